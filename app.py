@@ -1,27 +1,107 @@
-from flask import Flask, request, jsonify, render_template, url_for
+from flask import Flask, request, jsonify, render_template, url_for, Response, stream_with_context, send_file
+import json
+import logging
 import os
 import tempfile
+import threading
+import uuid
+from celery import group
+from celery.result import GroupResult
+from werkzeug.datastructures import CombinedMultiDict
 import torch  # To check for GPU
-from whisper_wrapper import transcribe_audio, load_whisper_model, to_srt, to_vtt, to_tsv
-from celery_worker_app import transcribe_audio_task
+from whisper_wrapper import format_transcription_result
+from celery_worker_app import transcribe_audio_task, transcribe_long_audio_task, routed_queues, autoscale_snapshot
+from result_cache import result_cache, new_audio_hasher, make_cache_key, RESULT_CACHE_ENABLED
+from audio_ingest import ingest_multipart_audio, probe_audio, probe_duration, IngestError
+from audio_store import audio_store, AUDIO_STORE_ENABLED
+from render_cache import render_cache, RENDER_CACHE_ENABLED
+from compact_result import pack_result, unpack_result
+from task_events import subscribe_task_events, get_partial_segments, TASK_EVENTS_ENABLED, TERMINAL_STATES
+from vad import VAD_DETECTORS, VAD_DEFAULT_DETECTOR
+from whisper_wrapper import PCM_SUFFIX
+from metrics import (stage_timer, metrics_payload, UPLOAD_BYTES, UPLOADS, SUBMISSIONS, SYNC_FALLBACKS,
+                     FAIR_SHARE_DECISIONS, LANE_DISPATCHES)
+from sync_path import sync_transcriber, SYNC_MODE_DEFAULT, SYNC_MODES
+from scheduling import (LANES, LANE_PRIORITIES, CLIENT_ID_HEADER, fair_share, choose_lane, lane_needs_duration, lane_stats,
+                        redis_configured)
+from batch_jobs import (BatchError, BATCH_MAX_FILES, BATCH_OUTPUT_FORMATS, resolve_manifest_path, stage_server_file,
+                        save_batch, load_batch, fetch_task_metas, summarize_batch, iter_batch_ndjson, build_batch_zip)
+
+# Module loggers (whisper_wrapper, result_cache, ...) log through the root logger
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+                    format='%(asctime)s %(levelname)s %(name)s: %(message)s')
 
 app = Flask(__name__)
 
 # Configuration
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'wav', 'mp3', 'm4a', 'ogg', 'flac', 'aac', 'opus'}
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # Bytes read per iteration while streaming an upload to disk
+# 'stream' makes streaming ingestion (ffmpeg decode during upload) the default; '?ingest=stream' selects it per request
+STREAM_INGEST_DEFAULT = os.environ.get('WHISPER_INGEST_MODE', 'file')
+SSE_MAX_SECONDS = int(os.environ.get('TASK_EVENTS_SSE_MAX_SECONDS', '3600'))  # Clients reconnect after this
+# Open /events streams per process; each holds a worker thread here (the ASGI front end has its own limit)
+SSE_MAX_STREAMS = int(os.environ.get('TASK_EVENTS_MAX_STREAMS', '8'))
+_sse_slots = threading.BoundedSemaphore(SSE_MAX_STREAMS)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 300 * 1024 * 1024  # 300 MB
 
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
+sync_transcriber.warm_up()  # No-op unless WHISPER_SYNC_WORKERS > 0
+
 
 def allowed_file(filename):
     return '.' in filename and \
         filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def save_upload_with_hash(file_storage, destination_path):
+    """Streams the uploaded file to disk while hashing it; returns the hex digest of its bytes."""
+    hasher = new_audio_hasher()
+    bytes_received = 0
+    with open(destination_path, 'wb') as out_file:
+        while True:
+            chunk = file_storage.stream.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+            out_file.write(chunk)
+            bytes_received += len(chunk)
+    UPLOADS.labels('file').inc()
+    UPLOAD_BYTES.labels('file').inc(bytes_received)
+    return hasher.hexdigest()
+
+
+def request_client_id():
+    """Fair-share identity of the caller: the client ID header (set it in a trusted proxy), else the remote address."""
+    return request.headers.get(CLIENT_ID_HEADER) or request.remote_addr or 'anonymous'
+
+
+def lookup_cached_task(cache_key, counted=False):
+    """
+    Returns a task_id that already answers this cache key, or None.
+    A finished result is written to the result backend under a fresh task_id so /status
+    serves it exactly like a worker result; an in-flight task is shared as-is.
+    counted: the submission's cache lookup was already counted (sync path fallback).
+    """
+    cached_result = result_cache.get(cache_key, count=not counted)
+    if cached_result is not None:
+        task_id = str(uuid.uuid4())
+        transcribe_audio_task.backend.store_result(task_id, pack_result(cached_result), 'SUCCESS')
+        SUBMISSIONS.labels('cache_hit').inc()
+        return task_id
+
+    inflight_task_id = result_cache.get_inflight(cache_key)
+    if inflight_task_id is not None:
+        if transcribe_audio_task.AsyncResult(inflight_task_id).state not in ('FAILURE', 'REVOKED'):
+            SUBMISSIONS.labels('inflight').inc()
+            return inflight_task_id
+        result_cache.clear_inflight(cache_key)
+    return None
+
+
 @app.route('/')
 def index():
     gpu_available = torch.cuda.is_available()
@@ -35,6 +115,19 @@ def docs():
 
 @app.route('/transcribe', methods=['POST'])
 def transcribe_route(): # Kept original name
+    stream_ingest = request.args.get('ingest', STREAM_INGEST_DEFAULT) == 'stream'
+    # Reruns of stored audio: ?audio_id=... or an audio_id form field instead of a file (audio_store.py)
+    audio_id = request.args.get('audio_id')
+    if audio_id is None and not (stream_ingest and request.mimetype == 'multipart/form-data') \
+            and 'audio_file' not in request.files:
+        audio_id = request.form.get('audio_id')
+    if audio_id:
+        # Reruns may send their options in the query string too (form fields win)
+        return transcribe_stored_audio(audio_id, CombinedMultiDict([request.form, request.args]))
+
+    if stream_ingest:
+        return transcribe_streamed_upload()
+
     if 'audio_file' not in request.files:
         return jsonify({"error": "No audio_file part in the request"}), 400
 
@@ -47,67 +140,303 @@ def transcribe_route(): # Kept original name
         _, temp_ext = os.path.splitext(file.filename)
         # The temporary file is saved. Celery task will be responsible for deleting it.
         temp_file_handler = tempfile.NamedTemporaryFile(delete=False, dir=app.config['UPLOAD_FOLDER'], suffix=temp_ext)
-        file.save(temp_file_handler.name)
         temp_file_path = temp_file_handler.name
         temp_file_handler.close()
+        with stage_timer('ingest'):
+            audio_digest = save_upload_with_hash(file, temp_file_path)
+        return submit_transcription(temp_file_path, audio_digest, request.form)
+    else:
+        return jsonify({"error": "File type not allowed"}), 400
 
+
+def transcribe_stored_audio(audio_id, form):
+    """Starts a transcription of audio kept in the audio store, without a new upload."""
+    if not AUDIO_STORE_ENABLED:
+        return jsonify({"error": "The audio store is disabled; upload the audio_file instead"}), 400
+    if not audio_store.valid_id(audio_id):
+        return jsonify({"error": "Invalid audio_id"}), 400
+    temp_file_path = audio_store.checkout(audio_id, app.config['UPLOAD_FOLDER'])
+    if temp_file_path is None:
+        return jsonify({"error": f"Unknown or expired audio_id '{audio_id}'; upload the audio_file again"}), 404
+    metadata = audio_store.metadata(audio_id) or {}
+    app.logger.info(f"API Request: rerun of stored audio {audio_id}")
+    return submit_transcription(temp_file_path, audio_id, form, duration=metadata.get('duration'))
+
+
+def probe_upload(temp_file_path, audio_digest, duration=None, probe=True):
+    """
+    Duration of an upload. With the audio store the upload is kept for reruns, and its probed
+    metadata is stored with it, so a rerun of the same audio skips ffprobe.
+    probe: run ffprobe if the duration is not known yet (else None is returned for it).
+    """
+    if not AUDIO_STORE_ENABLED:
+        return duration if duration is not None or not probe else probe_duration(temp_file_path)
+    stored = audio_store.metadata(audio_digest) or {}
+    probed = {}
+    if stored.get('duration') is None:
+        if duration is not None:
+            probed = {"duration": duration}
+        elif probe:
+            probed = probe_audio(temp_file_path) or {}
+    audio_store.add_upload(audio_digest, temp_file_path, **probed)
+    return probed.get('duration', stored.get('duration'))
+
+
+def transcribe_streamed_upload():
+    """
+    Streaming ingestion: the multipart body is parsed incrementally and the audio part is piped
+    straight into ffmpeg, which writes 16 kHz mono float32 PCM for the worker. Neither the raw
+    upload nor the decoded audio is held in memory, and the worker does not decode again.
+    """
+    temp_file_handler = tempfile.NamedTemporaryFile(delete=False, dir=app.config['UPLOAD_FOLDER'], suffix=PCM_SUFFIX)
+    pcm_path = temp_file_handler.name
+    temp_file_handler.close()
+    try:
+        with stage_timer('ingest'):
+            upload = ingest_multipart_audio(request.stream, request.content_type, pcm_path,
+                                            file_field='audio_file', is_allowed=allowed_file)
+    except IngestError as e:
+        os.remove(pcm_path)
+        return jsonify({"error": str(e)}), e.status_code
+    except Exception as e:
+        app.logger.error(f"Error ingesting streamed upload: {e}")
+        os.remove(pcm_path)
+        return jsonify({"error": f"Failed to ingest audio: {str(e)}"}), 500
+
+    UPLOADS.labels('stream').inc()
+    UPLOAD_BYTES.labels('stream').inc(upload.bytes_received)
+    app.logger.info(f"API Request: streamed {upload.bytes_received} bytes into {upload.duration:.1f}s of PCM at {pcm_path}")
+    return submit_transcription(pcm_path, upload.digest, upload.form, duration=upload.duration)
+
+
+def parse_decode_options(form):
+    """Decode options of a transcription request (keyword arguments of the Celery tasks, plus 'chunked')."""
+    model_name = form.get('model_name', 'base')
+    task_type = form.get('task', 'transcribe') # Parameter for Celery task
+    language = form.get('language')
+    if language == "": language = None
+
+    initial_prompt = form.get('initial_prompt')
+    if initial_prompt == "": initial_prompt = None
+
+    word_timestamps = form.get('word_timestamps', 'false').lower() in ['true', 'on', '1']
+    chunked = form.get('chunked', 'false').lower() in ['true', 'on', '1']
+
+    # vad: 'true'/'on' selects the default detector, any other non-false value names a detector
+    vad_form = form.get('vad', 'false').strip().lower()
+    vad = None
+    if vad_form in ['true', 'on', '1']: vad = VAD_DEFAULT_DETECTOR
+    elif vad_form not in ['false', 'off', '0', '']: vad = vad_form
+    if vad is not None and vad not in VAD_DETECTORS:
+        raise ValueError(f"Unknown VAD detector '{vad}'. Available: {', '.join(sorted(VAD_DETECTORS))}")
+
+    # speculative: greedy decoding with a draft model (speculative.py); unset follows WHISPER_SPECULATIVE
+    speculative_form = form.get('speculative', '').strip().lower()
+    speculative = None if speculative_form == '' else speculative_form in ['true', 'on', '1']
+
+    verbose_form = form.get('verbose_output', 'default')
+    verbose_param = None
+    if verbose_form == 'true': verbose_param = True
+    elif verbose_form == 'false': verbose_param = False
+
+    temperature_str = form.get('temperature', '0.0')
+    best_of_str = form.get('best_of', '5')
+    temperature = float(temperature_str) if temperature_str else 0.0
+    best_of = int(best_of_str) if best_of_str else 5
+
+    return {"model_name": model_name, "task_type": task_type, "language": language, "initial_prompt": initial_prompt,
+            "temperature": temperature, "best_of": best_of, "word_timestamps": word_timestamps,
+            "verbose": verbose_param, "vad": vad, "chunked": chunked, "speculative": speculative}
+
+
+def transcribe_synchronously(temp_file_path, cache_key, form, decode_options):
+    """
+    Sync fast path: answers with the formatted result (same shape as /status) instead of a task id.
+    Returns None when the in-process pool is saturated; the upload is then left for the Celery path.
+    """
+    output_format = request.args.get('output_format', form.get('output_format', 'json'))
+    simplified = request.args.get('simplified_output', form.get('simplified_output', 'false')).lower() in ['true', 'on', '1']
+
+    result = result_cache.get(cache_key) if cache_key is not None else None
+    cached = result is not None
+    if result is None:
+        result = sync_transcriber.run(audio_path=temp_file_path, **decode_options)
+        if result is None:
+            return None
+        if cache_key is not None:
+            result_cache.put(cache_key, result)
+    SUBMISSIONS.labels('cache_hit' if cached else 'sync').inc()
+    os.remove(temp_file_path)
+
+    if "error" in result:
+        return jsonify({"status": "FAILURE", "mode": "sync", "result": None, "error_info": result["error"]}), 500
+    return jsonify({
+        "status": "SUCCESS",
+        "mode": "sync",
+        "cached": cached,
+        "audio_id": decode_options.get("audio_id"),
+        "result": format_transcription_result(result, output_format, simplified),
+        "error_info": None
+    }), 200
+
+
+def submit_transcription(temp_file_path, audio_digest, form, duration=None):
+    """
+    Parses the transcription options from the form and answers synchronously (short clips, see
+    sync_path.py), from the cache, or by dispatching a Celery task.
+    duration: length of the audio in seconds if already known (streamed ingestion), else probed on demand.
+    """
+    try:
         try:
-            model_name = request.form.get('model_name', 'base')
-            task_type = request.form.get('task', 'transcribe') # Parameter for Celery task
-            language = request.form.get('language')
-            if language == "": language = None
-
-            initial_prompt = request.form.get('initial_prompt')
-            if initial_prompt == "": initial_prompt = None
-
-            word_timestamps = request.form.get('word_timestamps', 'false').lower() in ['true', 'on', '1']
-
-            verbose_form = request.form.get('verbose_output', 'default')
-            verbose_param = None
-            if verbose_form == 'true': verbose_param = True
-            elif verbose_form == 'false': verbose_param = False
-
-            temperature_str = request.form.get('temperature', '0.0')
-            best_of_str = request.form.get('best_of', '5')
-            temperature = float(temperature_str) if temperature_str else 0.0
-            best_of = int(best_of_str) if best_of_str else 5
-
-            print(f"API Request (to Celery): model='{model_name}', task='{task_type}', lang='{language}' for file {temp_file_path}")
-
-            # Dispatch the task to Celery
-            task_run = transcribe_audio_task.delay(
-                audio_path=temp_file_path,
-                model_name=model_name,
-                task_type=task_type,
-                language=language,
-                initial_prompt=initial_prompt,
-                temperature=temperature,
-                best_of=best_of,
-                word_timestamps=word_timestamps,
-                verbose=verbose_param
-            )
-
-            return jsonify({
-                "message": "Transcription task submitted successfully.",
-                "task_id": task_run.id,
-                "status_url": url_for('get_task_status', task_id=task_run.id, _external=True),
-                "ui_status_url": url_for('index', task_id=task_run.id, _external=False)
-            }), 202
-
-        except Exception as e:
-            app.logger.error(f"Error submitting task to Celery: {e}")
-            # Clean up the temp file if task submission failed
-            if os.path.exists(temp_file_path):
-                try:
-                    os.remove(temp_file_path)
-                except Exception as e_del:
-                    app.logger.error(f"Error deleting orphaned temp file {temp_file_path}: {e_del}")
-            return jsonify({"error": f"Failed to submit task: {str(e)}"}), 500
+            options = parse_decode_options(form)
+        except ValueError as e:
+            os.remove(temp_file_path)
+            return jsonify({"error": str(e)}), 400
+        model_name, task_type, language = options["model_name"], options["task_type"], options["language"]
+        initial_prompt, temperature, best_of = options["initial_prompt"], options["temperature"], options["best_of"]
+        word_timestamps, chunked, vad = options["word_timestamps"], options["chunked"], options["vad"]
+        verbose_param, speculative = options["verbose"], options["speculative"]
+
+        # mode: 'sync' waits for the result in this response, 'auto' does so for short clips, 'async' never
+        mode = (request.args.get('mode') or form.get('mode') or SYNC_MODE_DEFAULT).strip().lower()
+        if mode not in SYNC_MODES:
+            os.remove(temp_file_path)
+            return jsonify({"error": f"Unknown mode '{mode}'. Available: {', '.join(SYNC_MODES)}"}), 400
+
+        # priority: lane requested by the client (see scheduling.py); the audio duration caps it
+        requested_lane = (request.args.get('priority') or form.get('priority') or '').strip().lower() or None
+        if requested_lane is not None and requested_lane not in LANES:
+            os.remove(temp_file_path)
+            return jsonify({"error": f"Unknown priority '{requested_lane}'. Available: {', '.join(LANES)}"}), 400
+
+        # Lane, fair-share charge and sync eligibility depend on the duration; ffprobe only runs when
+        # one of them needs it (a clip the sync path would turn down anyway reports 'unknown_duration' only
+        # once its other checks passed)
+        needs_duration = fair_share.enabled or lane_needs_duration(requested_lane) or (
+            mode != 'async' and sync_transcriber.fallback_reason(model_name, None, chunked) == 'unknown_duration')
+        duration = probe_upload(temp_file_path, audio_digest, duration, probe=needs_duration)
+        audio_id = audio_digest if AUDIO_STORE_ENABLED else None
+        client_id = request_client_id()
+        admission = fair_share.admit(client_id, duration)
+        if fair_share.enabled:
+            FAIR_SHARE_DECISIONS.labels(admission.decision).inc()
+        if admission.rejected:
+            os.remove(temp_file_path)
+            app.logger.info(f"API Request: client '{client_id}' is over its fair share, retry in {admission.retry_after}s")
+            response = jsonify({"error": "Audio-seconds budget exhausted for this client.",
+                                "retry_after": admission.retry_after})
+            response.headers['Retry-After'] = str(admission.retry_after)
+            return response, 429
+        lane = choose_lane(requested_lane, duration, demoted=admission.demoted)
+
+        cache_key = None
+        if RESULT_CACHE_ENABLED:
+            cache_key = make_cache_key(audio_digest, options)
+
+        sync_fallback = None
+        if mode != 'async':
+            sync_fallback = sync_transcriber.fallback_reason(model_name, duration, chunked)
+            if sync_fallback is None:
+                sync_response = transcribe_synchronously(temp_file_path, cache_key, form, dict(
+                    model_name=model_name, task=task_type, language=language, initial_prompt=initial_prompt,
+                    temperature=temperature, best_of=best_of, word_timestamps=word_timestamps,
+                    verbose=verbose_param, vad=vad, audio_id=audio_id, speculative=speculative))
+                if sync_response is not None:
+                    return sync_response
+                sync_fallback = 'saturated'
+            SYNC_FALLBACKS.labels(sync_fallback).inc()
+            app.logger.info(f"API Request: not transcribing synchronously ({sync_fallback}), dispatching to Celery")
+
+        if cache_key is not None:
+            # A sync attempt that found the pool saturated has already looked the key up (and missed)
+            cached_task_id = lookup_cached_task(cache_key, counted=sync_fallback == 'saturated')
+            if cached_task_id is not None:
+                app.logger.info(f"API Request: cache hit for {cache_key}, answering with task {cached_task_id}")
+                os.remove(temp_file_path)  # No worker will consume this upload
+                fair_share.refund(admission, client_id)  # Nothing to decode
+                return jsonify({
+                    "message": "Transcription task submitted successfully.",
+                    "task_id": cached_task_id,
+                    "cached": True,
+                    "status_url": url_for('get_task_status', task_id=cached_task_id, _external=True),
+                    "events_url": url_for('task_events_stream', task_id=cached_task_id, _external=True),
+                    "ui_status_url": url_for('index', task_id=cached_task_id, _external=False),
+                    "sync_fallback": sync_fallback,
+                    "audio_id": audio_id
+                }), 202
+
+        app.logger.info(f"API Request (to Celery): model='{model_name}', task='{task_type}', lang='{language}', lane='{lane}' for file {temp_file_path}")
+
+        # Dispatch the task to Celery (long recordings can opt into parallel chunked decoding)
+        celery_task = transcribe_long_audio_task if chunked else transcribe_audio_task
+        task_run = celery_task.apply_async(kwargs=dict(
+            audio_path=temp_file_path,
+            model_name=model_name,
+            task_type=task_type,
+            language=language,
+            initial_prompt=initial_prompt,
+            temperature=temperature,
+            best_of=best_of,
+            word_timestamps=word_timestamps,
+            verbose=verbose_param,
+            cache_key=cache_key,
+            vad=vad,
+            audio_id=audio_id,
+            speculative=speculative
+        ), priority=LANE_PRIORITIES[lane])
+        if cache_key is not None:
+            result_cache.set_inflight(cache_key, task_run.id)
+        SUBMISSIONS.labels('dispatched').inc()
+        LANE_DISPATCHES.labels(lane).inc()
+
+        return jsonify({
+            "message": "Transcription task submitted successfully.",
+            "task_id": task_run.id,
+            "cached": False,
+            "priority": lane,
+            "status_url": url_for('get_task_status', task_id=task_run.id, _external=True),
+            "events_url": url_for('task_events_stream', task_id=task_run.id, _external=True),
+            "ui_status_url": url_for('index', task_id=task_run.id, _external=False),
+            "sync_fallback": sync_fallback,  # Why a sync/auto request was queued instead
+            "audio_id": audio_id  # Reference for reruns without a new upload (audio store only)
+        }), 202
+
+    except Exception as e:
+        app.logger.error(f"Error submitting task to Celery: {e}")
+        # Clean up the temp file if task submission failed
+        if os.path.exists(temp_file_path):
+            try:
+                os.remove(temp_file_path)
+            except Exception as e_del:
+                app.logger.error(f"Error deleting orphaned temp file {temp_file_path}: {e_del}")
+        return jsonify({"error": f"Failed to submit task: {str(e)}"}), 500
+
+def rendered_status_response(rendered):
+    """Serves a cached /status body: 304 on a matching ETag, gzip bytes as-is when the client accepts them."""
+    etag = f'"{rendered.etag}"'
+    if request.if_none_match.contains(rendered.etag):
+        response = Response(status=304)
+    elif 'gzip' in request.accept_encodings:
+        response = Response(rendered.compressed_body, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
     else:
-        return jsonify({"error": "File type not allowed"}), 400
+        response = Response(rendered.body(), mimetype='application/json')
+    response.headers['ETag'] = etag
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
 
 @app.route('/status/<task_id>', methods=['GET'])
 def get_task_status(task_id):
+    # Apply formatting based on original request parameters (could be passed or re-queried)
+    output_format_preference = request.args.get('output_format', 'json')
+    simplified_output_mode = request.args.get('simplified_output', 'false').lower() in ['true', 'on', '1']
+
+    if RENDER_CACHE_ENABLED:
+        rendered = render_cache.get(task_id, output_format_preference, simplified_output_mode)
+        if rendered is not None:  # Finished and already rendered: no result backend read, no formatting
+            return rendered_status_response(rendered)
+
     task = transcribe_audio_task.AsyncResult(task_id)
     response_data = {
         "task_id": task_id,
@@ -117,48 +446,329 @@ def get_task_status(task_id):
     }
 
     if task.successful():
-        raw_result = task.result
-        # Apply formatting based on original request parameters (could be passed or re-queried)
-        output_format_preference = request.args.get('output_format', 'json')
-        simplified_output_mode = request.args.get('simplified_output', 'false').lower() in ['true', 'on', '1']
-
-        # Re-use your formatting logic here (simplified example)
-        formatted_output = None
-        if raw_result and ("text" in raw_result or "segments" in raw_result):
-            if output_format_preference == 'txt':
-                formatted_output = raw_result.get("text", "")
-            elif output_format_preference == 'srt' and "segments" in raw_result:
-                formatted_output = to_srt(raw_result["segments"], as_dict=simplified_output_mode)
-            elif output_format_preference == 'vtt' and "segments" in raw_result:
-                formatted_output = to_vtt(raw_result["segments"], as_dict=simplified_output_mode)
-            elif output_format_preference == 'tsv' and "segments" in raw_result:
-                formatted_output = to_tsv(raw_result["segments"])
-            elif output_format_preference == 'json':
-                if simplified_output_mode:
-                    formatted_output = raw_result.get("text", "")
-                else: # Full JSON for non-simplified
-                    response_data["result"] = {"transcription_details": raw_result} # Set directly
-                    return jsonify(response_data) # Early return for this specific case
-            else:
-                formatted_output = raw_result # Fallback to raw result
-
-        if simplified_output_mode and output_format_preference != 'json': # JSON simplified is handled
-             response_data["result"] = {"formatted_output": formatted_output}
-        elif not simplified_output_mode and output_format_preference != 'json': # Full output
-             response_data["result"] = {"transcription_details": raw_result, "formatted_output": formatted_output}
-        elif simplified_output_mode and output_format_preference == 'json':
-             response_data["result"] = {"formatted_output": formatted_output}
-
+        raw_result = unpack_result(task.result)  # Compact results are decoded only here, on demand
+        if RESULT_CACHE_ENABLED:
+            result_cache.remember_task_result(task_id, raw_result)
+        if RENDER_CACHE_ENABLED:
+            return rendered_status_response(
+                render_cache.render(task_id, raw_result, output_format_preference, simplified_output_mode))
+        response_data["result"] = format_transcription_result(raw_result, output_format_preference, simplified_output_mode)
+
+    elif task.state == 'PROGRESS':
+        # Partial transcript: segments decoded so far. ?since=N returns only segments after the first N,
+        # numbered so that SRT/VTT/TSV output can be appended to what the client already rendered.
+        progress_info = task.info if isinstance(task.info, dict) else {}
+        since = max(0, request.args.get('since', 0, type=int))
+        partial_segments = get_partial_segments(task_id, start=since)
+        partial_result = {"text": "".join(segment["text"] for segment in partial_segments), "segments": partial_segments}
+        response_data["progress"] = progress_info.get("progress", 0.0)
+        response_data["partial"] = True
+        response_data["segments_done"] = since + len(partial_segments)
+        response_data["result"] = format_transcription_result(partial_result, output_format_preference,
+                                                              simplified_output_mode, start_index=since)
 
     elif task.failed():
         response_data["error_info"] = str(task.info) # .info contains the exception
+        if RESULT_CACHE_ENABLED:
+            result_cache.forget_failed_task(task_id)  # Let the next upload retry the decode
         # The Celery task should have already tried to delete the temp file on failure
 
     return jsonify(response_data)
 
 
+@app.route('/events/<task_id>', methods=['GET'])
+def task_events_stream(task_id):
+    """
+    Server-Sent Events stream of a task's state changes (STARTED, PROGRESS, SUCCESS, FAILURE),
+    pushed by the workers through Redis pub/sub. Clients fetch /status once the task is finished.
+    A stream blocks its worker thread, so at most TASK_EVENTS_MAX_STREAMS are open per process;
+    beyond that clients get 503 and poll instead.
+    """
+    if not TASK_EVENTS_ENABLED:
+        return jsonify({"error": "Task events are disabled; poll the status_url instead"}), 404
+    if not _sse_slots.acquire(blocking=False):
+        response = jsonify({"error": "Too many open event streams; poll the status_url instead"})
+        response.headers['Retry-After'] = '30'
+        return response, 503
+
+    def format_sse(event):
+        return f"event: {event['state'].lower()}\ndata: {json.dumps(event)}\n\n"
+
+    def generate():
+        yield "retry: 5000\n\n"
+        saw_event = False
+        for event in subscribe_task_events(task_id, max_seconds=SSE_MAX_SECONDS):
+            if event is None:
+                if not saw_event:
+                    # Nothing published yet: the task may have finished before events existed for it
+                    # (e.g. a result-cache hit), so consult the result backend once per idle period.
+                    state = transcribe_audio_task.AsyncResult(task_id).state
+                    if state in TERMINAL_STATES:
+                        yield format_sse({"task_id": task_id, "state": state})
+                        return
+                yield ": keepalive\n\n"
+                continue
+            saw_event = True
+            yield format_sse(event)
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(_sse_slots.release)  # Also when the client disconnects
+    return response
+
+
+def stage_batch_members():
+    """
+    Saves the files of a /batch request into the upload folder: `audio_file` parts, the paths of a
+    `manifest` (form field with one path per line, or `paths` in a JSON body) and stored `audio_id`s.
+    Returns (options_form, [(name, temp_file_path, audio_digest), ...]); raises BatchError.
+    """
+    payload = request.get_json(silent=True) if request.is_json else None
+    if payload is not None:
+        if not isinstance(payload, dict) or not isinstance(payload.get('paths', []), list) \
+                or not isinstance(payload.get('audio_ids', []), list):
+            raise BatchError("JSON body must be an object with a 'paths' and/or 'audio_ids' list")
+        paths = [str(path) for path in payload.get('paths', [])]
+        audio_ids = [str(audio_id) for audio_id in payload.get('audio_ids', [])]
+        # Options arrive as JSON values; parse_decode_options expects form strings
+        form = {name: ('true' if value is True else 'false' if value is False else str(value))
+                for name, value in payload.items() if name not in ('paths', 'audio_ids') and value is not None}
+    else:
+        form = request.form
+        paths = [line.strip() for line in form.get('manifest', '').splitlines() if line.strip()]
+        audio_ids = [audio_id.strip() for audio_id in form.getlist('audio_id') if audio_id.strip()]
+
+    uploads = [f for f in request.files.getlist('audio_file') if f.filename]
+    if not uploads and not paths and not audio_ids:
+        raise BatchError("No audio_file parts, manifest paths or audio_ids in the request")
+    if audio_ids and not AUDIO_STORE_ENABLED:
+        raise BatchError("The audio store is disabled; audio_ids can't be used")
+    for audio_id in audio_ids:
+        if not audio_store.contains(audio_id):
+            raise BatchError(f"Unknown or expired audio_id '{audio_id}'")
+    if len(uploads) + len(paths) + len(audio_ids) > BATCH_MAX_FILES:
+        raise BatchError(f"Too many files in one batch (limit {BATCH_MAX_FILES})")
+    for file in uploads:
+        if not allowed_file(file.filename):
+            raise BatchError(f"File type not allowed: {file.filename}")
+    resolved_paths = [resolve_manifest_path(path) for path in paths]
+    for path in paths:
+        if not allowed_file(path):
+            raise BatchError(f"File type not allowed: {path}")
+
+    staged = []
+    try:
+        with stage_timer('ingest'):
+            for file in uploads:
+                _, temp_ext = os.path.splitext(file.filename)
+                temp_file_handler = tempfile.NamedTemporaryFile(delete=False, dir=app.config['UPLOAD_FOLDER'], suffix=temp_ext)
+                temp_file_handler.close()
+                staged.append((file.filename, temp_file_handler.name, save_upload_with_hash(file, temp_file_handler.name)))
+            for path, resolved in zip(paths, resolved_paths):
+                staged_path, digest = stage_server_file(resolved, app.config['UPLOAD_FOLDER'])
+                staged.append((path, staged_path, digest))
+            for audio_id in audio_ids:
+                staged_path = audio_store.checkout(audio_id, app.config['UPLOAD_FOLDER'])
+                if staged_path is None:
+                    raise BatchError(f"Unknown or expired audio_id '{audio_id}'")
+                staged.append((audio_id, staged_path, audio_id))
+        for _, temp_file_path, audio_digest in staged:
+            audio_store.add_upload(audio_digest, temp_file_path)  # No-op without the audio store
+    except Exception:
+        for _, temp_file_path, _ in staged:
+            os.remove(temp_file_path)
+        raise
+    return form, staged
+
+
+@app.route('/batch', methods=['POST'])
+def submit_batch():
+    """
+    Submits many files at once as a Celery group and answers with a batch ID.
+    Every file is decoded with the same options; cache hits and in-flight duplicates are shared
+    exactly like on /transcribe, so only new audio reaches the workers. Each new file is charged to
+    the client's fair share; files past the allowed debt are rejected (429 if none is left).
+    """
+    try:
+        form, staged = stage_batch_members()
+    except BatchError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        options = parse_decode_options(form)
+    except ValueError as e:
+        for _, temp_file_path, _ in staged:
+            os.remove(temp_file_path)
+        return jsonify({"error": str(e)}), 400
+
+    # Batches default to the bulk lane and may ask for 'default' at most
+    requested_lane = (request.args.get('priority') or form.get('priority') or 'bulk').strip().lower()
+    if requested_lane not in LANES:
+        for _, temp_file_path, _ in staged:
+            os.remove(temp_file_path)
+        return jsonify({"error": f"Unknown priority '{requested_lane}'. Available: {', '.join(LANES)}"}), 400
+    lane = max(requested_lane, 'default', key=LANES.index)
+
+    celery_task = transcribe_long_audio_task if options["chunked"] else transcribe_audio_task
+    task_kwargs = {name: options[name] for name in ('model_name', 'task_type', 'language', 'initial_prompt',
+                                                    'temperature', 'best_of', 'word_timestamps', 'verbose', 'vad',
+                                                    'speculative')}
+    client_id = request_client_id()
+    members, rejected, signatures, new_keys = [], [], [], {}
+    lane_counts = {}
+    dispatched = False
+    try:
+        for name, temp_file_path, audio_digest in staged:
+            cache_key = make_cache_key(audio_digest, options) if RESULT_CACHE_ENABLED else None
+            task_id = None
+            if cache_key is not None:
+                task_id = new_keys.get(cache_key) or lookup_cached_task(cache_key)  # Same audio twice in a batch
+            member_lane = lane
+            if task_id is not None:
+                os.remove(temp_file_path)  # No worker will consume this upload
+            else:
+                # Every member that needs decoding is charged to the client's fair-share bucket like a
+                # /transcribe submission: over budget it is demoted to bulk, past the debt it is left out
+                duration = probe_upload(temp_file_path, audio_digest,
+                                        probe=fair_share.enabled or lane_needs_duration(lane))
+                admission = fair_share.admit(client_id, duration)
+                if fair_share.enabled:
+                    FAIR_SHARE_DECISIONS.labels(admission.decision).inc()
+                if admission.rejected:
+                    os.remove(temp_file_path)
+                    rejected.append({"name": name, "retry_after": admission.retry_after})
+                    continue
+                member_lane = choose_lane(lane, duration, demoted=admission.demoted)
+                task_id = str(uuid.uuid4())
+                signatures.append(celery_task.signature(
+                    kwargs=dict(audio_path=temp_file_path, cache_key=cache_key,
+                                audio_id=audio_digest if AUDIO_STORE_ENABLED else None, **task_kwargs), task_id=task_id,
+                    priority=LANE_PRIORITIES[member_lane]))
+                lane_counts[member_lane] = lane_counts.get(member_lane, 0) + 1
+                if cache_key is not None:
+                    new_keys[cache_key] = task_id
+            members.append({"task_id": task_id, "name": name, "audio_id": audio_digest if AUDIO_STORE_ENABLED else None,
+                            "priority": member_lane})
+
+        if rejected and not members:
+            retry_after = min(member["retry_after"] for member in rejected)
+            app.logger.info(f"API Request: client '{client_id}' is over its fair share, batch rejected, retry in {retry_after}s")
+            response = jsonify({"error": "Audio-seconds budget exhausted for this client.",
+                                "retry_after": retry_after, "rejected": rejected})
+            response.headers['Retry-After'] = str(retry_after)
+            return response, 429
+        if signatures:
+            group(signatures).apply_async()
+        dispatched = True  # From here on the workers own (and delete) the staged files
+        for cache_key, task_id in new_keys.items():
+            result_cache.set_inflight(cache_key, task_id)
+        SUBMISSIONS.labels('dispatched').inc(len(signatures))
+        for member_lane, count in lane_counts.items():
+            LANE_DISPATCHES.labels(member_lane).inc(count)
+
+        batch_id = str(uuid.uuid4())
+        backend = transcribe_audio_task.backend
+        GroupResult(batch_id, [transcribe_audio_task.AsyncResult(m["task_id"]) for m in members],
+                    backend=backend).save()
+        save_batch(backend, batch_id, members, {k: v for k, v in options.items() if k != 'verbose'})
+    except Exception as e:
+        app.logger.error(f"Error submitting batch to Celery: {e}")
+        if not dispatched:
+            for _, temp_file_path, _ in staged:
+                if os.path.exists(temp_file_path):
+                    os.remove(temp_file_path)
+        return jsonify({"error": f"Failed to submit batch: {str(e)}"}), 500
+
+    app.logger.info(f"API Request: batch {batch_id} with {len(members)} files, {len(signatures)} dispatched to Celery")
+    return jsonify({
+        "message": "Batch submitted successfully.",
+        "batch_id": batch_id,
+        "total": len(members),
+        "dispatched": len(signatures),
+        "priority": lane,
+        "members": [{"index": index, **member} for index, member in enumerate(members)],
+        "rejected": rejected,
+        "status_url": url_for('get_batch_status', batch_id=batch_id, _external=True),
+    }), 202
+
+
+@app.route('/batch/<batch_id>/status', methods=['GET'])
+def get_batch_status(batch_id):
+    """
+    Aggregate state of a batch, read with one multi-get for all members.
+    ?output=ndjson streams the finished members' results (same `result` as /status), ?output=zip
+    returns the successful transcripts as files (output_format: srt, vtt, tsv, txt or json).
+    """
+    backend = transcribe_audio_task.backend
+    batch = load_batch(backend, batch_id)
+    if batch is None:
+        return jsonify({"error": f"Unknown batch '{batch_id}'"}), 404
+
+    metas = fetch_task_metas(backend, [member["task_id"] for member in batch["members"]])
+    output = request.args.get('output', 'json')
+    if output == 'ndjson':
+        output_format = request.args.get('output_format', 'json')
+        simplified = request.args.get('simplified_output', 'false').lower() in ['true', 'on', '1']
+        return Response(stream_with_context(iter_batch_ndjson(batch, metas, output_format, simplified)),
+                        mimetype='application/x-ndjson')
+    if output == 'zip':
+        output_format = request.args.get('output_format', 'srt')
+        if output_format not in BATCH_OUTPUT_FORMATS:
+            return jsonify({"error": f"Unknown output_format '{output_format}'. Available: {', '.join(BATCH_OUTPUT_FORMATS)}"}), 400
+        return send_file(build_batch_zip(batch, metas, output_format), mimetype='application/zip',
+                         as_attachment=True, download_name=f"batch-{batch_id}-{output_format}.zip")
+    if output != 'json':
+        return jsonify({"error": f"Unknown output '{output}'. Available: json, ndjson, zip"}), 400
+    return jsonify(summarize_batch(batch, metas))
+
+
+@app.route('/queues', methods=['GET'])
+def queue_stats():
+    """Depth and estimated wait per priority lane of every transcription queue."""
+    try:
+        stats = lane_stats(routed_queues())
+    except Exception as e:
+        app.logger.error(f"Error reading queue depths: {e}")
+        return jsonify({"error": f"Failed to read queue depths: {str(e)}"}), 503
+    stats["lanes"] = list(LANES)
+    stats["fair_share"] = {"enabled": fair_share.enabled, "rate": fair_share.rate, "burst": fair_share.burst}
+    return jsonify(stats)
+
+
+@app.route('/autoscale', methods=['GET'])
+def autoscale_stats():
+    """Demand (queue depth, request mix) and supply (loaded models per worker process) per model."""
+    if not redis_configured():
+        return jsonify({"error": "Autoscaling signals need a Redis broker"}), 503
+    try:
+        return jsonify(autoscale_snapshot())
+    except Exception as e:
+        app.logger.error(f"Error building the autoscaling snapshot: {e}")
+        return jsonify({"error": f"Failed to build the autoscaling snapshot: {str(e)}"}), 503
+
+
+@app.route('/audio/<audio_id>', methods=['GET'])
+def stored_audio_info(audio_id):
+    """Metadata of stored audio (duration, sample_rate, channels, ...) and whether it is decoded already."""
+    info = audio_store.describe(audio_id) if AUDIO_STORE_ENABLED else None
+    if info is None:
+        return jsonify({"error": f"Unknown or expired audio_id '{audio_id}'"}), 404
+    return jsonify(info)
+
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify({"result_cache": result_cache.stats(), "render_cache": render_cache.stats(),
+                    "audio_store": audio_store.stats()})
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    body, content_type = metrics_payload()
+    return Response(body, mimetype=None, content_type=content_type)
+
+
 if __name__ == '__main__':
     # print("Pre-loading default 'base' Whisper model...")
     # load_whisper_model(model_name="base") moved to celery_worker_app
-    print("Starting Flask server...")
+    app.logger.info("Starting Flask server...")
     app.run(debug=True, host='0.0.0.0', port=5050)
\ No newline at end of file
@@ -0,0 +1,442 @@
+# asgi_app.py
+# Asyncio serving mode of the API for many slow clients on a few processes:
+#
+#   uvicorn asgi_app:app --host 0.0.0.0 --port 5050 --workers 2
+#
+# /transcribe, /status/<task_id>, /events/<task_id>, / and /docs are served natively. Uploads are
+# parsed as their bytes arrive, and disk or ffmpeg writes run in a thread pool. The result backend,
+# partial transcripts and the render cache are read through redis.asyncio clients with bounded
+# connection pools, and all /events streams of a process share one pub/sub connection. A waiting
+# client therefore costs a coroutine, not a worker thread. Submission (cache lookup, sync path,
+# Celery publish) reuses the Flask app's code in the thread pool, so response bodies are the same.
+# All other routes (/metrics, /cache/stats, ...) are served by the Flask app through a WSGI adapter.
+#
+# Requires `starlette` and `uvicorn` (and optionally `a2wsgi` as the WSGI adapter).
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from urllib.parse import parse_qsl
+
+import redis.asyncio as aioredis
+import torch
+from celery.backends.redis import RedisBackend
+from jinja2 import pass_context
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from starlette.staticfiles import StaticFiles
+from starlette.templating import Jinja2Templates
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import parse_accept_header, parse_etags
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:  # Starlette's adapter is deprecated but still works
+    from starlette.middleware.wsgi import WSGIMiddleware
+
+from app import (app as flask_app, allowed_file, submit_transcription, transcribe_stored_audio, STREAM_INGEST_DEFAULT,
+                 SSE_MAX_SECONDS)
+from audio_ingest import MultipartAudioReceiver, open_pcm_decoder, RawFileSink, IngestError, READ_CHUNK_SIZE
+from celery_worker_app import transcribe_audio_task, CELERY_RESULT_BACKEND
+from compact_result import unpack_result
+from metrics import stage_timer, UPLOAD_BYTES, UPLOADS
+from render_cache import render_cache, RenderedResponse, RENDER_CACHE_ENABLED, RENDER_CACHE_REDIS_URL
+from result_cache import result_cache, RESULT_CACHE_ENABLED
+from task_events import (TASK_EVENTS_ENABLED, TASK_EVENTS_REDIS_URL, CHANNEL_PREFIX, LAST_EVENT_PREFIX,
+                         PARTIAL_SEGMENTS_PREFIX, TERMINAL_STATES)
+from whisper_wrapper import format_transcription_result, PCM_SUFFIX
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Connections per Redis URL and process; callers beyond that wait up to REDIS_POOL_TIMEOUT seconds for one
+REDIS_POOL_SIZE = int(os.environ.get('WHISPER_ASGI_REDIS_POOL_SIZE', '50'))
+REDIS_POOL_TIMEOUT = float(os.environ.get('WHISPER_ASGI_REDIS_POOL_TIMEOUT', '5'))
+# /status?wait=N holds the request until the task finishes or N seconds (capped at this) pass
+STATUS_MAX_WAIT_SECONDS = float(os.environ.get('WHISPER_ASGI_STATUS_MAX_WAIT', '30'))
+STATUS_POLL_INTERVAL = 0.25
+SSE_KEEPALIVE_SECONDS = 15
+# Open /events streams per process; beyond this clients get 503 and poll /status instead
+SSE_MAX_STREAMS = int(os.environ.get('WHISPER_ASGI_MAX_EVENT_STREAMS', '1000'))
+_open_streams = 0
+
+_redis_clients = {}
+
+
+def get_async_redis(url):
+    """redis.asyncio client per URL, created lazily inside the serving event loop."""
+    client = _redis_clients.get(url)
+    if client is None:
+        pool = aioredis.BlockingConnectionPool.from_url(url, max_connections=REDIS_POOL_SIZE, timeout=REDIS_POOL_TIMEOUT)
+        client = _redis_clients[url] = aioredis.Redis(connection_pool=pool)
+    return client
+
+
+class TaskEventHub:
+    """
+    Fans task events out to the /events streams of this process over a single pub/sub connection
+    (redis-py would otherwise hold one pooled connection per subscribed client).
+    """
+
+    def __init__(self):
+        self._queues = {}  # channel -> set of asyncio.Queue of the streams following it
+        self._stale = set()  # Channels nobody follows any more, unsubscribed by the reader
+        self._pubsub = None
+        self._reader = None
+
+    async def listen(self, task_id):
+        channel = CHANNEL_PREFIX + task_id
+        queue = asyncio.Queue()
+        if self._pubsub is None:
+            self._pubsub = get_async_redis(TASK_EVENTS_REDIS_URL).pubsub(ignore_subscribe_messages=True)
+        self._stale.discard(channel)
+        subscribers = self._queues.setdefault(channel, set())
+        subscribers.add(queue)
+        if len(subscribers) == 1:
+            await self._pubsub.subscribe(channel)
+        if self._reader is None:
+            self._reader = asyncio.create_task(self._read())
+        return queue
+
+    def unlisten(self, task_id, queue):
+        # Synchronous so it also runs in a generator that is being cancelled (client went away)
+        channel = CHANNEL_PREFIX + task_id
+        subscribers = self._queues.get(channel)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._queues[channel]
+                self._stale.add(channel)
+
+    async def _read(self):
+        while True:
+            try:
+                if self._stale:
+                    stale, self._stale = self._stale, set()
+                    await self._pubsub.unsubscribe(*stale)
+                message = await self._pubsub.get_message(timeout=1.0)
+            except Exception as e:
+                logger.warning("Task event hub: pub/sub read failed: %s", e)
+                await asyncio.sleep(1.0)
+                continue
+            if message is None:
+                continue
+            channel = message["channel"].decode() if isinstance(message["channel"], bytes) else message["channel"]
+            event = json.loads(message["data"])
+            for queue in self._queues.get(channel, ()):
+                queue.put_nowait(event)
+
+    async def close(self):
+        if self._reader is not None:
+            self._reader.cancel()
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+
+
+event_hub = TaskEventHub()
+
+
+async def read_task_meta(task_id):
+    """The task's result backend entry as {"status", "result", ...}, read without blocking the event loop."""
+    backend = transcribe_audio_task.backend
+    if isinstance(backend, RedisBackend):
+        raw = await get_async_redis(CELERY_RESULT_BACKEND).get(backend.get_key_for_task(task_id))
+        # decode_result() turns a stored failure back into the exception, like AsyncResult.info
+        return backend.decode_result(raw) if raw is not None else {"status": "PENDING", "result": None}
+    task = transcribe_audio_task.AsyncResult(task_id)  # Other backends only have blocking clients
+    return await run_in_threadpool(lambda: {"status": task.state, "result": task.info})
+
+
+async def read_partial_segments(task_id, start=0):
+    if not TASK_EVENTS_ENABLED:
+        return []
+    try:
+        raw_segments = await get_async_redis(TASK_EVENTS_REDIS_URL).lrange(PARTIAL_SEGMENTS_PREFIX + task_id, start, -1)
+    except Exception as e:
+        logger.warning("Task events: failed to read partial segments for %s: %s", task_id, e)
+        return []
+    return [json.loads(raw) for raw in raw_segments]
+
+
+async def get_cached_render(task_id, output_format, simplified):
+    """render_cache.get() with the Redis tier read through the async client."""
+    key = render_cache.make_key(task_id, output_format, simplified)
+    payload = render_cache.local.get(key)
+    if payload is None and render_cache.redis is not None:
+        try:
+            payload = await get_async_redis(RENDER_CACHE_REDIS_URL).get(render_cache.redis.prefix + key)
+        except Exception as e:
+            logger.warning("Render cache: Redis get failed for %s: %s", key, e)
+        if payload is not None:
+            render_cache.local.set(key, payload)
+    if payload is None:
+        render_cache.misses += 1
+        return None
+    render_cache.hits += 1
+    return RenderedResponse.from_bytes(payload)
+
+
+def rendered_status_response(request, rendered):
+    """Same as the Flask app's: 304 on a matching ETag, gzip bytes as-is when the client accepts them."""
+    headers = {'ETag': f'"{rendered.etag}"', 'Vary': 'Accept-Encoding'}
+    if parse_etags(request.headers.get('if-none-match')).contains(rendered.etag):
+        return Response(status_code=304, headers=headers)
+    if 'gzip' in parse_accept_header(request.headers.get('accept-encoding')):
+        headers['Content-Encoding'] = 'gzip'
+        return Response(rendered.compressed_body, media_type='application/json', headers=headers)
+    return Response(rendered.body(), media_type='application/json', headers=headers)
+
+
+def query_number(request, name, default, cast=float):
+    try:
+        return cast(request.query_params.get(name, default))
+    except ValueError:
+        return default
+
+
+async def get_task_status(request):
+    task_id = request.path_params['task_id']
+    output_format_preference = request.query_params.get('output_format', 'json')
+    simplified_output_mode = request.query_params.get('simplified_output', 'false').lower() in ['true', 'on', '1']
+    wait_seconds = min(max(0.0, query_number(request, 'wait', 0.0)), STATUS_MAX_WAIT_SECONDS)
+
+    if RENDER_CACHE_ENABLED:
+        rendered = await get_cached_render(task_id, output_format_preference, simplified_output_mode)
+        if rendered is not None:
+            return rendered_status_response(request, rendered)
+
+    meta = await read_task_meta(task_id)
+    deadline = time.monotonic() + wait_seconds
+    while meta["status"] not in TERMINAL_STATES and time.monotonic() < deadline:
+        await asyncio.sleep(STATUS_POLL_INTERVAL)
+        meta = await read_task_meta(task_id)
+
+    state = meta["status"]
+    response_data = {"task_id": task_id, "status": state, "result": None, "error_info": None}
+
+    if state == 'SUCCESS':
+        raw_result = unpack_result(meta["result"])
+        if RESULT_CACHE_ENABLED:
+            await run_in_threadpool(result_cache.remember_task_result, task_id, raw_result)
+        if RENDER_CACHE_ENABLED:
+            rendered = await run_in_threadpool(render_cache.render, task_id, raw_result,
+                                               output_format_preference, simplified_output_mode)
+            return rendered_status_response(request, rendered)
+        response_data["result"] = await run_in_threadpool(format_transcription_result, raw_result,
+                                                          output_format_preference, simplified_output_mode)
+
+    elif state == 'PROGRESS':
+        progress_info = meta["result"] if isinstance(meta["result"], dict) else {}
+        since = max(0, query_number(request, 'since', 0, cast=int))
+        partial_segments = await read_partial_segments(task_id, start=since)
+        partial_result = {"text": "".join(segment["text"] for segment in partial_segments), "segments": partial_segments}
+        response_data["progress"] = progress_info.get("progress", 0.0)
+        response_data["partial"] = True
+        response_data["segments_done"] = since + len(partial_segments)
+        response_data["result"] = format_transcription_result(partial_result, output_format_preference,
+                                                              simplified_output_mode, start_index=since)
+
+    elif state == 'FAILURE':
+        response_data["error_info"] = str(meta["result"])
+        if RESULT_CACHE_ENABLED:
+            await run_in_threadpool(result_cache.forget_failed_task, task_id)
+
+    return JSONResponse(response_data)
+
+
+async def task_events_stream(request):
+    """Server-Sent Events stream of a task's state changes (see the Flask route)."""
+    if not TASK_EVENTS_ENABLED:
+        return JSONResponse({"error": "Task events are disabled; poll the status_url instead"}, status_code=404)
+    global _open_streams
+    if _open_streams >= SSE_MAX_STREAMS:
+        return JSONResponse({"error": "Too many open event streams; poll the status_url instead"}, status_code=503,
+                            headers={'Retry-After': '30'})
+    task_id = request.path_params['task_id']
+
+    def format_sse(event):
+        return f"event: {event['state'].lower()}\ndata: {json.dumps(event)}\n\n"
+
+    async def generate():
+        global _open_streams
+        queue = None
+        try:
+            yield "retry: 5000\n\n"
+            queue = await event_hub.listen(task_id)  # Before reading the last event so nothing is missed
+            raw = await get_async_redis(TASK_EVENTS_REDIS_URL).get(LAST_EVENT_PREFIX + task_id)
+            saw_event = raw is not None
+            if saw_event:
+                event = json.loads(raw)
+                yield format_sse(event)
+                if event["state"] in TERMINAL_STATES:
+                    return
+            deadline = time.monotonic() + SSE_MAX_SECONDS
+            while time.monotonic() < deadline:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    if not saw_event:
+                        # Possibly finished before events existed for it (e.g. a result-cache hit)
+                        state = (await read_task_meta(task_id))["status"]
+                        if state in TERMINAL_STATES:
+                            yield format_sse({"task_id": task_id, "state": state})
+                            return
+                    yield ": keepalive\n\n"
+                    continue
+                saw_event = True
+                yield format_sse(event)
+                if event["state"] in TERMINAL_STATES:
+                    return
+        finally:
+            _open_streams -= 1
+            if queue is not None:
+                event_hub.unlisten(task_id, queue)
+
+    _open_streams += 1  # Released when the stream's generator closes
+    return StreamingResponse(generate(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+async def feed_body(request, receive):
+    """
+    Passes the request body in chunks of up to READ_CHUNK_SIZE to receive(chunk), which runs in the
+    thread pool (parsing, disk/ffmpeg writes); raises IngestError past MAX_CONTENT_LENGTH.
+    """
+    max_bytes = flask_app.config['MAX_CONTENT_LENGTH']
+    buffer = bytearray()
+    total_bytes = 0
+    async for chunk in request.stream():
+        total_bytes += len(chunk)
+        if max_bytes and total_bytes > max_bytes:
+            raise IngestError("Upload too large", status_code=413)
+        buffer.extend(chunk)
+        if len(buffer) >= READ_CHUNK_SIZE:
+            await run_in_threadpool(receive, bytes(buffer))
+            buffer.clear()
+    if buffer:
+        await run_in_threadpool(receive, bytes(buffer))
+
+
+async def rerun_stored_audio(request, audio_id, form):
+    """Rerun of stored audio (audio_store.py); options come from the form, then the query string."""
+    if not audio_id:
+        return JSONResponse({"error": "No audio_file part in the request"}, status_code=400)
+    options = MultiDict(list(form.items()) + [(name, value) for name, value in request.query_params.multi_items()
+                                              if name not in form])
+    return await run_in_threadpool(run_in_flask_context, request, lambda: transcribe_stored_audio(audio_id, options))
+
+
+def run_in_flask_context(request, view):
+    """Runs Flask submission code (cache, sync path, Celery publish) for this request and converts its response."""
+    # Headers and the peer address carry the client's identity for fair-share admission
+    with flask_app.test_request_context('/transcribe', method='POST', base_url=str(request.base_url),
+                                        query_string=request.url.query, headers=list(request.headers.items()),
+                                        environ_base={'REMOTE_ADDR': request.client.host if request.client else ''}):
+        response = flask_app.make_response(view())
+    headers = {name: value for name, value in response.headers.items()
+               if name.lower() not in ('content-type', 'content-length')}  # e.g. Retry-After of a 429
+    return Response(response.get_data(), status_code=response.status_code, media_type=response.mimetype,
+                    headers=headers)
+
+
+async def transcribe_route(request):
+    stream_ingest = request.query_params.get('ingest', STREAM_INGEST_DEFAULT) == 'stream'
+    audio_id = request.query_params.get('audio_id')
+    if not request.headers.get('content-type', '').startswith('multipart/form-data'):
+        # No upload: a rerun of stored audio with an urlencoded options form
+        body = bytearray()
+        try:
+            await feed_body(request, body.extend)
+        except IngestError as e:
+            return JSONResponse({"error": str(e)}, status_code=e.status_code)
+        form = MultiDict(parse_qsl(bytes(body).decode('utf-8', 'replace'), keep_blank_values=True))
+        return await rerun_stored_audio(request, audio_id or form.get('audio_id'), form)
+    temp_paths = []
+
+    def open_sink(filename):
+        # Same files as the Flask routes: decoded PCM for streaming ingestion, the original upload otherwise
+        suffix = PCM_SUFFIX if stream_ingest else os.path.splitext(filename)[1]
+        temp_file_handler = tempfile.NamedTemporaryFile(delete=False, dir=flask_app.config['UPLOAD_FOLDER'], suffix=suffix)
+        temp_file_handler.close()
+        temp_paths.append(temp_file_handler.name)
+        return open_pcm_decoder(filename, temp_file_handler.name) if stream_ingest else RawFileSink(temp_file_handler.name)
+
+    receiver = None
+    try:
+        # With ?audio_id= an audio_file part is skipped unread: the stored audio wins, as in the Flask route
+        receiver = MultipartAudioReceiver(request.headers.get('content-type'), open_sink,
+                                          file_field=None if audio_id else 'audio_file', is_allowed=allowed_file)
+        with stage_timer('ingest'):
+            await feed_body(request, receiver.receive)
+            upload = None
+            if receiver.has_file:
+                upload = await run_in_threadpool(receiver.finish)
+            elif not receiver.finished:
+                await run_in_threadpool(receiver.receive, None)  # Raises on a truncated body
+    except BaseException as e:  # Including a client disconnect or cancellation mid-upload
+        if receiver is not None:
+            receiver.abort()
+        for path in temp_paths:
+            if os.path.exists(path):
+                os.remove(path)
+        if isinstance(e, IngestError):
+            return JSONResponse({"error": str(e)}, status_code=e.status_code)
+        if isinstance(e, Exception):
+            logger.error("Error ingesting upload: %s", e)
+            return JSONResponse({"error": f"Failed to ingest audio: {str(e)}"}, status_code=500)
+        raise
+
+    if upload is None:  # Options form of a rerun (audio_id in the query string or a form field)
+        return await rerun_stored_audio(request, audio_id or receiver.form.get('audio_id'), receiver.form)
+
+    ingest_mode = 'stream' if stream_ingest else 'file'
+    UPLOADS.labels(ingest_mode).inc()
+    UPLOAD_BYTES.labels(ingest_mode).inc(upload.bytes_received)
+    return await run_in_threadpool(run_in_flask_context, request, lambda: submit_transcription(
+        temp_paths[0], upload.digest, upload.form, duration=upload.duration))
+
+
+templates = Jinja2Templates(directory=os.path.join(BASE_DIR, 'templates'))
+
+
+@pass_context
+def flask_style_url_for(context, name, **params):
+    """The templates are shared with the Flask app and call url_for() the Flask way (relative URLs)."""
+    if name == 'static':
+        params = {'path': params['filename']}
+    return context['request'].url_for(name, **params).path
+
+
+templates.env.globals['url_for'] = flask_style_url_for
+
+
+async def index(request):
+    return templates.TemplateResponse(request, 'index.html', {"gpu_available": torch.cuda.is_available()})
+
+
+async def docs(request):
+    return templates.TemplateResponse(request, 'docs.html')
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    await event_hub.close()
+    for client in _redis_clients.values():
+        await client.aclose()
+
+
+app = Starlette(routes=[
+    Route('/', index, name='index'),
+    Route('/docs', docs, name='docs'),
+    Route('/transcribe', transcribe_route, methods=['POST'], name='transcribe_route'),
+    Route('/status/{task_id}', get_task_status, name='get_task_status'),
+    Route('/events/{task_id}', task_events_stream, name='task_events_stream'),
+    Mount('/static', StaticFiles(directory=os.path.join(BASE_DIR, 'static')), name='static'),
+    Mount('/', WSGIMiddleware(flask_app)),  # /metrics, /cache/stats and every other Flask route
+], lifespan=lifespan)
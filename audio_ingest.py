@@ -0,0 +1,304 @@
+# audio_ingest.py
+# Streaming ingestion of uploads: the multipart request body is parsed incrementally and the
+# audio part is piped into an ffmpeg process that emits Whisper's input format (16 kHz mono
+# float32 PCM) directly into the file handed to the worker. MP4-family containers may keep their
+# index (moov atom) at the end of the file, which ffmpeg can't seek back to through a pipe; those
+# uploads are spooled to disk and decoded from the file once complete.
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import MultipartDecoder, Data, Epilogue, Field, File, NEED_DATA
+
+from result_cache import new_audio_hasher
+from whisper_wrapper import SAMPLE_RATE, PCM_SUFFIX
+
+READ_CHUNK_SIZE = 256 * 1024  # Bytes pulled from the request stream per iteration
+MAX_FORM_FIELD_BYTES = 64 * 1024  # Text fields (prompt etc.) are small; anything bigger is rejected
+MAX_PARTS = 64
+BYTES_PER_SAMPLE = 4  # float32
+# ISO base media files: ffmpeg needs to seek to their moov atom, so they are not decoded from a pipe
+SPOOLED_DECODE_EXTENSIONS = {'.mp4', '.m4a', '.m4b', '.m4v', '.mov', '.3gp', '.3g2'}
+
+
+class IngestError(Exception):
+    """Client-side problem with a streamed upload; carries the HTTP status to answer with."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class IngestedUpload:
+    def __init__(self, form, filename, digest, bytes_received, samples):
+        self.form = form
+        self.filename = filename
+        self.digest = digest  # SHA-256 of the original upload bytes (result cache key)
+        self.bytes_received = bytes_received
+        self.samples = samples
+
+    @property
+    def duration(self):
+        return self.samples / SAMPLE_RATE if self.samples is not None else None
+
+
+def find_ffmpeg():
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        raise RuntimeError("ffmpeg executable not found on PATH")
+    return ffmpeg
+
+
+class FFmpegPCMDecoder:
+    """
+    Runs ffmpeg as a pipe: encoded audio in on stdin, float32 PCM out into `output_path`.
+    input_path: decode this file instead of stdin (feed() must not be called).
+    """
+
+    def __init__(self, output_path, sample_rate=SAMPLE_RATE, input_path=None):
+        ffmpeg = find_ffmpeg()
+        self._stderr = tempfile.TemporaryFile()
+        self._output = open(output_path, 'wb')
+        self._process = subprocess.Popen(
+            [ffmpeg, '-nostdin', '-loglevel', 'error', '-threads', '0', '-i', input_path or 'pipe:0',
+             '-f', 'f32le', '-ac', '1', '-ar', str(sample_rate), 'pipe:1'],
+            stdin=subprocess.DEVNULL if input_path else subprocess.PIPE, stdout=subprocess.PIPE, stderr=self._stderr,
+        )
+        self.bytes_written = 0
+        # Drain stdout concurrently, otherwise ffmpeg blocks on a full pipe while we block on stdin
+        self._reader = threading.Thread(target=self._drain_stdout, daemon=True)
+        self._reader.start()
+
+    def _drain_stdout(self):
+        while True:
+            chunk = self._process.stdout.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            self._output.write(chunk)
+            self.bytes_written += len(chunk)
+
+    def feed(self, data):
+        try:
+            self._process.stdin.write(data)
+        except BrokenPipeError:
+            raise IngestError(f"Audio could not be decoded: {self._error_output()}")
+
+    def finish(self):
+        """Closes ffmpeg's input and waits for the decode; returns the number of samples written."""
+        try:
+            if self._process.stdin is not None:
+                self._process.stdin.close()
+        except BrokenPipeError:
+            pass
+        return_code = self._process.wait()
+        self._reader.join()
+        self._output.close()
+        error_output = self._error_output()
+        self._stderr.close()
+        if return_code != 0:
+            raise IngestError(f"Audio could not be decoded: {error_output}")
+        return self.bytes_written // BYTES_PER_SAMPLE
+
+    def abort(self):
+        self._process.kill()
+        self._process.wait()
+        self._reader.join()
+        self._output.close()
+        self._stderr.close()
+
+    def _error_output(self):
+        self._stderr.seek(0)
+        return self._stderr.read().decode('utf-8', errors='replace').strip() or "unknown ffmpeg error"
+
+
+def probe_audio(path, timeout=10):
+    """
+    Metadata of an audio file: duration in seconds, sample_rate, channels and format (PCM files by
+    size, others via ffprobe), or None if it can't be probed.
+    """
+    if path.endswith(PCM_SUFFIX):
+        return {"duration": os.path.getsize(path) / BYTES_PER_SAMPLE / SAMPLE_RATE, "sample_rate": SAMPLE_RATE,
+                "channels": 1, "format": "f32le"}
+    ffprobe = shutil.which('ffprobe')
+    if ffprobe is None:
+        return None
+    try:
+        completed = subprocess.run(
+            [ffprobe, '-v', 'error', '-select_streams', 'a:0', '-show_entries',
+             'format=duration,format_name:stream=sample_rate,channels', '-of', 'json', path],
+            capture_output=True, text=True, timeout=timeout)
+        probed = json.loads(completed.stdout)
+        stream = (probed.get("streams") or [{}])[0]
+        return {"duration": float(probed["format"]["duration"]),
+                "sample_rate": int(stream["sample_rate"]) if "sample_rate" in stream else None,
+                "channels": stream.get("channels"),
+                "format": probed["format"].get("format_name")}
+    except (subprocess.SubprocessError, ValueError, KeyError):
+        return None
+
+
+def probe_duration(path, timeout=10):
+    """Duration in seconds of an audio file, or None if unknown."""
+    metadata = probe_audio(path, timeout=timeout)
+    return metadata["duration"] if metadata else None
+
+
+class RawFileSink:
+    """Writes the upload's original bytes to `output_path` (file ingestion: the worker decodes it)."""
+
+    def __init__(self, output_path):
+        self._output = open(output_path, 'wb')
+
+    def feed(self, data):
+        self._output.write(data)
+
+    def finish(self):
+        self._output.close()
+        return None  # Samples are unknown until the worker decodes the file
+
+    def abort(self):
+        self._output.close()
+
+
+class SpooledPCMDecoder:
+    """
+    Same interface as FFmpegPCMDecoder for uploads ffmpeg can't decode from a pipe: the bytes are
+    written to a spool file next to `output_path` and decoded from it in finish().
+    """
+
+    def __init__(self, output_path, sample_rate=SAMPLE_RATE):
+        find_ffmpeg()  # Fail before the upload is read, like FFmpegPCMDecoder
+        self._output_path = output_path
+        self._sample_rate = sample_rate
+        self._spool_path = output_path + '.spool'
+        self._spool = RawFileSink(self._spool_path)
+
+    def feed(self, data):
+        self._spool.feed(data)
+
+    def finish(self):
+        self._spool.finish()
+        try:
+            return FFmpegPCMDecoder(self._output_path, self._sample_rate, input_path=self._spool_path).finish()
+        finally:
+            os.remove(self._spool_path)
+
+    def abort(self):
+        self._spool.abort()
+        if os.path.exists(self._spool_path):
+            os.remove(self._spool_path)
+
+
+def open_pcm_decoder(filename, output_path):
+    """Decoder for streamed ingestion of `filename` into `output_path`: a pipe unless the container needs seeking."""
+    if os.path.splitext(filename or '')[1].lower() in SPOOLED_DECODE_EXTENSIONS:
+        return SpooledPCMDecoder(output_path)
+    return FFmpegPCMDecoder(output_path)
+
+
+class MultipartAudioReceiver:
+    """
+    Push parser for a multipart/form-data body, fed in chunks through receive() and completed with
+    finish(). The `file_field` part is streamed into the sink returned by open_sink(filename)
+    (open_pcm_decoder's decoder or a RawFileSink) while its raw bytes are hashed; other parts become text form
+    fields. Used by the blocking reader below and by the asyncio front end (asgi_app.py).
+    """
+
+    def __init__(self, content_type, open_sink, file_field='audio_file', is_allowed=None):
+        mimetype, options = parse_options_header(content_type or '')
+        boundary = options.get('boundary')
+        if mimetype != 'multipart/form-data' or not boundary:
+            raise IngestError("Expected a multipart/form-data body")
+        self._parser = MultipartDecoder(boundary.encode('latin-1'), max_parts=MAX_PARTS)
+        self._open_sink = open_sink
+        self._file_field = file_field
+        self._is_allowed = is_allowed
+        self._hasher = new_audio_hasher()
+        self._sink = None
+        self._current_field = None  # (kind, name) of the part whose Data events are arriving
+        self._field_buffer = bytearray()
+        self.form = {}
+        self.filename = None
+        self.bytes_received = 0
+        self.finished = False
+
+    def receive(self, data):
+        """Parses the next chunk of the body (b'' or None marks its end)."""
+        if self.finished:
+            return  # Anything after the closing boundary is ignored
+        try:
+            self._parser.receive_data(data or None)  # None signals end of input
+            event = self._parser.next_event()
+            while event is not NEED_DATA:
+                if isinstance(event, File) and event.name == self._file_field:
+                    if self._sink is not None:
+                        raise IngestError(f"More than one {self._file_field} part in the request")
+                    if not event.filename:
+                        raise IngestError("No selected file")
+                    if self._is_allowed is not None and not self._is_allowed(event.filename):
+                        raise IngestError("File type not allowed")
+                    self.filename = event.filename
+                    self._sink = self._open_sink(event.filename)
+                    self._current_field = ('audio', event.name)
+                elif isinstance(event, (Field, File)):
+                    self._current_field = ('field' if isinstance(event, Field) else 'ignored', event.name)
+                    self._field_buffer.clear()
+                elif isinstance(event, Data):
+                    kind, name = self._current_field
+                    if kind == 'audio':
+                        self._hasher.update(event.data)
+                        self._sink.feed(event.data)
+                        self.bytes_received += len(event.data)
+                    elif kind == 'field':
+                        self._field_buffer.extend(event.data)
+                        if len(self._field_buffer) > MAX_FORM_FIELD_BYTES:
+                            raise IngestError(f"Form field '{name}' is too large", status_code=413)
+                        if not event.more_data:
+                            self.form[name] = self._field_buffer.decode('utf-8', errors='replace')
+                elif isinstance(event, Epilogue):
+                    self.finished = True
+                    break  # The parser is complete; asking for more events would raise
+                event = self._parser.next_event()
+            if not data and not self.finished:
+                raise IngestError("Incomplete multipart body")
+        except Exception:
+            self.abort()
+            raise
+
+    @property
+    def has_file(self):
+        """Whether the `file_field` part arrived (so far)."""
+        return self._sink is not None
+
+    def finish(self):
+        """Completes the upload after the whole body was received; returns an IngestedUpload."""
+        if not self.finished:
+            self.receive(None)
+        if self._sink is None:
+            raise IngestError(f"No {self._file_field} part in the request")
+        samples = self._sink.finish()
+        if samples == 0:
+            raise IngestError("Uploaded audio contains no samples")
+        return IngestedUpload(self.form, self.filename, self._hasher.hexdigest(), self.bytes_received, samples)
+
+    def abort(self):
+        if self._sink is not None:
+            self._sink.abort()
+            self._sink = None
+
+
+def ingest_multipart_audio(stream, content_type, pcm_path, file_field='audio_file', is_allowed=None):
+    """
+    Reads a multipart/form-data body from `stream`, decoding the `file_field` part into `pcm_path`
+    while hashing its raw bytes. Returns an IngestedUpload with the other (text) form fields.
+    """
+    receiver = MultipartAudioReceiver(content_type, lambda filename: open_pcm_decoder(filename, pcm_path),
+                                      file_field=file_field, is_allowed=is_allowed)
+    while not receiver.finished:
+        data = stream.read(READ_CHUNK_SIZE)
+        receiver.receive(data)
+    return receiver.finish()
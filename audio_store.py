@@ -0,0 +1,286 @@
+# audio_store.py
+# Uploaded audio kept for reruns, keyed by the SHA-256 of the upload (the `audio_id`).
+#
+# Without it, every upload is deleted by its task. A rerun with a larger model or task=translate
+# means a new upload, another ffmpeg decode and another log-mel computation. With
+# WHISPER_AUDIO_STORE enabled, each audio_id keeps these files in WHISPER_AUDIO_STORE_DIR:
+#
+#   <audio_id>.json            probed metadata (duration, sample_rate, channels, format, ...)
+#   <audio_id>.src<ext>        the original upload, until a worker has decoded it
+#   <audio_id>.f32             decoded 16 kHz mono float32 PCM (same format as streamed ingestion)
+#   <audio_id>.mel<N>.npy      log-mel spectrogram with N mel bins, padded as whisper.transcribe pads it
+#
+# /transcribe?audio_id=... starts a task from the stored audio without uploading it again. The
+# task gets a hard link of the PCM (or of the source), so deleting its input never touches the
+# store. Workers reuse the stored PCM and mel instead of decoding again. Entries expire
+# WHISPER_AUDIO_STORE_TTL seconds after their last use. WHISPER_AUDIO_STORE_MAX_MB optionally
+# caps the total size, dropping the least recently used entries first.
+#
+# The store is a plain directory, so the API and the workers must share it. It lives next to
+# uploads/ by default, which they already share.
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+AUDIO_STORE_ENABLED = os.environ.get('WHISPER_AUDIO_STORE', 'false').lower() in ['true', 'on', '1']
+AUDIO_STORE_DIR = os.environ.get('WHISPER_AUDIO_STORE_DIR', os.path.join('uploads', 'audio-store'))
+AUDIO_STORE_TTL = int(os.environ.get('WHISPER_AUDIO_STORE_TTL', str(24 * 3600)))  # Seconds since last use
+AUDIO_STORE_MAX_BYTES = int(os.environ.get('WHISPER_AUDIO_STORE_MAX_MB', '0')) * 1024 * 1024  # 0: TTL only
+AUDIO_STORE_MEL = os.environ.get('WHISPER_AUDIO_STORE_MEL', 'true').lower() in ['true', 'on', '1']
+
+AUDIO_ID_PATTERN = re.compile(r'^[0-9a-f]{64}$')  # Hex SHA-256; also keeps ids from escaping the directory
+PCM_DTYPE = '<f4'  # whisper_wrapper's PCM format: little-endian float32 samples at 16 kHz
+SWEEP_INTERVAL = 60  # Seconds between sweeps of one process
+
+
+class AudioStore:
+    def __init__(self, directory=AUDIO_STORE_DIR, ttl=AUDIO_STORE_TTL, max_bytes=AUDIO_STORE_MAX_BYTES,
+                 enabled=AUDIO_STORE_ENABLED):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._last_sweep = 0.0
+        self._sweep_lock = threading.Lock()
+
+    @staticmethod
+    def valid_id(audio_id):
+        return bool(audio_id) and AUDIO_ID_PATTERN.match(audio_id) is not None
+
+    def _path(self, audio_id, suffix):
+        return os.path.join(self.directory, audio_id + suffix)
+
+    def _entry_files(self, audio_id):
+        prefix = audio_id + '.'
+        try:
+            return [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                    if name.startswith(prefix) and not name.endswith('.tmp')]
+        except FileNotFoundError:
+            return []
+
+    def _source_path(self, audio_id):
+        for path in self._entry_files(audio_id):
+            if path[len(self.directory) + 1 + len(audio_id):].startswith('.src'):
+                return path
+        return None
+
+    def _write_atomic(self, path, write):
+        """Writes through a temporary file in the store directory, so readers never see a partial file."""
+        os.makedirs(self.directory, exist_ok=True)
+        handle = tempfile.NamedTemporaryFile(delete=False, dir=self.directory, suffix='.tmp')
+        try:
+            with handle:
+                write(handle)
+            os.replace(handle.name, path)
+        except BaseException:
+            if os.path.exists(handle.name):
+                os.remove(handle.name)
+            raise
+
+    @staticmethod
+    def _link_or_copy(source, destination):
+        try:
+            os.link(source, destination)
+        except OSError:  # Different filesystem
+            shutil.copyfile(source, destination)
+
+    def touch(self, audio_id):
+        """Marks the entry as used (its TTL restarts)."""
+        for path in self._entry_files(audio_id):
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+
+    def contains(self, audio_id):
+        """True if audio (decoded or not) is stored for this id."""
+        return self.enabled and self.valid_id(audio_id) and (
+            os.path.exists(self._path(audio_id, '.f32')) or self._source_path(audio_id) is not None)
+
+    # --- Metadata ---
+
+    def metadata(self, audio_id):
+        """Stored metadata of an audio_id, or None."""
+        if not self.enabled or not self.valid_id(audio_id):
+            return None
+        try:
+            with open(self._path(audio_id, '.json')) as handle:
+                return json.load(handle)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def save_metadata(self, audio_id, **fields):
+        """Merges fields into the entry's metadata (None values are skipped)."""
+        metadata = self.metadata(audio_id) or {"audio_id": audio_id, "stored_at": time.time()}
+        metadata.update({name: value for name, value in fields.items() if value is not None})
+        self._write_atomic(self._path(audio_id, '.json'),
+                           lambda handle: handle.write(json.dumps(metadata, sort_keys=True).encode('utf-8')))
+        return metadata
+
+    def describe(self, audio_id):
+        """Metadata plus what is stored (for GET /audio/<audio_id>), or None for unknown ids."""
+        if not self.contains(audio_id):
+            return None
+        self.touch(audio_id)
+        suffixes = [path[len(self.directory) + 1 + len(audio_id):] for path in self._entry_files(audio_id)]
+        return {**(self.metadata(audio_id) or {"audio_id": audio_id}),
+                "decoded": '.f32' in suffixes,
+                "mel_bins": sorted(int(s[4:-4]) for s in suffixes if s.startswith('.mel') and s.endswith('.npy')),
+                "expires_in": self.ttl}
+
+    # --- Audio ---
+
+    def add_upload(self, audio_id, upload_path, **metadata):
+        """
+        Keeps an upload (hard link, no copy) unless the id is already stored. PCM uploads (streamed
+        ingestion) are stored as decoded audio right away.
+        """
+        if not self.enabled or not self.valid_id(audio_id):
+            return
+        try:
+            if not self.contains(audio_id):
+                os.makedirs(self.directory, exist_ok=True)
+                _, extension = os.path.splitext(upload_path)
+                if extension == '.f32':
+                    target = self._path(audio_id, '.f32')
+                else:
+                    target = self._path(audio_id, '.src' + extension)
+                temporary = f"{target}.{os.getpid()}.tmp"
+                self._link_or_copy(upload_path, temporary)
+                os.replace(temporary, target)
+            else:
+                self.touch(audio_id)
+            if metadata or self.metadata(audio_id) is None:
+                self.save_metadata(audio_id, **metadata)
+        except OSError as e:
+            logger.warning("Audio store: could not keep %s: %s", audio_id, e)
+        self.sweep_if_due()
+
+    def checkout(self, audio_id, directory):
+        """
+        A new hard link of the stored audio in `directory` (PCM if decoded, else the source), for a
+        task that deletes its input. None if the id is not stored.
+        """
+        if not self.contains(audio_id):
+            return None
+        source = self._path(audio_id, '.f32')
+        if not os.path.exists(source):
+            source = self._source_path(audio_id)
+        if source is None:
+            return None
+        _, extension = os.path.splitext(source)
+        handle = tempfile.NamedTemporaryFile(delete=False, dir=directory, suffix=extension)
+        handle.close()
+        os.remove(handle.name)
+        try:
+            self._link_or_copy(source, handle.name)
+        except FileNotFoundError:  # Expired or decoded in between
+            return None
+        self.touch(audio_id)
+        return handle.name
+
+    def load_pcm(self, audio_id):
+        """Decoded samples of an audio_id, or None if it was not decoded yet."""
+        if not self.enabled or not self.valid_id(audio_id):
+            return None
+        try:
+            samples = np.fromfile(self._path(audio_id, '.f32'), dtype=PCM_DTYPE)
+        except FileNotFoundError:
+            return None
+        self.touch(audio_id)
+        return samples
+
+    def save_pcm(self, audio_id, samples):
+        """Stores the decoded samples; the source upload is then no longer needed."""
+        if not self.enabled or not self.valid_id(audio_id):
+            return
+        try:
+            self._write_atomic(self._path(audio_id, '.f32'),
+                               lambda handle: np.asarray(samples, dtype=PCM_DTYPE).tofile(handle))
+            source = self._source_path(audio_id)
+            if source is not None:
+                os.remove(source)
+        except OSError as e:
+            logger.warning("Audio store: could not store PCM of %s: %s", audio_id, e)
+
+    def load_mel(self, audio_id, n_mels):
+        if not (self.enabled and AUDIO_STORE_MEL) or not self.valid_id(audio_id):
+            return None
+        try:
+            return np.load(self._path(audio_id, f'.mel{n_mels}.npy'))
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def save_mel(self, audio_id, n_mels, mel):
+        if not (self.enabled and AUDIO_STORE_MEL) or not self.valid_id(audio_id):
+            return
+        try:
+            self._write_atomic(self._path(audio_id, f'.mel{n_mels}.npy'), lambda handle: np.save(handle, mel))
+        except OSError as e:
+            logger.warning("Audio store: could not store the mel spectrogram of %s: %s", audio_id, e)
+
+    # --- Expiry ---
+
+    def sweep_if_due(self):
+        if time.time() - self._last_sweep < SWEEP_INTERVAL or not self._sweep_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_sweep = time.time()
+            self.sweep()
+        finally:
+            self._sweep_lock.release()
+
+    def sweep(self):
+        """Removes entries unused for longer than the TTL, then the least recently used ones over the size cap."""
+        entries = {}  # audio_id -> [last use, bytes, paths]
+        now = time.time()
+        try:
+            with os.scandir(self.directory) as scan:
+                for item in scan:
+                    stat = item.stat()
+                    if item.name.endswith('.tmp'):
+                        if now - stat.st_mtime > 3600:  # Left behind by a crashed writer
+                            os.remove(item.path)
+                        continue
+                    entry = entries.setdefault(item.name.split('.', 1)[0], [0.0, 0, []])
+                    entry[0] = max(entry[0], stat.st_mtime)
+                    entry[1] += stat.st_size
+                    entry[2].append(item.path)
+        except FileNotFoundError:
+            return
+        removed = 0
+        total = sum(entry[1] for entry in entries.values())
+        for audio_id, (last_used, size, paths) in sorted(entries.items(), key=lambda item: item[1][0]):
+            if now - last_used <= self.ttl and (not self.max_bytes or total <= self.max_bytes):
+                break  # Oldest first: everything after this entry is newer
+            for path in paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= size
+            removed += 1
+        if removed:
+            logger.info("Audio store: removed %d entries, %d bytes remain.", removed, total)
+
+    def stats(self):
+        count, total = 0, 0
+        try:
+            with os.scandir(self.directory) as scan:
+                for item in scan:
+                    total += item.stat().st_size
+                    count += item.name.endswith('.json')
+        except FileNotFoundError:
+            pass
+        return {"enabled": self.enabled, "entries": count, "bytes": total, "ttl": self.ttl, "max_bytes": self.max_bytes}
+
+audio_store = AudioStore()
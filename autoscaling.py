@@ -0,0 +1,315 @@
+# autoscaling.py
+# Demand and supply signals for scaling the workers, combined into one snapshot in Redis.
+#
+# Demand: every published transcription task counts towards its model's requests of the current
+# minute, and every finished one adds its run time to the model's busy seconds. Together with the
+# broker depth of the model's queue this is the recent request mix per model.
+#
+# Supply: every process that runs tasks (prefork child, or the worker itself with -P solo/threads)
+# publishes a heartbeat every WHISPER_AUTOSCALE_INTERVAL seconds and whenever it starts or finishes
+# a task: the models in its model cache (with the cache's occupancy), the tasks it is running and
+# since when it is idle. The worker's main process publishes its pool size, the queues it consumes
+# and its preload list.
+# Heartbeats expire when a process stops sending them.
+#
+# Snapshot: one worker at a time (a Redis lock per interval) combines both into a JSON document at
+# whisper:autoscale:snapshot, which an external scaler can read; GET /autoscale computes it on
+# demand. For each model it holds a target number of warm processes: the average number of
+# processes busy with it over the window (with WHISPER_AUTOSCALE_HEADROOM), plus enough to work
+# off its queued tasks within WHISPER_AUTOSCALE_BACKLOG_SECONDS, and at least one while it has
+# recent demand. warm_pool.py acts on it.
+import json
+import logging
+import math
+import os
+import socket
+import threading
+import time
+
+from scheduling import DRAIN_WINDOW_MINUTES, get_redis, lane_stats, redis_configured
+
+logger = logging.getLogger(__name__)
+
+AUTOSCALE_INTERVAL = float(os.environ.get('WHISPER_AUTOSCALE_INTERVAL', '15'))  # Heartbeat seconds, 0 disables
+AUTOSCALE_HEADROOM = float(os.environ.get('WHISPER_AUTOSCALE_HEADROOM', '1.25'))  # Warm processes per busy one
+AUTOSCALE_BACKLOG_SECONDS = float(os.environ.get('WHISPER_AUTOSCALE_BACKLOG_SECONDS', '300'))  # Clear queues within
+AUTOSCALE_TASK_SECONDS = float(os.environ.get('WHISPER_AUTOSCALE_TASK_SECONDS', '60'))  # Assumed until tasks finish
+# Most processes a worker may grow to; defaults to the host's cores (set per worker)
+WARM_POOL_MAX_PROCESSES = int(os.environ.get('WHISPER_WARM_POOL_MAX_PROCESSES', '0')) or os.cpu_count() or 1
+
+KEY_PREFIX = 'whisper:autoscale:'
+DEMAND_PREFIX = KEY_PREFIX + 'demand:'  # + <model>:<minute>, tasks published per model and minute
+BUSY_PREFIX = KEY_PREFIX + 'busy:'  # + <model>:<minute>, hash of finished tasks and their run seconds
+MODELS_KEY = KEY_PREFIX + 'models'  # Sorted set: model -> last request time
+PROCESSES_KEY = KEY_PREFIX + 'processes'  # Sorted set: heartbeat key -> last heartbeat time
+WORKERS_KEY = KEY_PREFIX + 'workers'
+PROCESS_PREFIX = KEY_PREFIX + 'process:'  # + <node>:<pid>
+WORKER_PREFIX = KEY_PREFIX + 'worker:'  # + <node>
+SNAPSHOT_KEY = KEY_PREFIX + 'snapshot'
+SNAPSHOT_LOCK_KEY = KEY_PREFIX + 'snapshot-lock'
+
+_process = {"node": None, "started_at": time.time(), "idle_since": time.time(), "tasks_done": 0, "beating": False}
+_running = {}  # task_id -> (model, start time); several entries with -P threads
+_running_lock = threading.Lock()
+
+
+def _heartbeat_ttl():
+    return int(3 * AUTOSCALE_INTERVAL) + 5
+
+
+def signals_enabled():
+    return AUTOSCALE_INTERVAL > 0 and redis_configured()
+
+
+def model_of_cache_key(cache_key):
+    """'large-v3_cuda' / 'base_cpu_int8' -> model name (model names contain no underscores)."""
+    return cache_key.split('_', 1)[0]
+
+
+def record_request(model_name):
+    """Counts a published task towards the demand of its model (called where tasks are published)."""
+    if not model_name or not signals_enabled():
+        return
+    now = time.time()
+    key = f"{DEMAND_PREFIX}{model_name}:{int(now // 60)}"
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.incr(key)
+        pipe.expire(key, (DRAIN_WINDOW_MINUTES + 1) * 60)
+        pipe.zadd(MODELS_KEY, {model_name: now})
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Autoscaling: failed to record a request for {model_name}: {e}")
+
+
+def task_started(task_id, model_name):
+    with _running_lock:
+        _running[task_id] = (model_name, time.time())
+    publish_process()
+
+
+def task_finished(task_id):
+    """Adds the task's run time to its model's busy seconds and marks the process idle when it runs nothing else."""
+    now = time.time()
+    with _running_lock:
+        model_name, started = _running.pop(task_id, (None, now))
+        _process["tasks_done"] += 1
+        if not _running:
+            _process["idle_since"] = now
+    if model_name and signals_enabled():
+        key = f"{BUSY_PREFIX}{model_name}:{int(now // 60)}"
+        try:
+            pipe = get_redis().pipeline(transaction=False)
+            pipe.hincrby(key, 'tasks', 1)
+            pipe.hincrbyfloat(key, 'seconds', round(now - started, 3))
+            pipe.expire(key, (DRAIN_WINDOW_MINUTES + 1) * 60)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Autoscaling: failed to record the run time of {task_id}: {e}")
+    publish_process()
+
+
+def process_heartbeat():
+    """Supply side of this process: loaded models and what it is doing."""
+    from whisper_wrapper import model_cache
+    with _running_lock:
+        running = [model for model, _ in _running.values()]
+        idle_since = None if running else _process["idle_since"]
+    return {
+        "node": _process["node"] or socket.gethostname(),
+        "pid": os.getpid(),
+        "models": sorted({model_of_cache_key(key) for key in model_cache.keys()}),
+        "model_cache": {name: value for name, value in model_cache.stats().items() if name != 'pinned'},
+        "running": running,
+        "idle_since": idle_since,
+        "tasks_done": _process["tasks_done"],
+        "started_at": _process["started_at"],
+        "ts": time.time(),
+    }
+
+
+def _publish(index_key, key, payload):
+    pipe = get_redis().pipeline(transaction=False)
+    pipe.set(key, json.dumps(payload, separators=(',', ':')), ex=_heartbeat_ttl())
+    pipe.zadd(index_key, {key: payload["ts"]})
+    pipe.execute()
+
+
+def publish_process():
+    if not signals_enabled():
+        return
+    heartbeat = process_heartbeat()
+    try:
+        _publish(PROCESSES_KEY, f"{PROCESS_PREFIX}{heartbeat['node']}:{heartbeat['pid']}", heartbeat)
+    except Exception as e:
+        logger.warning(f"Autoscaling: failed to publish the heartbeat of process {heartbeat['pid']}: {e}")
+
+
+def forget_processes(node, pids):
+    """Drops the heartbeats of stopped processes right away instead of waiting for them to expire."""
+    keys = [f"{PROCESS_PREFIX}{node}:{pid}" for pid in pids]
+    if keys and signals_enabled():
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.delete(*keys)
+        pipe.zrem(PROCESSES_KEY, *keys)
+        pipe.execute()
+
+
+def publish_worker(description):
+    """description: node, pool, processes, max_processes, queues, preload, warmed (see celery_worker_app)."""
+    if not signals_enabled():
+        return
+    description = dict(description, ts=time.time())
+    try:
+        _publish(WORKERS_KEY, f"{WORKER_PREFIX}{description['node']}", description)
+    except Exception as e:
+        logger.warning(f"Autoscaling: failed to publish the heartbeat of worker {description['node']}: {e}")
+
+
+def _every_interval(name, publish):
+    def loop():
+        while True:
+            try:
+                publish()
+            except Exception as e:
+                logger.warning(f"Autoscaling: {name} failed: {e}")
+            time.sleep(AUTOSCALE_INTERVAL)
+
+    threading.Thread(target=loop, name=name, daemon=True).start()
+
+
+def start_process_heartbeat(node=None):
+    """Publishes this process's heartbeat now and every interval (call after the models are preloaded)."""
+    if not signals_enabled() or _process["beating"]:
+        return
+    _process.update(node=node, beating=True)
+    _process["started_at"] = _process["idle_since"] = time.time()
+    _every_interval('autoscale-process-heartbeat', publish_process)
+
+
+def start_worker_heartbeat(describe_worker, build):
+    """
+    Worker main process: publishes describe_worker() every interval and, if no other worker did so
+    in this interval, the snapshot returned by build().
+    """
+    if not signals_enabled():
+        return
+
+    def beat():
+        description = describe_worker()
+        publish_worker(description)
+        if get_redis().set(SNAPSHOT_LOCK_KEY, description['node'], nx=True, ex=max(1, int(AUTOSCALE_INTERVAL))):
+            get_redis().set(SNAPSHOT_KEY, json.dumps(build(), separators=(',', ':')), ex=_heartbeat_ttl())
+
+    _every_interval('autoscale-worker-heartbeat', beat)
+
+
+def read_supply():
+    """(worker heartbeats, process heartbeats) that haven't expired."""
+    client = get_redis()
+    cutoff = time.time() - _heartbeat_ttl()
+    pipe = client.pipeline(transaction=False)
+    for index_key in (WORKERS_KEY, PROCESSES_KEY):
+        pipe.zremrangebyscore(index_key, '-inf', cutoff)
+        pipe.zrange(index_key, 0, -1)
+    _, worker_keys, _, process_keys = pipe.execute()
+    workers = [json.loads(raw) for raw in client.mget(worker_keys) if raw] if worker_keys else []
+    processes = [json.loads(raw) for raw in client.mget(process_keys) if raw] if process_keys else []
+    return workers, processes
+
+
+def read_demand():
+    """{model: {"requests", "tasks_finished", "busy_seconds"}} over the last DRAIN_WINDOW_MINUTES."""
+    client = get_redis()
+    now = time.time()
+    minute = int(now // 60)
+    minutes = range(minute - DRAIN_WINDOW_MINUTES + 1, minute + 1)
+    client.zremrangebyscore(MODELS_KEY, '-inf', now - DRAIN_WINDOW_MINUTES * 60)
+    models = [m.decode() if isinstance(m, bytes) else m for m in client.zrange(MODELS_KEY, 0, -1)]
+    pipe = client.pipeline(transaction=False)
+    for model_name in models:
+        pipe.mget([f"{DEMAND_PREFIX}{model_name}:{m}" for m in minutes])
+        for m in minutes:
+            pipe.hmget(f"{BUSY_PREFIX}{model_name}:{m}", 'tasks', 'seconds')
+    replies = pipe.execute()
+    demand = {}
+    step = len(minutes) + 1
+    for index, model_name in enumerate(models):
+        counts = replies[index * step]
+        busy = replies[index * step + 1:(index + 1) * step]
+        demand[model_name] = {
+            "requests": sum(int(c) for c in counts if c),
+            "tasks_finished": sum(int(tasks) for tasks, _ in busy if tasks),
+            "busy_seconds": sum(float(seconds) for _, seconds in busy if seconds),
+        }
+    return demand
+
+
+def target_processes(busy_seconds, tasks_finished, queued, running, requests, window_seconds):
+    """Warm processes a model should have (see the module comment)."""
+    mean_task = busy_seconds / tasks_finished if tasks_finished else AUTOSCALE_TASK_SECONDS
+    load = max(busy_seconds / window_seconds, running)
+    target = math.ceil(load * AUTOSCALE_HEADROOM + queued * mean_task / AUTOSCALE_BACKLOG_SECONDS)
+    if requests or queued or running:
+        target = max(target, 1)
+    return target
+
+
+def build_snapshot(queue_of):
+    """Demand and supply per model; queue_of(model) is the queue its tasks are routed to."""
+    now = time.time()
+    window_seconds = (DRAIN_WINDOW_MINUTES - 1) * 60 + (now % 60)  # Full past minutes plus the current one
+    demand = read_demand()
+    workers, processes = read_supply()
+    consumers = {w["node"]: set(w.get("queues", ())) for w in workers}
+
+    models = set(demand)
+    for entry in workers:
+        models.update(entry.get("preload", ()))
+    for entry in processes:
+        models.update(entry["models"])
+    queue_names = {model_name: queue_of(model_name) for model_name in models}
+    queues = lane_stats(sorted(set(queue_names.values()))).get("queues", [])
+    depths = {q["queue"]: sum(lane["depth"] for lane in q["lanes"].values()) for q in queues}
+    queue_requests = {}
+    for model_name, queue in queue_names.items():
+        queue_requests[queue] = queue_requests.get(queue, 0) + demand.get(model_name, {}).get("requests", 0)
+
+    snapshot_models = {}
+    for model_name in sorted(models):
+        queue = queue_names[model_name]
+        stats = demand.get(model_name, {"requests": 0, "tasks_finished": 0, "busy_seconds": 0.0})
+        # Models sharing a queue split its depth by their share of the recent requests
+        share = stats["requests"] / queue_requests[queue] if queue_requests[queue] else 0.0
+        queued = round(depths.get(queue, 0) * share, 1)
+        serving = [p for p in processes if queue in consumers.get(p["node"], ())]
+        warm = [p for p in serving if model_name in p["models"]]
+        running = sum(p["running"].count(model_name) for p in processes)
+        snapshot_models[model_name] = {
+            "queue": queue,
+            "queued": queued,
+            "requests_per_minute": round(stats["requests"] * 60 / window_seconds, 2),
+            "tasks_finished": stats["tasks_finished"],
+            "busy_seconds": round(stats["busy_seconds"], 1),
+            "running": running,
+            "warm_processes": len(warm),
+            "idle_warm_processes": sum(1 for p in warm if not p["running"]),
+            "target_processes": target_processes(stats["busy_seconds"], stats["tasks_finished"], queued, running,
+                                                 stats["requests"], window_seconds),
+        }
+
+    for entry in workers:
+        entry["process_list"] = sorted((p for p in processes if p["node"] == entry["node"]), key=lambda p: p["pid"])
+    return {
+        "generated_at": now,
+        "window_minutes": DRAIN_WINDOW_MINUTES,
+        "models": snapshot_models,
+        "queues": queues,
+        "workers": sorted(workers, key=lambda w: w["node"]),
+    }
+
+
+def load_snapshot():
+    """The snapshot last published by a worker, or None."""
+    raw = get_redis().get(SNAPSHOT_KEY)
+    return json.loads(raw) if raw else None
@@ -0,0 +1,176 @@
+# batch_jobs.py
+# Batch submissions: many files in one /batch request, tracked under a single batch ID.
+#
+# The members of a batch are dispatched as one Celery group and saved as a GroupResult; the
+# batch record (member task IDs and file names, in submission order) is kept next to it in the
+# result backend. /batch/<id>/status reads the states of all members with a single pipelined
+# MGET instead of one AsyncResult round trip per task, and can return the finished results as
+# NDJSON or as a zip of SRT/VTT/TSV/TXT/JSON files.
+#
+# Besides uploads, a batch can name files that already live on the API host (a "manifest").
+# Only paths below WHISPER_BATCH_ROOT are accepted; manifests are refused while it is unset.
+import json
+import logging
+import os
+import tempfile
+import zipfile
+
+from celery.backends.redis import RedisBackend
+
+from compact_result import unpack_result
+from result_cache import new_audio_hasher
+from whisper_wrapper import format_transcription_result
+
+logger = logging.getLogger(__name__)
+
+BATCH_ROOT = os.environ.get('WHISPER_BATCH_ROOT')  # Directory manifest paths must live in; unset disables manifests
+BATCH_MAX_FILES = int(os.environ.get('WHISPER_BATCH_MAX_FILES', '5000'))
+BATCH_KEY_PREFIX = 'whisper-batch-'
+MGET_CHUNK = 500  # Keys per MGET inside the pipeline, keeps single replies bounded
+COPY_CHUNK_SIZE = 1024 * 1024
+
+FINISHED_STATES = ('SUCCESS', 'FAILURE', 'REVOKED')
+BATCH_OUTPUT_FORMATS = ('srt', 'vtt', 'tsv', 'txt', 'json')
+
+
+class BatchError(Exception):
+    """A batch request that can't be accepted (answered with 400)."""
+
+
+def resolve_manifest_path(path):
+    """Absolute real path of a manifest entry; raises BatchError unless it is a file below BATCH_ROOT."""
+    if not BATCH_ROOT:
+        raise BatchError("Manifests are disabled; set WHISPER_BATCH_ROOT to allow server-side paths")
+    root = os.path.realpath(BATCH_ROOT)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise BatchError(f"Path '{path}' is outside of the batch root")
+    if not os.path.isfile(resolved):
+        raise BatchError(f"File '{path}' does not exist")
+    return resolved
+
+
+def stage_server_file(source_path, upload_folder):
+    """
+    Puts a manifest file into the upload folder (tasks delete their input) and returns (path, digest).
+    A hard link costs nothing on the same filesystem; elsewhere the file is copied.
+    """
+    _, extension = os.path.splitext(source_path)
+    handle = tempfile.NamedTemporaryFile(delete=False, dir=upload_folder, suffix=extension)
+    staged_path = handle.name
+    handle.close()
+    hasher = new_audio_hasher()
+    try:
+        os.remove(staged_path)
+        os.link(source_path, staged_path)
+        with open(staged_path, 'rb') as staged:
+            for chunk in iter(lambda: staged.read(COPY_CHUNK_SIZE), b''):
+                hasher.update(chunk)
+    except OSError:
+        with open(source_path, 'rb') as source, open(staged_path, 'wb') as staged:
+            for chunk in iter(lambda: source.read(COPY_CHUNK_SIZE), b''):
+                hasher.update(chunk)
+                staged.write(chunk)
+    return staged_path, hasher.hexdigest()
+
+
+def save_batch(backend, batch_id, members, options):
+    """Stores the batch record; members is a list of {"task_id", "name"} in submission order."""
+    record = {"batch_id": batch_id, "members": members, "options": options}
+    backend.set(BATCH_KEY_PREFIX + batch_id, json.dumps(record, separators=(',', ':')))
+
+
+def load_batch(backend, batch_id):
+    """The batch record saved by save_batch, or None for an unknown (or expired) batch."""
+    raw = backend.get(BATCH_KEY_PREFIX + batch_id)
+    if raw is None:
+        return None
+    return json.loads(raw)
+
+
+def fetch_task_metas(backend, task_ids):
+    """
+    Result metadata ({"status", "result", ...}) of many tasks in one round trip.
+    On Redis the MGETs are pipelined; other key-value backends use their own multi-get.
+    """
+    keys = [backend.get_key_for_task(task_id) for task_id in task_ids]
+    if isinstance(backend, RedisBackend):
+        pipeline = backend.client.pipeline(transaction=False)
+        for start in range(0, len(keys), MGET_CHUNK):
+            pipeline.mget(keys[start:start + MGET_CHUNK])
+        values = [value for reply in pipeline.execute() for value in reply]
+    else:
+        values = backend.mget(keys)
+        if isinstance(values, dict):  # The cache backend answers with a mapping
+            values = [values.get(key) for key in keys]
+    return [backend.decode_result(value) if value is not None else {"status": "PENDING", "result": None}
+            for value in values]
+
+
+def member_progress(meta):
+    """Fraction done of one member (0-100, like the task's own PROGRESS meta)."""
+    if meta["status"] in FINISHED_STATES:
+        return 100.0
+    if meta["status"] == 'PROGRESS' and isinstance(meta.get("result"), dict):
+        return float(meta["result"].get("progress", 0.0))
+    return 0.0
+
+
+def summarize_batch(batch, metas):
+    """Aggregate counts and progress plus the per-member states of a batch."""
+    counts = {}
+    members = []
+    for index, (member, meta) in enumerate(zip(batch["members"], metas)):
+        state = meta["status"]
+        counts[state] = counts.get(state, 0) + 1
+        entry = {"index": index, "task_id": member["task_id"], "name": member["name"], "status": state,
+                 "progress": member_progress(meta), "audio_id": member.get("audio_id")}
+        if state in ('FAILURE', 'REVOKED'):
+            entry["error_info"] = str(meta.get("result"))
+        members.append(entry)
+    total = len(members)
+    finished = sum(counts.get(state, 0) for state in FINISHED_STATES)
+    return {
+        "batch_id": batch["batch_id"],
+        "total": total,
+        "finished": finished == total,
+        "counts": counts,
+        "progress": round(sum(entry["progress"] for entry in members) / total, 2) if total else 100.0,
+        "members": members,
+    }
+
+
+def render_member_output(raw_result, output_format):
+    """Contents of one member's file in the requested format."""
+    if output_format == 'json':
+        return json.dumps(raw_result, ensure_ascii=False)
+    return format_transcription_result(raw_result, output_format)["formatted_output"] or ""
+
+
+def iter_batch_ndjson(batch, metas, output_format, simplified):
+    """NDJSON lines (one per finished member) with the same `result` a /status response would carry."""
+    for index, (member, meta) in enumerate(zip(batch["members"], metas)):
+        state = meta["status"]
+        if state not in FINISHED_STATES:
+            continue
+        line = {"index": index, "task_id": member["task_id"], "name": member["name"], "status": state,
+                "result": None, "error_info": None}
+        if state == 'SUCCESS':
+            line["result"] = format_transcription_result(unpack_result(meta["result"]), output_format, simplified)
+        else:
+            line["error_info"] = str(meta.get("result"))
+        yield json.dumps(line, ensure_ascii=False) + "\n"
+
+
+def build_batch_zip(batch, metas, output_format):
+    """Spooled zip archive of the successful members, one file each, rewound for reading."""
+    archive = tempfile.SpooledTemporaryFile(max_size=32 * 1024 * 1024)
+    with zipfile.ZipFile(archive, 'w', compression=zipfile.ZIP_DEFLATED) as bundle:
+        for index, (member, meta) in enumerate(zip(batch["members"], metas)):
+            if meta["status"] != 'SUCCESS':
+                continue
+            stem = os.path.splitext(os.path.basename(member["name"]))[0] or member["task_id"]
+            output = render_member_output(unpack_result(meta["result"]), output_format)
+            bundle.writestr(f"{index:05d}_{stem}.{output_format}", output)  # Index keeps equal names apart
+    archive.seek(0)
+    return archive
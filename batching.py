@@ -0,0 +1,189 @@
+# batching.py
+# Batched decoding of short clips for workers running the threads pool (-P threads -c N).
+#
+# Clips that fit into one 30 s Whisper window and use plain greedy decoding are not run through
+# model.transcribe one by one. Instead the first task of a group waits WHISPER_BATCH_WINDOW_MS for
+# other tasks with the same model and options, then runs the encoder and decoder once for the whole
+# group. Each task thread gets its own result back. Throughput then grows with the batch size
+# instead of the number of tasks.
+import os
+import threading
+import time
+import weakref
+
+import torch
+import whisper
+from whisper.audio import N_SAMPLES
+from whisper.tokenizer import get_tokenizer
+
+BATCH_WINDOW_MS = int(os.environ.get('WHISPER_BATCH_WINDOW_MS', '0'))  # 0 disables batching
+BATCH_MAX_SIZE = int(os.environ.get('WHISPER_BATCH_MAX_SIZE', '8'))
+TIME_PRECISION = 0.02  # Seconds per timestamp token
+# Same silence detection as whisper.transcribe's defaults
+NO_SPEECH_THRESHOLD = 0.6
+LOGPROB_THRESHOLD = -1.0
+
+# Whisper's decoder keeps its kv-cache through forward hooks installed on the shared model modules,
+# so two threads decoding with the same model at once would write into each other's caches.
+_inference_locks = weakref.WeakKeyDictionary()
+_inference_locks_guard = threading.Lock()
+
+
+def inference_lock(model):
+    """Lock serialising forward passes on `model` within this process."""
+    with _inference_locks_guard:
+        lock = _inference_locks.get(model)
+        if lock is None:
+            lock = _inference_locks[model] = threading.Lock()
+        return lock
+
+
+def is_batchable(samples, temperature, word_timestamps):
+    """Batching covers one-window clips with deterministic decoding (no fallback, no word alignment)."""
+    return (BATCH_WINDOW_MS > 0 and len(samples) <= N_SAMPLES
+            and temperature is not None and float(temperature) == 0.0 and not word_timestamps)
+
+
+def segments_from_tokens(tokens, tokenizer, duration, decode_result=None):
+    """
+    Splits a decoded token sequence (<|t0|> text <|t1|><|t1|> text <|t2|> ...) into Whisper-style
+    segments. Text after the last timestamp runs until `duration`.
+    """
+    timestamp_begin = tokenizer.timestamp_begin
+    segments = []
+    start = None
+    segment_tokens = []
+    text_tokens = []
+
+    def close_segment(end):
+        segments.append({
+            "id": len(segments),
+            "seek": 0,
+            "start": start if start is not None else 0.0,
+            "end": end,
+            "text": tokenizer.decode(text_tokens),
+            "tokens": list(segment_tokens),
+            "temperature": 0.0,
+            "avg_logprob": getattr(decode_result, 'avg_logprob', 0.0),
+            "compression_ratio": getattr(decode_result, 'compression_ratio', 0.0),
+            "no_speech_prob": getattr(decode_result, 'no_speech_prob', 0.0),
+        })
+
+    for token in tokens:
+        if token >= tokenizer.eot and token < timestamp_begin:
+            continue  # Other special tokens carry no text
+        segment_tokens.append(token)
+        if token < timestamp_begin:
+            text_tokens.append(token)
+            continue
+        time_stamp = (token - timestamp_begin) * TIME_PRECISION
+        if text_tokens:
+            close_segment(time_stamp)
+            start = None
+            segment_tokens = []
+            text_tokens = []
+        else:
+            start = time_stamp  # Opening timestamp (or the second of a consecutive pair)
+            segment_tokens = [token]
+    if text_tokens:
+        close_segment(max(duration, start or 0.0))
+    return segments
+
+
+def decode_batch(model, audios, task="transcribe", language=None, initial_prompt=None):
+    """Transcribes up to 30 s clips in one batched encoder/decoder pass; returns one result per clip."""
+    mel = torch.stack([whisper.log_mel_spectrogram(whisper.pad_or_trim(audio), model.dims.n_mels)
+                       for audio in audios]).to(model.device)
+    options = whisper.DecodingOptions(task=task, language=language, temperature=0.0, prompt=initial_prompt,
+                                      fp16=model.device.type == "cuda")
+    with torch.no_grad():
+        decode_results = whisper.decode(model, mel, options)
+    tokenizer = get_tokenizer(model.is_multilingual, num_languages=model.num_languages, task=task)
+
+    results = []
+    for audio, decode_result in zip(audios, decode_results):
+        if (decode_result.no_speech_prob > NO_SPEECH_THRESHOLD
+                and decode_result.avg_logprob < LOGPROB_THRESHOLD):
+            segments = []  # Silence, skipped like whisper.transcribe does
+        else:
+            segments = segments_from_tokens(decode_result.tokens, tokenizer, len(audio) / whisper.audio.SAMPLE_RATE,
+                                            decode_result)
+        results.append({
+            "text": "".join(segment["text"] for segment in segments),
+            "segments": segments,
+            "language": decode_result.language,
+        })
+    return results
+
+
+class _BatchRequest:
+    def __init__(self, audio):
+        self.audio = audio
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class BatchCollector:
+    """Groups concurrent requests by key; the first request of a group decodes it for everyone."""
+
+    def __init__(self, window_ms=BATCH_WINDOW_MS, max_size=BATCH_MAX_SIZE):
+        self.window_seconds = window_ms / 1000.0
+        self.max_size = max(1, max_size)
+        self._condition = threading.Condition()
+        self._pending = {}  # batch_key -> list of _BatchRequest waiting for the leader
+        self.batches = 0
+        self.items = 0
+
+    def submit(self, batch_key, model, audio, **decode_options):
+        """Blocks until the batch containing `audio` has been decoded and returns its result."""
+        request = _BatchRequest(audio)
+        with self._condition:
+            group = self._pending.get(batch_key)
+            is_leader = group is None
+            if is_leader:
+                group = self._pending[batch_key] = []
+            group.append(request)
+            if len(group) >= self.max_size:
+                self._pending.pop(batch_key, None)  # Full: later arrivals start a new group
+                self._condition.notify_all()
+            if is_leader:
+                deadline = time.monotonic() + self.window_seconds
+                while self._pending.get(batch_key) is group:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        del self._pending[batch_key]
+                        break
+                    self._condition.wait(remaining)
+
+        if is_leader:
+            self._run(model, group, decode_options)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _run(self, model, group, decode_options):
+        try:
+            with inference_lock(model):
+                results = decode_batch(model, [r.audio for r in group], **decode_options)
+            for request, result in zip(group, results):
+                request.result = result
+        except Exception as e:
+            for request in group:
+                request.error = e
+        finally:
+            with self._condition:
+                self.batches += 1
+                self.items += len(group)
+            for request in group:
+                request.done.set()
+
+    def stats(self):
+        with self._condition:
+            return {"window_ms": int(self.window_seconds * 1000), "max_size": self.max_size,
+                    "batches": self.batches, "items": self.items,
+                    "mean_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0}
+
+
+batch_collector = BatchCollector()
@@ -0,0 +1,66 @@
+# benchmarks/compare.py
+# Compares two result files of benchmarks/run.py and flags regressions.
+#
+#   python -m benchmarks.compare baseline.json current.json --threshold 10
+#
+# Exits with status 1 if any metric got worse by more than the threshold (percent).
+import argparse
+import json
+import sys
+
+
+def load_report(path):
+    with open(path) as handle:
+        return json.load(handle)
+
+
+def compare_reports(baseline, current, threshold_percent):
+    """Returns rows of (metric, baseline, current, change_percent, verdict) for metrics present in both."""
+    rows = []
+    for name in sorted(set(baseline["metrics"]) | set(current["metrics"])):
+        before = baseline["metrics"].get(name)
+        after = current["metrics"].get(name)
+        if before is None or after is None:
+            rows.append((name, before and before["value"], after and after["value"], None,
+                         "new" if before is None else "missing"))
+            continue
+        if before["value"] == 0:
+            change = 0.0 if after["value"] == 0 else float('inf')
+        else:
+            change = (after["value"] - before["value"]) / abs(before["value"]) * 100
+        worse = change > threshold_percent if after["better"] == 'lower' else change < -threshold_percent
+        better = change < -threshold_percent if after["better"] == 'lower' else change > threshold_percent
+        rows.append((name, before["value"], after["value"], change,
+                     "REGRESSION" if worse else "improved" if better else "ok"))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files.")
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=10.0, help="Allowed change in percent before flagging")
+    args = parser.parse_args(argv)
+
+    baseline, current = load_report(args.baseline), load_report(args.current)
+    for key in ('random_weights', 'cpu_quantize', 'cpu_count', 'torch_threads'):
+        if baseline["meta"].get(key) != current["meta"].get(key):
+            print(f"Warning: runs differ in {key} ({baseline['meta'].get(key)} vs {current['meta'].get(key)})")
+
+    rows = compare_reports(baseline, current, args.threshold)
+    print(f"{'metric':<50} {'baseline':>12} {'current':>12} {'change':>9}  verdict")
+    for name, before, after, change, verdict in rows:
+        before_text = f"{before:12.4f}" if before is not None else f"{'-':>12}"
+        after_text = f"{after:12.4f}" if after is not None else f"{'-':>12}"
+        change_text = f"{change:+8.1f}%" if change is not None else f"{'-':>9}"
+        print(f"{name:<50} {before_text} {after_text} {change_text}  {verdict}")
+
+    regressions = [row for row in rows if row[4] == "REGRESSION"]
+    if regressions:
+        print(f"{len(regressions)} regression(s) above {args.threshold:g}%")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
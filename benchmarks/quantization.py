@@ -0,0 +1,136 @@
+# benchmarks/quantization.py
+# Accuracy and speed check of INT8 CPU inference (WHISPER_CPU_QUANTIZE) against fp32, per model.
+#
+#   python -m benchmarks.quantization --fixtures fixtures/ --models tiny,base --output quant.json
+#
+# The fixture directory holds audio files (any format ffmpeg reads). A reference transcript
+# next to an audio file (same name, .txt) is used for the WER. Without references the fp32
+# transcript is the reference, so the report shows how far INT8 diverges from fp32.
+# A model is recommended for quantization when its WER increase stays within --max-wer-delta.
+import argparse
+import json
+import os
+import sys
+import time
+
+import torch
+import whisper
+from whisper.normalizers import BasicTextNormalizer, EnglishTextNormalizer
+
+from whisper_wrapper import load_audio_samples, quantize_model_int8
+
+AUDIO_EXTENSIONS = {'.wav', '.mp3', '.m4a', '.ogg', '.flac', '.aac', '.opus', '.f32'}
+
+
+def word_errors(reference_words, hypothesis_words):
+    """Levenshtein distance over words (substitutions + deletions + insertions)."""
+    previous = list(range(len(hypothesis_words) + 1))
+    for i, reference_word in enumerate(reference_words, start=1):
+        current = [i] + [0] * len(hypothesis_words)
+        for j, hypothesis_word in enumerate(hypothesis_words, start=1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1,
+                             previous[j - 1] + (reference_word != hypothesis_word))
+        previous = current
+    return previous[-1]
+
+
+def load_fixtures(directory):
+    fixtures = []
+    for name in sorted(os.listdir(directory)):
+        stem, extension = os.path.splitext(name)
+        if extension.lower() not in AUDIO_EXTENSIONS:
+            continue
+        reference_path = os.path.join(directory, stem + '.txt')
+        reference = None
+        if os.path.exists(reference_path):
+            with open(reference_path, encoding='utf-8') as handle:
+                reference = handle.read()
+        fixtures.append({"name": name, "audio": load_audio_samples(os.path.join(directory, name)),
+                         "reference": reference})
+    return fixtures
+
+
+def transcribe_all(model, fixtures, language):
+    transcripts = []
+    elapsed = 0.0
+    for fixture in fixtures:
+        started = time.perf_counter()
+        result = model.transcribe(fixture["audio"], language=language, temperature=0.0, fp16=False, verbose=None)
+        elapsed += time.perf_counter() - started
+        transcripts.append(result["text"])
+    return transcripts, elapsed
+
+
+def corpus_wer(references, hypotheses, normalize):
+    errors = words = 0
+    for reference, hypothesis in zip(references, hypotheses):
+        reference_words = normalize(reference).split()
+        errors += word_errors(reference_words, normalize(hypothesis).split())
+        words += len(reference_words)
+    return errors / words if words else 0.0
+
+
+def check_model(model_name, fixtures, language, normalize):
+    audio_seconds = sum(len(f["audio"]) for f in fixtures) / whisper.audio.SAMPLE_RATE
+    fp32_model = whisper.load_model(model_name, device="cpu")
+    fp32_text, fp32_seconds = transcribe_all(fp32_model, fixtures, language)
+    del fp32_model
+    int8_model = quantize_model_int8(whisper.load_model(model_name, device="cpu"))
+    int8_text, int8_seconds = transcribe_all(int8_model, fixtures, language)
+    del int8_model
+
+    has_references = all(f["reference"] is not None for f in fixtures)
+    references = [f["reference"] for f in fixtures] if has_references else fp32_text
+    fp32_wer = corpus_wer(references, fp32_text, normalize)
+    int8_wer = corpus_wer(references, int8_text, normalize)
+    return {
+        "reference": "fixtures" if has_references else "fp32",
+        "fp32_wer": round(fp32_wer, 4),
+        "int8_wer": round(int8_wer, 4),
+        "wer_delta": round(int8_wer - fp32_wer, 4),
+        "fp32_rtf": round(fp32_seconds / audio_seconds, 4),
+        "int8_rtf": round(int8_seconds / audio_seconds, 4),
+        "speedup": round(fp32_seconds / int8_seconds, 3) if int8_seconds else None,
+        "per_fixture": [{"name": f["name"], "fp32": a, "int8": b} for f, a, b in zip(fixtures, fp32_text, int8_text)],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="WER delta and speedup of INT8 dynamic quantization per model.")
+    parser.add_argument('--fixtures', required=True, help="Directory with audio files and optional .txt references")
+    parser.add_argument('--models', default='tiny,base')
+    parser.add_argument('--language', default='en', help="Language of the fixtures (selects the text normalizer)")
+    parser.add_argument('--max-wer-delta', type=float, default=0.01, help="Largest acceptable absolute WER increase")
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args(argv)
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    normalize = EnglishTextNormalizer() if args.language in (None, '', 'en') else BasicTextNormalizer()
+    fixtures = load_fixtures(args.fixtures)
+    if not fixtures:
+        raise SystemExit(f"No audio fixtures found in {args.fixtures}")
+
+    report = {"fixtures": len(fixtures), "torch_threads": torch.get_num_threads(),
+              "max_wer_delta": args.max_wer_delta, "models": {}}
+    recommended = []
+    for model_name in [m.strip() for m in args.models.split(',') if m.strip()]:
+        outcome = check_model(model_name, fixtures, args.language or None, normalize)
+        outcome["quantize"] = outcome["wer_delta"] <= args.max_wer_delta
+        report["models"][model_name] = outcome
+        if outcome["quantize"]:
+            recommended.append(model_name)
+        print(f"{model_name:<10} WER fp32 {outcome['fp32_wer']:.4f}  int8 {outcome['int8_wer']:.4f}  "
+              f"delta {outcome['wer_delta']:+.4f}  speedup {outcome['speedup']}x  "
+              f"(reference: {outcome['reference']}) -> {'quantize' if outcome['quantize'] else 'keep fp32'}")
+
+    print(f"Suggested setting: WHISPER_CPU_QUANTIZE={','.join(recommended)}")
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(report, handle, indent=2)
+    return report
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,292 @@
+# benchmarks/run.py
+# Offline benchmark suite: model load time, real-time factor of transcribe_audio, formatter
+# throughput and end-to-end /transcribe -> /status latency under concurrent submissions.
+#
+#   python -m benchmarks.run --models tiny,base --output bench.json
+#   python -m benchmarks.compare baseline.json bench.json
+#
+# Everything runs on synthetic audio on the CPU. Model checkpoints must already be in Whisper's
+# cache (see pull_models.py); --random-weights runs the same architectures with random weights,
+# which needs no checkpoints at all (timings remain comparable between runs, transcripts do not).
+# The end-to-end part runs Celery in eager mode with an in-memory result backend by default, or
+# against a running broker and worker with --e2e-mode live.
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from benchmarks.synthetic_audio import synthetic_speech, synthetic_segments, to_wav_bytes
+
+# Architectures of the benchmarked models, used for --random-weights
+MODEL_DIMENSIONS = {
+    "tiny": dict(n_mels=80, n_audio_ctx=1500, n_audio_state=384, n_audio_head=6, n_audio_layer=4,
+                 n_vocab=51865, n_text_ctx=448, n_text_state=384, n_text_head=6, n_text_layer=4),
+    "base": dict(n_mels=80, n_audio_ctx=1500, n_audio_state=512, n_audio_head=8, n_audio_layer=6,
+                 n_vocab=51865, n_text_ctx=448, n_text_state=512, n_text_head=8, n_text_layer=6),
+}
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else None
+
+
+def add_metric(metrics, name, value, unit, better='lower'):
+    metrics[name] = {"value": round(float(value), 6), "unit": unit, "better": better}
+    print(f"  {name:<48} {value:>12.4f} {unit}")
+
+
+def checkpoint_path(model_name):
+    import whisper
+    cache_dir = os.path.join(os.getenv("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")), "whisper")
+    return os.path.join(cache_dir, os.path.basename(whisper._MODELS[model_name]))
+
+
+def random_model(dims):
+    """
+    Whisper with random weights from torch's generator. The text decoder's positional embedding is
+    allocated uninitialized (a checkpoint always overwrites it), so it is drawn here as well; left as
+    is, the model decodes whatever was in that memory, which can be inf or NaN.
+    """
+    import torch
+    from whisper.model import Whisper
+    model = Whisper(dims)
+    with torch.no_grad():
+        model.decoder.positional_embedding.normal_(std=0.01)
+    return model.eval()
+
+
+def build_model(model_name, random_weights):
+    """Loads the model on the CPU (bypassing the service's model cache)."""
+    import torch
+    import whisper
+    from whisper.model import ModelDimensions
+    if random_weights:
+        torch.manual_seed(0)
+        return random_model(ModelDimensions(**MODEL_DIMENSIONS[model_name.split('.')[0]]))
+    if not os.path.exists(checkpoint_path(model_name)):
+        raise SystemExit(f"Checkpoint for '{model_name}' is not cached; run pull_models.py or use --random-weights")
+    return whisper.load_model(model_name, device="cpu")
+
+
+def seed_model_cache(model_name, random_weights):
+    """Puts the model into the service's model cache the way load_whisper_model would (INT8 if configured)."""
+    import whisper_wrapper
+    device = whisper_wrapper.DEFAULT_DEVICE_WHISPER
+    quantized = whisper_wrapper.quantization_enabled(model_name, device)
+    model = build_model(model_name, random_weights)
+    if quantized:
+        model = whisper_wrapper.quantize_model_int8(model)
+    whisper_wrapper.model_cache.put(whisper_wrapper.model_cache_key(model_name, device, quantized), model)
+
+
+def bench_model_load(args, metrics):
+    print("Model load")
+    for model_name in args.models:
+        timings = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            model = build_model(model_name, args.random_weights)
+            timings.append(time.perf_counter() - started)
+            del model
+        add_metric(metrics, f"load.{model_name}.seconds", statistics.median(timings), "s")
+
+
+def bench_transcribe(args, metrics):
+    """Real-time factor (processing time / audio duration) of whisper_wrapper.transcribe_audio."""
+    import whisper_wrapper
+    print("Transcription (real-time factor)")
+    for model_name in args.models:
+        seed_model_cache(model_name, args.random_weights)  # transcribe_audio then measures decoding only
+        for duration in args.durations:
+            with tempfile.NamedTemporaryFile(suffix=whisper_wrapper.PCM_SUFFIX, delete=False) as handle:
+                pcm_path = handle.name
+            whisper_wrapper.save_pcm(pcm_path, synthetic_speech(duration, seed=int(duration)))
+            timings = []
+            try:
+                for _ in range(args.repeat):
+                    started = time.perf_counter()
+                    result = whisper_wrapper.transcribe_audio(pcm_path, model_name=model_name, language="en",
+                                                              temperature=0.0, best_of=None, verbose=None)
+                    timings.append(time.perf_counter() - started)
+                    if "error" in result:
+                        raise RuntimeError(result["error"])
+            finally:
+                os.remove(pcm_path)
+            elapsed = statistics.median(timings)
+            add_metric(metrics, f"transcribe.{model_name}.{duration:g}s.seconds", elapsed, "s")
+            add_metric(metrics, f"transcribe.{model_name}.{duration:g}s.rtf", elapsed / duration, "x")
+
+
+def bench_formatters(args, metrics):
+    """Segments per second through /status rendering (formatting + JSON body) and the compact result encoding."""
+    from compact_result import decode_result, encode_result
+    from render_cache import render_status_body
+    print(f"Formatters ({args.segments} segments)")
+    result = synthetic_segments(args.segments)
+    cases = {f"format.{fmt}{'.simplified' if simplified else ''}":
+             (lambda fmt=fmt, simplified=simplified: render_status_body("benchmark", result, fmt, simplified))
+             for fmt in ('json', 'txt', 'srt', 'vtt', 'tsv') for simplified in (False, True)}
+    compact = encode_result(result)
+    cases["compact.encode"] = lambda: encode_result(result)
+    cases["compact.decode"] = lambda: decode_result(compact)
+    for name, run in cases.items():
+        timings = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - started)
+        add_metric(metrics, f"{name}.segments_per_second", args.segments / statistics.median(timings),
+                   "segments/s", better='higher')
+
+
+def bench_end_to_end(args, metrics):
+    """Latency from POST /transcribe to a SUCCESS from /status for concurrent clients."""
+    if args.e2e_mode == 'eager':
+        from celery_worker_app import celery
+        celery.conf.update(task_always_eager=True, task_store_eager_result=True)
+    from app import app
+
+    model_name = args.models[0]
+    if args.e2e_mode == 'eager':
+        seed_model_cache(model_name, args.random_weights)
+    clips = [to_wav_bytes(synthetic_speech(args.e2e_duration, seed=1000 + i)) for i in range(args.e2e_requests)]
+    print(f"End to end ({args.e2e_mode}, {model_name}, {args.e2e_requests} requests, concurrency {args.concurrency})")
+
+    def submit_and_wait(index):
+        client = app.test_client()
+        started = time.perf_counter()
+        response = client.post('/transcribe', content_type='multipart/form-data', data={
+            'audio_file': (io.BytesIO(clips[index]), f'clip{index}.wav'),
+            'model_name': model_name, 'language': 'en', 'temperature': '0', 'best_of': '',
+        })
+        if response.status_code != 202:
+            raise RuntimeError(f"/transcribe answered {response.status_code}: {response.get_data(as_text=True)}")
+        task_id = response.get_json()["task_id"]
+        while True:
+            status = client.get(f'/status/{task_id}?output_format=json').get_json()
+            if status["status"] == 'SUCCESS':
+                # Errors are returned as {"error": ...} and end in SUCCESS too
+                details = (status["result"] or {}).get("transcription_details") or {}
+                if "error" in details or "text" not in details:
+                    return time.perf_counter() - started, details.get("error", "no transcript (the task returned an error)")
+                return time.perf_counter() - started, 'SUCCESS'
+            if status["status"] == 'FAILURE':
+                return time.perf_counter() - started, status["error_info"] or 'FAILURE'
+            time.sleep(args.poll_interval)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        outcomes = list(pool.map(submit_and_wait, range(args.e2e_requests)))
+    wall_time = time.perf_counter() - started
+
+    latencies = [latency for latency, state in outcomes if state == 'SUCCESS']
+    failures = len(outcomes) - len(latencies)
+    if failures:
+        first_error = next(state for _, state in outcomes if state != 'SUCCESS')
+        print(f"  {failures} of {len(outcomes)} requests failed, e.g.: {first_error}")
+    for q in (50, 95, 99):
+        if latencies:
+            add_metric(metrics, f"e2e.{model_name}.latency_p{q}", percentile(latencies, q), "s")
+    add_metric(metrics, f"e2e.{model_name}.throughput", len(latencies) / wall_time, "requests/s", better='higher')
+    add_metric(metrics, f"e2e.{model_name}.failures", failures, "requests")
+
+
+def environment_info(args):
+    import torch
+    import whisper
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        "git_commit": commit or None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "torch": torch.__version__,
+        "torch_threads": torch.get_num_threads(),
+        "whisper": getattr(whisper, '__version__', None),
+        "random_weights": args.random_weights,
+        "cpu_quantize": os.environ.get('WHISPER_CPU_QUANTIZE', ''),
+        "arguments": {k: v for k, v in vars(args).items() if k != 'output'},
+    }
+
+
+BENCHMARKS = {
+    'load': bench_model_load,
+    'transcribe': bench_transcribe,
+    'format': bench_formatters,
+    'e2e': bench_end_to_end,
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the Whisper API service.")
+    parser.add_argument('--only', default=','.join(BENCHMARKS), help="Comma-separated subset of: " + ', '.join(BENCHMARKS))
+    parser.add_argument('--models', default='tiny,base', help="Comma-separated models (tiny, base)")
+    parser.add_argument('--durations', default='10,60', help="Audio durations in seconds for the RTF benchmark")
+    parser.add_argument('--repeat', type=int, default=3, help="Repetitions per measurement (median is reported)")
+    parser.add_argument('--segments', type=int, default=5000, help="Segment count for the formatter benchmark")
+    parser.add_argument('--e2e-mode', choices=['eager', 'live'], default='eager',
+                        help="eager: Celery eager mode with an in-memory result backend; live: running broker and worker")
+    parser.add_argument('--e2e-requests', type=int, default=32)
+    parser.add_argument('--e2e-duration', type=float, default=8.0, help="Seconds of audio per end-to-end request")
+    parser.add_argument('--concurrency', type=int, default=8, help="Concurrent clients for the end-to-end benchmark")
+    parser.add_argument('--poll-interval', type=float, default=0.05)
+    parser.add_argument('--threads', type=int, default=None, help="torch.set_num_threads for the run")
+    parser.add_argument('--random-weights', action='store_true', help="Use randomly initialised models (no checkpoints)")
+    parser.add_argument('--output', default=None, help="Write the JSON results to this file")
+    args = parser.parse_args(argv)
+    args.only = [name.strip() for name in args.only.split(',') if name.strip()]
+    args.models = [name.strip() for name in args.models.split(',') if name.strip()]
+    args.durations = [float(d) for d in args.durations.split(',') if d.strip()]
+    unknown = set(args.only) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if 'e2e' in args.only and args.e2e_mode == 'eager':
+        # Must be set before the app and the Celery app are imported
+        os.environ.setdefault('CELERY_RESULT_BACKEND', 'cache+memory://')
+        os.environ.setdefault('CELERY_BROKER_URL', 'memory://')
+        os.environ.setdefault('TASK_EVENTS_ENABLED', 'false')
+        os.environ.setdefault('RENDER_CACHE_REDIS_URL', '')
+    os.environ.setdefault('RESULT_CACHE_ENABLED', 'false')  # Every request must really be decoded
+
+    import torch
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    metrics = {}
+    for name in args.only:
+        BENCHMARKS[name](args, metrics)
+
+    report = {"meta": environment_info(args), "metrics": metrics}
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(report, handle, indent=2, sort_keys=True)
+        print(f"Results written to {args.output}")
+    return report
+
+
+def failed_requests(report):
+    return sum(metric["value"] for name, metric in report["metrics"].items() if name.endswith('.failures'))
+
+
+if __name__ == '__main__':
+    if failed_requests(main(sys.argv[1:])):
+        sys.exit(1)  # Timings of failed requests are not worth comparing
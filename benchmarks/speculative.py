@@ -0,0 +1,116 @@
+# benchmarks/speculative.py
+# Speed and equivalence check of speculative decoding (speculative.py) against plain greedy decoding.
+#
+#   python -m benchmarks.speculative --fixtures fixtures/ --models large-v3,turbo --draft tiny --output spec.json
+#   python -m benchmarks.speculative --random-weights --models base --draft tiny
+#
+# Each fixture is transcribed greedily by the target model, once plainly and once with the draft
+# model proposing tokens, for every --draft-tokens setting. The report shows the speedup, the share
+# of draft tokens the target accepted, the tokens produced per target decoder pass and whether the
+# transcripts are identical (they should be, up to floating-point ties). Without --fixtures,
+# synthetic audio of --durations seconds is used; its transcripts are meaningless, but timings
+# and equivalence still are. --random-weights only knows the tiny and base architectures.
+import argparse
+import json
+import sys
+import time
+
+import torch
+import whisper
+
+import speculative
+from benchmarks.quantization import load_fixtures
+from benchmarks.run import build_model
+from benchmarks.synthetic_audio import synthetic_speech
+from transcribe_loop import transcribe_windows
+from whisper_wrapper import speculative_window_decoder
+
+
+def transcribe_all(model, fixtures, language, draft=None):
+    """(token lists per fixture, seconds, acceptance stats) of greedy transcriptions."""
+    outputs, elapsed = [], 0.0
+    totals = {"drafted": 0, "accepted": 0, "passes": 0, "tokens": 0}
+    for fixture in fixtures:
+        started = time.perf_counter()
+        if draft is None:
+            result = transcribe_windows(model, fixture["audio"], language=language, temperature=0.0, fp16=False)
+        else:
+            decode_window, stats = speculative_window_decoder(model, draft, fixture["audio"])
+            result = transcribe_windows(model, fixture["audio"], language=language, temperature=0.0, fp16=False,
+                                        decode_window=decode_window)
+            for name in totals:
+                totals[name] += stats[name]
+        elapsed += time.perf_counter() - started
+        outputs.append({"text": result["text"], "tokens": [s["tokens"] for s in result["segments"]]})
+    return outputs, elapsed, totals
+
+
+def check_model(model_name, draft, fixtures, language, draft_tokens, random_weights):
+    model = build_model(model_name, random_weights)
+    plain, plain_seconds, _ = transcribe_all(model, fixtures, language)
+    runs = {}
+    for tokens in draft_tokens:
+        speculative.SPECULATIVE_DRAFT_TOKENS = tokens
+        drafted, seconds, stats = transcribe_all(model, fixtures, language, draft)
+        identical = sum(a["tokens"] == b["tokens"] for a, b in zip(plain, drafted))
+        runs[str(tokens)] = {
+            "seconds": round(seconds, 3),
+            "speedup": round(plain_seconds / seconds, 3) if seconds else None,
+            "acceptance_rate": round(stats["accepted"] / stats["drafted"], 4) if stats["drafted"] else None,
+            "tokens_per_pass": round(stats["tokens"] / stats["passes"], 3) if stats["passes"] else None,
+            "identical_fixtures": identical,
+            "differing": [f["name"] for f, a, b in zip(fixtures, plain, drafted) if a["tokens"] != b["tokens"]],
+        }
+    del model
+    return {"plain_seconds": round(plain_seconds, 3), "draft_tokens": runs}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Speedup and equivalence of draft-model speculative decoding.")
+    parser.add_argument('--fixtures', default=None, help="Directory with audio files (default: synthetic audio)")
+    parser.add_argument('--durations', default='30,120', help="Synthetic audio durations in seconds (no --fixtures)")
+    parser.add_argument('--models', default='large-v3', help="Comma-separated target models")
+    parser.add_argument('--draft', default=speculative.SPECULATIVE_DRAFT_MODEL, help="Draft model")
+    parser.add_argument('--draft-tokens', default='4,6,8', help="Comma-separated proposals per pass to compare")
+    parser.add_argument('--language', default='en')
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--random-weights', action='store_true', help="Use randomly initialised models (no checkpoints)")
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args(argv)
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    if args.fixtures:
+        fixtures = load_fixtures(args.fixtures)
+        if not fixtures:
+            raise SystemExit(f"No audio fixtures found in {args.fixtures}")
+    else:
+        fixtures = [{"name": f"synthetic-{d}s", "audio": synthetic_speech(float(d)), "reference": None}
+                    for d in args.durations.split(',') if d.strip()]
+    draft_tokens = [int(t) for t in args.draft_tokens.split(',') if t.strip()]
+    audio_seconds = sum(len(f["audio"]) for f in fixtures) / whisper.audio.SAMPLE_RATE
+
+    report = {"fixtures": len(fixtures), "audio_seconds": round(audio_seconds, 1),
+              "torch_threads": torch.get_num_threads(), "models": {}}
+    for model_name in [m.strip() for m in args.models.split(',') if m.strip()]:
+        draft_name = speculative.draft_model_name(model_name) if args.draft == speculative.SPECULATIVE_DRAFT_MODEL \
+            else args.draft
+        draft = build_model(draft_name, args.random_weights)
+        outcome = check_model(model_name, draft, fixtures, args.language or None, draft_tokens, args.random_weights)
+        outcome["draft"] = draft_name
+        del draft
+        report["models"][model_name] = outcome
+        for tokens, run in outcome["draft_tokens"].items():
+            print(f"{model_name:<10} draft {draft_name} x{tokens}: plain {outcome['plain_seconds']:.2f}s  "
+                  f"speculative {run['seconds']:.2f}s  speedup {run['speedup']}x  "
+                  f"accepted {run['acceptance_rate']}  tokens/pass {run['tokens_per_pass']}  "
+                  f"identical {run['identical_fixtures']}/{len(fixtures)}")
+
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(report, handle, indent=2)
+    return report
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,67 @@
+# benchmarks/synthetic_audio.py
+# Deterministic speech-like test audio, so benchmark runs need no recordings and no network.
+import io
+import wave
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+
+
+def synthetic_speech(duration_seconds, seed=0, sample_rate=SAMPLE_RATE):
+    """
+    Alternating "utterances" (harmonic stacks with a wandering pitch and syllable-rate amplitude
+    modulation) and pauses over low background noise, as float32 samples in [-1, 1].
+    """
+    rng = np.random.default_rng(seed)
+    n_samples = int(duration_seconds * sample_rate)
+    audio = 0.002 * rng.standard_normal(n_samples)
+    position = int(rng.uniform(0.2, 1.0) * sample_rate)
+    while position < n_samples:
+        length = min(int(rng.uniform(1.0, 4.0) * sample_rate), n_samples - position)
+        t = np.arange(length) / sample_rate
+        pitch = rng.uniform(100, 220) * (1 + 0.1 * np.sin(2 * np.pi * rng.uniform(0.5, 2.0) * t))
+        phase = 2 * np.pi * np.cumsum(pitch) / sample_rate
+        voiced = sum(np.sin(k * phase) / k for k in range(1, 16))
+        envelope = 0.5 * (1 + np.sin(2 * np.pi * rng.uniform(3, 6) * t)) * np.hanning(length)
+        audio[position:position + length] += 0.1 * voiced * envelope
+        position += length + int(rng.uniform(0.3, 2.0) * sample_rate)
+    return np.clip(audio, -1.0, 1.0).astype(np.float32)
+
+
+def to_wav_bytes(audio, sample_rate=SAMPLE_RATE):
+    """16-bit mono WAV container for the samples (what a client would upload)."""
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes((audio * 32767).astype('<i2').tobytes())
+    return buffer.getvalue()
+
+
+def synthetic_segments(n_segments, words_per_segment=12, seed=0):
+    """Whisper-shaped result segments (with word timestamps) for formatter benchmarks."""
+    rng = np.random.default_rng(seed)
+    vocabulary = ["alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel", "india", "juliett"]
+    segments = []
+    start = 0.0
+    for segment_id in range(n_segments):
+        words = []
+        word_start = start
+        for _ in range(words_per_segment):
+            word_end = word_start + float(rng.uniform(0.15, 0.6))
+            words.append({"word": " " + vocabulary[int(rng.integers(len(vocabulary)))],
+                          "start": round(word_start, 2), "end": round(word_end, 2),
+                          "probability": float(rng.uniform(0.5, 1.0))})
+            word_start = word_end
+        segments.append({
+            "id": segment_id, "seek": int(start * 100), "start": round(start, 2), "end": round(word_start, 2),
+            "text": "".join(word["word"] for word in words),
+            "tokens": [int(t) for t in rng.integers(50365, 51865, size=words_per_segment + 2)],
+            "temperature": 0.0, "avg_logprob": float(rng.uniform(-1.0, 0.0)),
+            "compression_ratio": float(rng.uniform(1.0, 2.4)), "no_speech_prob": float(rng.uniform(0.0, 0.2)),
+            "words": words,
+        })
+        start = word_start + float(rng.uniform(0.1, 1.0))
+    return {"text": "".join(segment["text"] for segment in segments), "segments": segments, "language": "en"}
@@ -37,17 +37,87 @@ except RuntimeError as e:
         print(f"Celery Worker (Attempting Setup): Current method: {multiprocessing.get_start_method(allow_none=True)}")
 # --- End of multiprocessing start method setting ---
 
-from celery import Celery
+from celery import Celery, chord
 import os
+import time
 # import torch
 from whisper_wrapper import transcribe_audio as actual_transcribe_function
-from whisper_wrapper import load_whisper_model # For preloading
-from celery.signals import worker_process_init
+from whisper_wrapper import load_whisper_model, model_cache # For preloading
+from whisper_wrapper import configure_torch_threads
+from batching import batch_collector
+from whisper_wrapper import load_audio_samples, save_pcm, PCM_SUFFIX, SAMPLE_RATE
+from chunking import plan_chunks, merge_chunk_results, core_segments, chunk_progress, CHUNK_MIN_DURATION_SECONDS
+from result_cache import result_cache
+from render_cache import render_cache, RENDER_EAGER_FORMATS
+from compact_result import pack_result, unpack_result
+from task_events import (publish_task_event, append_partial_segments, clear_partial_segments, record_chunk_progress,
+                         TERMINAL_STATES)
+from celery.signals import (worker_init, worker_process_init, worker_process_shutdown, worker_ready,
+                            celeryd_after_setup, before_task_publish, task_prerun, task_postrun)
+from celery.utils.log import get_task_logger
+from celery.worker.control import inspect_command, control_command, ok, nok
+from metrics import stage_timer, observe_stage, start_worker_exporter, mark_process_exited, TASK_OUTCOMES
+from shared_weights import SHARED_WEIGHTS_ENABLED, export_models
+from scheduling import LANE_PRIORITIES, record_task_done
+from speculative import SPECULATIVE_DEFAULT, draft_model_name
+from autoscaling import (record_request, task_started, task_finished, start_process_heartbeat, start_worker_heartbeat,
+                         build_snapshot, model_of_cache_key, read_supply, signals_enabled, WARM_POOL_MAX_PROCESSES)
+
+logger = get_task_logger(__name__)
 
 # Define default broker and backend URLs, allowing override via environment variables
 CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0')
 CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
 
+# --- Model-affinity routing ---
+# WHISPER_ROUTED_MODELS: comma-separated models that get a dedicated 'whisper.<model>' queue, or '*' for all.
+#   Empty (default) keeps every task on Celery's default queue.
+# WHISPER_OVERFLOW_QUEUE: queue for models without a dedicated queue (e.g. 'whisper.overflow').
+#   Empty (default) sends them to the default queue.
+# WHISPER_WORKER_MODELS: models this worker preloads. Defaults to the models of the 'whisper.<model>'
+#   queues the worker consumes (-Q), or 'base' when it consumes none.
+MODEL_QUEUE_PREFIX = 'whisper.'
+WHISPER_ROUTED_MODELS = [m.strip() for m in os.environ.get('WHISPER_ROUTED_MODELS', '').split(',') if m.strip()]
+WHISPER_OVERFLOW_QUEUE = os.environ.get('WHISPER_OVERFLOW_QUEUE', '').strip()
+DEFAULT_PRELOAD_MODELS = ['base']
+MODEL_ROUTED_TASKS = {'transcribe_audio_task', 'transcribe_long_audio_task', 'merge_chunks_task'}
+
+
+def queue_for_model(model_name):
+    """Queue a task for this model should go to, or None for Celery's default queue."""
+    if model_name and ('*' in WHISPER_ROUTED_MODELS or model_name in WHISPER_ROUTED_MODELS):
+        return f"{MODEL_QUEUE_PREFIX}{model_name}"
+    return WHISPER_OVERFLOW_QUEUE or None
+
+
+def route_by_model(name, args, kwargs, options, task=None, **kw):
+    """Celery router: sends transcription tasks to the queue of the model they need."""
+    if name not in MODEL_ROUTED_TASKS:
+        return None
+    queue = queue_for_model((kwargs or {}).get('model_name'))
+    return {'queue': queue} if queue else None
+
+
+def routed_queues():
+    """Every queue transcription tasks can be routed to (default queue first), e.g. for /queues."""
+    models = WHISPER_ROUTED_MODELS
+    if '*' in models:
+        import whisper
+        models = whisper.available_models()
+    queues = [celery.conf.task_default_queue] + [queue_for_model(m) for m in models]
+    return list(dict.fromkeys(q for q in queues if q))
+
+
+def worker_models():
+    """Models this worker process should keep warm."""
+    declared = [m.strip() for m in os.environ.get('WHISPER_WORKER_MODELS', '').split(',') if m.strip()]
+    return declared or DEFAULT_PRELOAD_MODELS
+
+
+def autoscale_snapshot():
+    """Demand/supply snapshot of all workers (autoscaling.py), as served by /autoscale."""
+    return build_snapshot(lambda model_name: queue_for_model(model_name) or celery.conf.task_default_queue)
+
 celery = Celery(
     'whisper_tasks', # Namespace for your tasks
     broker=CELERY_BROKER_URL,
@@ -64,26 +134,62 @@ celery.conf.update(
     enable_utc=True,
     worker_prefetch_multiplier=1, # Important for long-running tasks, especially with concurrency 1
     task_acks_late=True, # Acknowledge task only after it's completed (or failed)
+    task_routes=(route_by_model,),
+    # Priority lanes (scheduling.py): one Redis list per lane and queue, lower priority values are served first
+    task_default_priority=LANE_PRIORITIES['default'],
+    broker_transport_options={'priority_steps': sorted(set(LANE_PRIORITIES.values()))},
 )
 
 @celery.task(name='transcribe_audio_task', bind=True) # bind=True gives access to self (the task instance)
-def transcribe_audio_task(self, audio_path, model_name, task_type, language, initial_prompt, temperature, best_of, word_timestamps, verbose):
+def transcribe_audio_task(self, audio_path, model_name, task_type, language, initial_prompt, temperature, best_of, word_timestamps, verbose, cache_key=None, vad=None, audio_id=None, speculative=None,
+                          parent_task_id=None, chunk_index=None, chunks=None):
     """
     Celery task to transcribe audio.
+    cache_key: result cache key computed by the API; the result is published to the shared
+    (Redis) tier of the result cache so later uploads of the same audio skip the decode.
+    vad: VAD detector name; silent regions are skipped before decoding.
+    audio_id: id of the upload in the audio store (decoded PCM and spectrogram are reused or kept).
+    speculative: decode greedy windows with a draft model (None: worker default).
+    parent_task_id, chunk_index, chunks: set for the chunks of transcribe_long_audio_task; progress
+    and partial segments are then reported under the id the client polls.
     """
-    print(f"Celery Task [{self.request.id}]: Starting transcription for {audio_path} with model {model_name}")
+    logger.info("Starting transcription for %s with model %s", audio_path, model_name)
+
+    published_segments = 0
+
+    def report_progress(fraction_done, segments):
+        # Called after every decoded 30 s window: makes the new segments readable through /status
+        # (partial transcript) and pushes them to /events subscribers.
+        nonlocal published_segments
+        new_segments = segments[published_segments:]
+        published_segments = len(segments)
+        if parent_task_id:
+            report_chunk_progress(self, parent_task_id, chunk_index, chunks, fraction_done, new_segments)
+            return
+        progress = round(fraction_done * 100, 1)
+        append_partial_segments(self.request.id, new_segments)
+        if self.request.id and not self.request.called_directly:
+            self.update_state(state='PROGRESS', meta={"progress": progress, "segments_done": published_segments})
+        publish_task_event(self.request.id, 'PROGRESS', progress=progress, segments_done=published_segments,
+                           new_segments=new_segments)
+
     try:
-        result = actual_transcribe_function(
-            audio_path=audio_path,
-            model_name=model_name,
-            task=task_type,
-            language=language,
-            initial_prompt=initial_prompt,
-            temperature=temperature,
-            best_of=best_of,
-            word_timestamps=word_timestamps,
-            verbose=verbose
-        )
+        with stage_timer('total', model_name):
+            result = actual_transcribe_function(
+                audio_path=audio_path,
+                model_name=model_name,
+                task=task_type,
+                language=language,
+                initial_prompt=initial_prompt,
+                temperature=temperature,
+                best_of=best_of,
+                word_timestamps=word_timestamps,
+                verbose=verbose,
+                progress_callback=report_progress,
+                vad=vad,
+                audio_id=audio_id,
+                speculative=speculative
+            )
 
         # The task is responsible for cleaning up the temp file after processing.
         # We return the path so the status check can trigger deletion if needed,
@@ -91,37 +197,397 @@ def transcribe_audio_task(self, audio_path, model_name, task_type, language, ini
         if os.path.exists(audio_path):
             try:
                 os.remove(audio_path)
-                print(f"Celery Task [{self.request.id}]: Temporary file {audio_path} deleted successfully.")
+                logger.debug("Temporary file %s deleted successfully.", audio_path)
             except Exception as e_del:
-                print(f"Celery Task [{self.request.id}]: Error deleting temporary file {audio_path}: {e_del}")
+                logger.warning("Error deleting temporary file %s: %s", audio_path, e_del)
 
         if "error" in result:
-            print(f"Celery Task [{self.request.id}]: Error during transcription: {result['error']}")
+            logger.error("Error during transcription: %s", result['error'])
             # Optionally raise an exception to mark the task as FAILED more explicitly
             # raise ValueError(result['error'])
         else:
-            print(f"Celery Task [{self.request.id}]: Transcription successful for {audio_path}")
-        return result
+            logger.info("Transcription successful for %s", audio_path)
+            if cache_key:
+                result_cache.put_shared(cache_key, result)
+        return pack_result(result)
     except Exception as e:
-        print(f"Celery Task [{self.request.id}]: Exception during transcription for {audio_path}: {e}")
+        logger.error("Exception during transcription for %s: %s", audio_path, e)
         # If audio_path still exists on unhandled exception, try to clean it up
         if os.path.exists(audio_path):
             try:
                 os.remove(audio_path)
-                print(f"Celery Task [{self.request.id}]: Temporary file {audio_path} deleted due to task exception.")
+                logger.debug("Temporary file %s deleted due to task exception.", audio_path)
             except Exception as e_del:
-                print(f"Celery Task [{self.request.id}]: Error deleting temporary file {audio_path} during task exception: {e_del}")
+                logger.warning("Error deleting temporary file %s during task exception: %s", audio_path, e_del)
         raise # Re-raising the exception will mark the task as FAILED in Celery
 
-@worker_process_init.connect
-def preload_models(**kwargs):
-    print("Celery Worker Process: Pre-loading default 'base' Whisper model...")
+def report_chunk_progress(task, parent_task_id, chunk_index, chunks, fraction_done, new_segments):
+    """
+    Progress of one chunk, reported under the chunked job's id: the segments in the chunk's core
+    region are appended to the job's partial transcript on the original timeline (in decode order,
+    so chunks decoded in parallel interleave; the merged result is in timeline order), and the job's
+    progress is the length-weighted progress of all its chunks.
+    """
+    new_segments = core_segments(new_segments, chunks, chunk_index)
+    segments_done = append_partial_segments(parent_task_id, new_segments)
+    fractions = record_chunk_progress(parent_task_id, chunk_index, fraction_done)
+    if fractions is None:
+        return  # Nothing shared to aggregate in
+    progress = round(chunk_progress(fractions, chunks) * 100, 1)
+    meta = {"progress": progress}
+    if segments_done is not None:
+        meta["segments_done"] = segments_done
+    if not task.request.called_directly:
+        task.update_state(task_id=parent_task_id, state='PROGRESS', meta=meta)
+    publish_task_event(parent_task_id, 'PROGRESS', **meta, chunk=chunk_index, new_segments=new_segments)
+
+
+@celery.task(name='transcribe_long_audio_task', bind=True)
+def transcribe_long_audio_task(self, audio_path, model_name, task_type, language, initial_prompt, temperature, best_of, word_timestamps, verbose, cache_key=None, vad=None, audio_id=None, speculative=None):
+    """
+    Opt-in chunked transcription for long recordings.
+    Splits the audio at quiet points into overlapping chunks and replaces itself with a chord:
+    one transcribe_audio_task per chunk (spread over all workers), then merge_chunks_task.
+    The chord result is stored under this task's id, so /status works unchanged; the chunks
+    report their progress and partial segments under it as well.
+    Recordings too short to chunk are replaced by a single transcribe_audio_task (same id).
+    """
+    logger.info("Planning chunked transcription for %s", audio_path)
+    decode_options = dict(model_name=model_name, task_type=task_type, language=language,
+                          initial_prompt=initial_prompt, temperature=temperature, best_of=best_of,
+                          word_timestamps=word_timestamps, verbose=verbose, vad=vad, speculative=speculative)
     try:
-        # Let load_whisper_model decide the device (tries CUDA first if available)
-        loaded_model = load_whisper_model(model_name="base")
-        if loaded_model:
-            print(f"Celery Worker Process: Model 'base' pre-loaded successfully on {loaded_model.device.type}.")
+        audio = load_audio_samples(audio_path, audio_id)
+    except Exception:
+        if os.path.exists(audio_path):
+            os.remove(audio_path)
+        raise
+
+    # Chunks stay in the lane of the recording (an explicit None would bypass task_default_priority)
+    priority = (self.request.delivery_info or {}).get('priority')
+    lane_options = {'priority': priority} if priority is not None else {}
+    duration = len(audio) / SAMPLE_RATE
+    if duration < CHUNK_MIN_DURATION_SECONDS:
+        logger.info("%.1fs is too short to chunk, transcribing in one piece.", duration)
+        del audio
+        single = transcribe_audio_task.s(audio_path=audio_path, cache_key=cache_key, audio_id=audio_id, **decode_options)
+        raise self.replace(single.set(**lane_options))
+
+    chunks = plan_chunks(audio, SAMPLE_RATE)
+    base_path, _ = os.path.splitext(audio_path)
+    chunk_tasks = []
+    for index, chunk in enumerate(chunks):
+        chunk_path = f"{base_path}.chunk{index:03d}{PCM_SUFFIX}"
+        save_pcm(chunk_path, audio[int(chunk["start"] * SAMPLE_RATE):int(chunk["end"] * SAMPLE_RATE)])
+        chunk_tasks.append(transcribe_audio_task.s(audio_path=chunk_path, parent_task_id=self.request.id,
+                                                   chunk_index=index, chunks=chunks, **decode_options).set(**lane_options))
+    del audio
+    os.remove(audio_path)  # Chunk tasks only need their own PCM files
+
+    logger.info("Dispatching %d chunks for %.1fs of audio.", len(chunks), duration)
+    merge = merge_chunks_task.s(chunks=chunks, model_name=model_name, cache_key=cache_key).set(**lane_options)
+    raise self.replace(chord(chunk_tasks, merge))
+
+
+@celery.task(name='merge_chunks_task')
+def merge_chunks_task(chunk_results, chunks, model_name=None, cache_key=None):
+    """Chord callback: stitches the chunk results in timeline order. model_name is only used for routing."""
+    result = merge_chunk_results([unpack_result(r) for r in chunk_results], chunks)
+    if cache_key and "error" not in result:
+        result_cache.put_shared(cache_key, result)
+    return pack_result(result)
+
+@before_task_publish.connect
+def stamp_submission_time(headers=None, **kwargs):
+    # Lets the worker measure how long the task waited in the queue
+    if headers is not None:
+        headers.setdefault('submitted_at', time.time())
+
+@before_task_publish.connect
+def count_model_demand(sender=None, body=None, **kwargs):
+    # Runs where the task is published (API, batches, chunk fan-out): the demand side of /autoscale
+    if sender in ('transcribe_audio_task', 'transcribe_long_audio_task') and isinstance(body, (tuple, list)):
+        record_request((body[1] or {}).get('model_name'))
+
+@task_prerun.connect
+def track_task_start(task_id=None, task=None, **kwargs):
+    if task is not None and task.name in MODEL_ROUTED_TASKS:
+        task_started(task_id, (task.request.kwargs or {}).get('model_name'))
+
+@task_postrun.connect
+def track_task_end(task_id=None, task=None, **kwargs):
+    if task is not None and task.name in MODEL_ROUTED_TASKS:
+        task_finished(task_id)
+
+@task_prerun.connect
+def publish_task_started(task_id=None, task=None, **kwargs):
+    if task is not None and task.name in MODEL_ROUTED_TASKS:
+        submitted_at = getattr(task.request, 'submitted_at', None)  # Custom message headers become request attributes
+        if submitted_at:
+            model_name = (task.request.kwargs or {}).get('model_name', '')
+            observe_stage('queue_wait', max(0.0, time.time() - submitted_at), model_name)
+        publish_task_event(task_id, 'STARTED')
+
+@task_postrun.connect
+def publish_task_finished(task_id=None, task=None, state=None, retval=None, **kwargs):
+    # Sent after the result is stored, so a client reacting to the event finds it via /status.
+    # A chord callback (merge_chunks_task) runs under the id of the task it replaced.
+    if task is not None and task.name in MODEL_ROUTED_TASKS and state in TERMINAL_STATES:
+        # Errors are returned as {"error": ...} (never compacted), exceptions end in FAILURE
+        if state == 'SUCCESS':
+            outcome = 'error' if isinstance(retval, dict) and "error" in retval else 'success'
         else:
-            print("Celery Worker Process: Failed to preload 'base' model.")
-    except Exception as e:
-        print(f"Celery Worker Process: Error pre-loading 'base' model: {e}")
\ No newline at end of file
+            outcome = 'exception' if state == 'FAILURE' else state.lower()
+        TASK_OUTCOMES.labels(task.name, outcome).inc()
+        record_task_done((task.request.delivery_info or {}).get('routing_key'))  # Drain rate for /queues
+        is_chunk = bool(getattr(task.request, 'chord', None))  # Chord members are not polled by clients
+        if state == 'SUCCESS' and RENDER_EAGER_FORMATS and not is_chunk:
+            try:
+                render_cache.render_shared(task_id, unpack_result(retval), RENDER_EAGER_FORMATS)
+            except Exception as e:
+                logger.warning("Eager rendering failed for %s: %s", task_id, e)
+        clear_partial_segments(task_id)
+        publish_task_event(task_id, state)
+
+@celeryd_after_setup.connect
+def declare_worker_models(sender, instance, **kwargs):
+    """Derives WHISPER_WORKER_MODELS from the consumed 'whisper.<model>' queues when it is not set."""
+    if os.environ.get('WHISPER_WORKER_MODELS'):
+        return
+    consumed = instance.app.amqp.queues.consume_from or {}
+    models = [q[len(MODEL_QUEUE_PREFIX):] for q in consumed
+              if q.startswith(MODEL_QUEUE_PREFIX) and q != WHISPER_OVERFLOW_QUEUE]
+    if models:
+        # Environment rather than a global so that pool children started with 'spawn' see it too
+        os.environ['WHISPER_WORKER_MODELS'] = ','.join(models)
+        logger.info("Serving models %s from queues %s.", models, sorted(consumed))
+
+@celeryd_after_setup.connect
+def declare_worker_node(sender, instance, **kwargs):
+    # Children name their autoscaling heartbeats after the worker node (controllers address it)
+    os.environ['WHISPER_WORKER_NODE'] = sender
+
+@celeryd_after_setup.connect
+def declare_worker_processes(sender, instance, **kwargs):
+    """Records how many prefork children share this host's cores, for configure_torch_threads."""
+    pool_module = getattr(instance.pool_cls, '__module__', str(instance.pool_cls))
+    processes = instance.concurrency if 'prefork' in pool_module else 1  # solo/threads: one torch process
+    os.environ['WHISPER_WORKER_PROCESSES'] = str(processes)
+
+@celeryd_after_setup.connect
+def export_shared_weights(sender, instance, **kwargs):
+    """Writes the shared weight files of the served models once, in the parent, before the pool forks."""
+    # Connected after declare_worker_models, so models derived from the consumed queues are included
+    if SHARED_WEIGHTS_ENABLED:
+        export_models(worker_models())
+
+@worker_init.connect
+def start_metrics_exporter(**kwargs):
+    # Main worker process; with prefork, children report through PROMETHEUS_MULTIPROC_DIR
+    start_worker_exporter()
+
+@worker_process_shutdown.connect
+def drop_process_metrics(pid=None, **kwargs):
+    # The per-process model cache gauges of a stopped prefork child must not be exported any longer
+    mark_process_exited(pid)
+
+@worker_process_init.connect
+def pin_torch_threads(**kwargs):
+    # Before preloading, so the models' first forward passes already use the pinned thread pool
+    threads = configure_torch_threads(int(os.environ.get('WHISPER_WORKER_PROCESSES', '1')))
+    logger.info("Using %d torch threads in this worker process.", threads)
+
+@worker_process_init.connect
+def preload_models(**kwargs):
+    models = worker_models()
+    if SPECULATIVE_DEFAULT:  # Draft models are needed by every greedy request
+        models = list(dict.fromkeys(models + [draft_model_name(m) for m in models]))
+    for model_name in models:
+        logger.info("Pre-loading '%s' Whisper model...", model_name)
+        try:
+            # Let load_whisper_model decide the device (tries CUDA first if available)
+            # Pinned so served models survive evictions under the WHISPER_MODEL_CACHE_MAX_MB budget
+            loaded_model = load_whisper_model(model_name=model_name, pin=True)
+            if loaded_model:
+                logger.info("Model '%s' pre-loaded successfully on %s.", model_name, loaded_model.device.type)
+            else:
+                logger.error("Failed to preload '%s' model.", model_name)
+        except Exception as e:
+            logger.error("Error pre-loading '%s' model: %s", model_name, e)
+
+@worker_process_init.connect
+def start_supply_heartbeat(**kwargs):
+    # After preload_models, so the first heartbeat already lists the warm models
+    start_process_heartbeat(os.environ.get('WHISPER_WORKER_NODE'))
+
+# Models added to this worker's preload list by warm_pool_grow, with the queues consumed for them
+warm_pool_models = {}
+# Why this worker's prefork pool can't be resized by warm_pool_grow/drain (None: it can), see check_pool_internals
+pool_resize_unsupported = None
+
+
+def _is_prefork(consumer):
+    return 'prefork' in type(consumer.pool).__module__
+
+
+def missing_pool_internals(consumer):
+    """
+    The private Celery/billiard attributes warm_pool_grow/drain use (the Consumer's prefetch update,
+    billiard's process list and counters, controlled termination) that this worker lacks.
+    """
+    missing = [] if hasattr(consumer, '_update_prefetch_count') else ['Consumer._update_prefetch_count']
+    if not callable(getattr(consumer.pool, 'grow', None)):
+        missing.append('TaskPool.grow')
+    pool = getattr(consumer.pool, '_pool', None)  # The billiard pool behind Celery's TaskPool
+    if pool is None:
+        return missing + ['TaskPool._pool']
+    missing += [f'{type(pool).__name__}.{name}' for name in ('_pool', '_processes', '_putlock', '_worker_active', 'on_shrink')
+                if not hasattr(pool, name)]
+    if not all(hasattr(process, 'terminate_controlled') for process in getattr(pool, '_pool', [])):
+        missing.append('Process.terminate_controlled')
+    return missing
+
+
+@worker_ready.connect
+def check_pool_internals(sender=None, **kwargs):
+    """Disables warm_pool_grow/drain at startup if this Celery/billiard version lacks what they rely on."""
+    global pool_resize_unsupported
+    if not _is_prefork(sender):
+        return  # -P solo/threads load models in place and are never drained
+    missing = missing_pool_internals(sender)
+    if missing:
+        pool_resize_unsupported = f"this Celery/billiard version lacks {', '.join(missing)}"
+        logger.warning("warm_pool_grow and warm_pool_drain are disabled: %s.", pool_resize_unsupported)
+
+
+def _sends_process_init(consumer):
+    # Prefork children and the solo pool send worker_process_init; -P threads (gevent, eventlet) don't
+    return type(consumer.pool).__module__.rsplit('.', 1)[-1] in ('prefork', 'solo')
+
+
+def describe_worker(consumer):
+    """The worker's own heartbeat for autoscaling.py: pool size and what it serves."""
+    queues = [queue.name for queue in consumer.task_consumer.queues] if consumer.task_consumer else []
+    return {
+        "node": consumer.hostname,
+        "pool": type(consumer.pool).__module__.rsplit('.', 1)[-1],
+        "processes": consumer.pool.num_processes,
+        "max_processes": WARM_POOL_MAX_PROCESSES if _is_prefork(consumer) else consumer.pool.num_processes,
+        "resizable": pool_resize_unsupported is None,  # warm_pool_grow/drain can change the process count
+        "queues": queues,
+        "preload": worker_models(),
+        "warmed": sorted(warm_pool_models),
+    }
+
+@worker_ready.connect
+def init_in_place_pool(sender=None, **kwargs):
+    """-P threads runs tasks in this process, which gets no worker_process_init: run its receivers here."""
+    if _sends_process_init(sender):
+        return
+    pin_torch_threads()
+    preload_models()
+    start_supply_heartbeat()
+
+@worker_ready.connect
+def start_worker_supply_heartbeat(sender=None, **kwargs):
+    start_worker_heartbeat(lambda: describe_worker(sender), autoscale_snapshot)
+
+@control_command(args=[('model_name', str), ('n', int)], signature='<model_name> [N=1]')
+def warm_pool_grow(state, model_name, n=1, **kwargs):
+    """
+    `celery -A celery_worker_app.celery control warm_pool_grow large 2` - starts N pool processes that
+    preload `model_name` and consumes the model's queue. With -P solo/threads the model is loaded in place.
+    """
+    consumer = state.consumer
+    if consumer.controller.autoscaler:
+        return nok("warm_pool_grow is not supported with --autoscale")
+    if _is_prefork(consumer) and pool_resize_unsupported:
+        return nok(f"warm_pool_grow is disabled: {pool_resize_unsupported}")
+    models = worker_models()
+    if model_name not in models:
+        # Environment, like declare_worker_models: processes forked (or spawned) from now on preload it too
+        os.environ['WHISPER_WORKER_MODELS'] = ','.join(models + [model_name])
+        queue = queue_for_model(model_name) or celery.conf.task_default_queue
+        consumed = {q.name for q in consumer.task_consumer.queues} if consumer.task_consumer else set()
+        added_queue = queue if queue and queue not in consumed else None
+        if added_queue:  # A dedicated worker may not consume the queue the model's tasks go to yet
+            consumer.call_soon(consumer.add_task_queue, added_queue)
+        warm_pool_models[model_name] = added_queue
+    if not _is_prefork(consumer):
+        load_whisper_model(model_name=model_name, pin=True)
+        return ok(f"'{model_name}' loaded")
+    consumer.pool.grow(n)
+    consumer._update_prefetch_count(n)
+    return ok(f"pool will grow by {n} process(es) preloading '{model_name}'")
+
+def drain_pool_processes(pool, pids):
+    """Billiard's Pool.shrink for chosen processes: stops those of `pids` that run no job, returns their pids."""
+    drained = []
+    for process in list(pool._pool):
+        if process.pid in pids and not pool._worker_active(process):
+            pool._processes -= 1  # Not replaced by the pool's supervisor
+            if pool._putlock:
+                pool._putlock.shrink()
+            process.terminate_controlled()
+            pool.on_shrink(1)
+            drained.append(process.pid)
+    return drained
+
+@control_command(args=[('pids', str)], signature='<pid>[,<pid>...]')
+def warm_pool_drain(state, pids, **kwargs):
+    """
+    `celery -A celery_worker_app.celery control warm_pool_drain 4711,4712` - stops these pool processes
+    if they are idle; busy ones are left alone. Prefetched tasks are unacknowledged (acks_late) and
+    run on the remaining processes.
+    """
+    consumer = state.consumer
+    if consumer.controller.autoscaler:
+        return nok("warm_pool_drain is not supported with --autoscale")
+    if not _is_prefork(consumer):
+        return nok("warm_pool_drain needs the prefork pool")
+    if pool_resize_unsupported:
+        return nok(f"warm_pool_drain is disabled: {pool_resize_unsupported}")
+    wanted = {int(pid) for pid in (pids.split(',') if isinstance(pids, str) else pids)}
+    drained = drain_pool_processes(consumer.pool._pool, wanted)
+    if drained:
+        consumer._update_prefetch_count(-len(drained))
+    return ok({"drained": drained, "skipped": sorted(wanted - set(drained))})
+
+@control_command(args=[('model_name', str)], signature='<model_name>')
+def warm_pool_release(state, model_name, **kwargs):
+    """
+    `celery -A celery_worker_app.celery control warm_pool_release large` - undoes warm_pool_grow: new
+    processes stop preloading the model and the queue consumed for it is cancelled. Prefetched tasks
+    of that queue are unacknowledged (acks_late) and still run here.
+    """
+    if model_name not in warm_pool_models:
+        return nok(f"'{model_name}' was not added by warm_pool_grow")
+    consumer = state.consumer
+    added_queue = warm_pool_models.pop(model_name)
+    os.environ['WHISPER_WORKER_MODELS'] = ','.join(m for m in worker_models() if m != model_name)
+    if added_queue:
+        consumer.call_soon(consumer.cancel_task_queue, added_queue)
+    if not _is_prefork(consumer):  # Loaded in place: let the cache budget evict it again
+        for cache_key in model_cache.keys():
+            if model_of_cache_key(cache_key) == model_name:
+                model_cache.unpin(cache_key)
+    return ok(f"'{model_name}' released")
+
+@inspect_command()
+def model_cache_stats(state, **kwargs):
+    """`celery -A celery_worker_app.celery inspect model_cache_stats` - occupancy/evictions of the model caches."""
+    if not _is_prefork(state.consumer):
+        return model_cache.stats()  # -P solo/threads: tasks run in this process
+    # The prefork parent holds no models; the children report their caches in their autoscaling heartbeats
+    if not signals_enabled():
+        return nok("Prefork children report their model caches through the autoscaling heartbeats, "
+                   "which need a Redis broker and WHISPER_AUTOSCALE_INTERVAL > 0")
+    _, processes = read_supply()
+    node = state.consumer.hostname
+    return {"processes": {str(p["pid"]): p.get("model_cache") for p in processes if p["node"] == node}}
+
+
+@inspect_command()
+def batch_stats(state, **kwargs):
+    """`celery -A celery_worker_app.celery inspect batch_stats` - batches decoded by this worker (-P threads)."""
+    return batch_collector.stats()
@@ -0,0 +1,138 @@
+# chunking.py
+# Splitting of long recordings into overlapping chunks that can be transcribed in
+# parallel, and stitching of the per-chunk results back into one Whisper result.
+import os
+from collections import Counter
+
+import numpy as np
+
+CHUNK_SECONDS = float(os.environ.get('WHISPER_CHUNK_SECONDS', '600'))  # Target chunk length
+CHUNK_OVERLAP_SECONDS = float(os.environ.get('WHISPER_CHUNK_OVERLAP_SECONDS', '5'))
+CHUNK_SEARCH_SECONDS = float(os.environ.get('WHISPER_CHUNK_SEARCH_SECONDS', '30'))  # Window to look for silence
+# Recordings shorter than this are transcribed in one piece even when chunking was requested
+CHUNK_MIN_DURATION_SECONDS = float(os.environ.get('WHISPER_CHUNK_MIN_DURATION_SECONDS', str(CHUNK_SECONDS * 1.5)))
+
+FRAME_SECONDS = 0.02     # Energy frame length
+QUIET_WINDOW_SECONDS = 0.5  # A cut is placed in the middle of the quietest window of this length
+
+
+def frame_energy(audio, sample_rate, frame_seconds=FRAME_SECONDS):
+    """RMS energy per non-overlapping frame."""
+    frame_len = max(1, int(sample_rate * frame_seconds))
+    n_frames = len(audio) // frame_len
+    frames = np.asarray(audio[:n_frames * frame_len], dtype=np.float32).reshape(n_frames, frame_len)
+    return np.sqrt(np.mean(frames * frames, axis=1) + 1e-12)
+
+
+def find_quiet_point(energy, lo_frame, hi_frame, window_frames):
+    """Frame index in [lo_frame, hi_frame) at the centre of the lowest-energy window."""
+    segment = energy[lo_frame:hi_frame]
+    if len(segment) <= window_frames:
+        return (lo_frame + hi_frame) // 2
+    window_energy = np.convolve(segment, np.ones(window_frames, dtype=np.float32), mode='valid')
+    return lo_frame + int(np.argmin(window_energy)) + window_frames // 2
+
+
+def plan_chunks(audio, sample_rate, chunk_seconds=CHUNK_SECONDS, overlap_seconds=CHUNK_OVERLAP_SECONDS,
+                search_seconds=CHUNK_SEARCH_SECONDS):
+    """
+    Returns the chunk layout as a list of dicts (all values in seconds):
+        start/end:           audio actually transcribed for the chunk (core plus overlap)
+        core_start/core_end: part of the timeline this chunk is authoritative for
+    Cuts are placed at the quietest point within `search_seconds` before each target length.
+    """
+    duration = len(audio) / sample_rate
+    energy = frame_energy(audio, sample_rate)
+    window_frames = max(1, int(QUIET_WINDOW_SECONDS / FRAME_SECONDS))
+
+    cuts = [0.0]
+    while duration - cuts[-1] > chunk_seconds:
+        target = cuts[-1] + chunk_seconds
+        lo_frame = int(max(cuts[-1] + chunk_seconds / 2, target - search_seconds) / FRAME_SECONDS)
+        hi_frame = int(target / FRAME_SECONDS)
+        cuts.append(round(find_quiet_point(energy, lo_frame, hi_frame, window_frames) * FRAME_SECONDS, 3))
+    cuts.append(round(duration, 3))
+
+    chunks = []
+    for core_start, core_end in zip(cuts[:-1], cuts[1:]):
+        chunks.append({
+            "start": max(0.0, core_start - overlap_seconds),
+            "end": min(duration, core_end + overlap_seconds),
+            "core_start": core_start,
+            "core_end": core_end,
+        })
+    return chunks
+
+
+def _shift_segment(segment, offset):
+    shifted = dict(segment)
+    shifted["start"] = round(segment["start"] + offset, 3)
+    shifted["end"] = round(segment["end"] + offset, 3)
+    if "seek" in segment:
+        shifted["seek"] = segment["seek"] + int(round(offset * 100))  # Mel frames (10 ms)
+    if segment.get("words"):
+        shifted["words"] = [dict(word, start=round(word["start"] + offset, 3), end=round(word["end"] + offset, 3))
+                            for word in segment["words"]]
+    return shifted
+
+
+def core_segments(segments, chunks, index):
+    """
+    Moves one chunk's segments onto the original timeline and keeps the ones whose midpoint
+    falls in the chunk's core region (the last chunk also keeps segments past its core end).
+    """
+    chunk = chunks[index]
+    is_last = index == len(chunks) - 1
+    kept = []
+    for segment in segments:
+        shifted = _shift_segment(segment, chunk["start"])
+        midpoint = (shifted["start"] + shifted["end"]) / 2
+        if midpoint < chunk["core_start"]:
+            continue
+        if midpoint >= chunk["core_end"] and not is_last:
+            continue
+        kept.append(shifted)
+    return kept
+
+
+def chunk_progress(fractions, chunks):
+    """Overall progress of a chunked job from {chunk index: fraction done}, weighted by chunk length."""
+    total = sum(chunk["end"] - chunk["start"] for chunk in chunks)
+    if total <= 0:
+        return 0.0
+    done = sum(fractions.get(index, 0.0) * (chunk["end"] - chunk["start"]) for index, chunk in enumerate(chunks))
+    return min(1.0, done / total)
+
+
+def merge_chunk_results(chunk_results, chunks):
+    """
+    Stitches per-chunk Whisper results into a single result.
+    Segment timestamps are moved onto the original timeline; in the overlaps only the
+    segments whose midpoint falls in a chunk's core region are kept, so overlapped speech
+    appears exactly once.
+    """
+    errors = [r["error"] for r in chunk_results if r and "error" in r]
+    if errors:
+        return {"error": f"{len(errors)} of {len(chunks)} chunks failed: {errors[0]}"}
+
+    segments = []
+    languages = Counter()
+    for index, result in enumerate(chunk_results):
+        if result.get("language"):
+            languages[result["language"]] += 1
+        segments.extend(core_segments(result.get("segments", []), chunks, index))
+
+    segments.sort(key=lambda seg: seg["start"])
+    for segment_id, segment in enumerate(segments):
+        segment["id"] = segment_id
+
+    merged = {
+        "text": "".join(segment["text"] for segment in segments),
+        "segments": segments,
+        "language": languages.most_common(1)[0][0] if languages else None,
+        "chunks": len(chunks),
+    }
+    if any("vad_skipped_seconds" in result for result in chunk_results):
+        # Summed over chunks, so silence inside an overlap is counted by both neighbours
+        merged["vad_skipped_seconds"] = round(sum(r.get("vad_skipped_seconds", 0.0) for r in chunk_results), 3)
+    return merged
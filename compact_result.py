@@ -0,0 +1,212 @@
+# compact_result.py
+# Compact binary encoding of Whisper results for the Celery result backend.
+#
+# With word_timestamps=True a JSON result repeats the same keys and full-precision floats for
+# every word. The compact form stores segments and words as columns instead: times and
+# probabilities as float32 arrays, tokens as one int32 array plus offsets, and all text as
+# UTF-8 blobs indexed by offsets. The container is compressed with zstd when the
+# `zstandard` package is installed (zlib otherwise) and base64-wrapped so it still travels
+# through Celery's JSON serializer. Results are decoded on demand when they are read.
+#
+# Only segments the columns hold exactly are stored as columns: every numeric field present with
+# a number, and words with just word/start/end/probability. Any other segment (a missing field,
+# extra word keys, ...) is kept as plain JSON in the header, so decoding never invents or drops a
+# value; floats are the only thing rounded (see TIME_DECIMALS/VALUE_DECIMALS).
+import base64
+import json
+import os
+import struct
+import zlib
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:  # Optional dependency
+    zstandard = None
+
+COMPACT_RESULTS_ENABLED = os.environ.get('WHISPER_COMPACT_RESULTS', 'false').lower() in ['true', 'on', '1']
+COMPACT_MARKER = '__compact_result__'
+FORMAT_MAGIC = b'WCR1'
+FORMAT_VERSION = 2  # 2: plain JSON segments and the words presence column (version 1 still decodes)
+ZSTD_LEVEL = 3
+ZLIB_LEVEL = 6
+
+# Segment fields stored as columns; anything else on a segment is kept verbatim in the header
+SEGMENT_INT_FIELDS = ('id', 'seek')
+SEGMENT_FLOAT_FIELDS = ('start', 'end', 'temperature', 'avg_logprob', 'compression_ratio', 'no_speech_prob')
+SEGMENT_COLUMN_FIELDS = set(SEGMENT_INT_FIELDS) | set(SEGMENT_FLOAT_FIELDS) | {'text', 'tokens', 'words'}
+WORD_FIELDS = {'word', 'start', 'end', 'probability'}
+TIME_DECIMALS = 3   # Whisper timestamps have 10-20 ms resolution
+VALUE_DECIMALS = 6  # float32 holds ~7 significant digits
+
+
+def _text_column(strings):
+    """UTF-8 blob plus int32 byte offsets (len(strings) + 1)."""
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype='<i4')
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def _read_text_column(blob, offsets):
+    data = blob.tobytes()
+    bounds = offsets.tolist()
+    return [data[bounds[i]:bounds[i + 1]].decode('utf-8') for i in range(len(bounds) - 1)]
+
+
+def _compress(payload):
+    if zstandard is not None:
+        return 'zstd', zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(payload)
+    return 'zlib', zlib.compress(payload, ZLIB_LEVEL)
+
+
+def _decompress(codec, payload):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("Result was compressed with zstd but the 'zstandard' package is not installed")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    return zlib.decompress(payload)
+
+
+def _is_number(value, kind=(int, float)):
+    return isinstance(value, kind) and not isinstance(value, bool)
+
+
+def _is_columnar_word(word):
+    return isinstance(word, dict) and word.keys() == WORD_FIELDS and isinstance(word['word'], str) \
+        and all(_is_number(word[field]) for field in ('start', 'end', 'probability'))
+
+
+def _is_columnar_segment(segment):
+    """Whether the columns can hold the segment without losing or inventing a value."""
+    if not isinstance(segment, dict):
+        return False
+    if not all(_is_number(segment.get(field), int) for field in SEGMENT_INT_FIELDS) \
+            or not all(_is_number(segment.get(field)) for field in SEGMENT_FLOAT_FIELDS):
+        return False
+    if not isinstance(segment.get('text'), str) or not isinstance(segment.get('tokens'), list) \
+            or not all(_is_number(token, int) for token in segment['tokens']):
+        return False
+    words = segment.get('words', [])
+    return isinstance(words, list) and all(_is_columnar_word(word) for word in words)
+
+
+def encode_result(result):
+    """Encodes a Whisper result dict; errors and results without segments are returned unchanged."""
+    if not isinstance(result, dict) or "error" in result or not isinstance(result.get("segments"), list):
+        return result
+    raw_segments = {str(i): seg for i, seg in enumerate(result["segments"]) if not _is_columnar_segment(seg)}
+    segments = [seg for i, seg in enumerate(result["segments"]) if str(i) not in raw_segments]
+    columns = {}
+
+    for field in SEGMENT_INT_FIELDS:
+        columns[field] = np.array([seg.get(field, 0) for seg in segments], dtype='<i4')
+    for field in SEGMENT_FLOAT_FIELDS:
+        columns[field] = np.array([seg.get(field, 0.0) for seg in segments], dtype='<f4')
+    columns['text_blob'], columns['text_offsets'] = _text_column([seg.get('text', '') for seg in segments])
+
+    token_lists = [seg.get('tokens', []) for seg in segments]
+    columns['token_offsets'] = np.zeros(len(segments) + 1, dtype='<i4')
+    np.cumsum([len(tokens) for tokens in token_lists], out=columns['token_offsets'][1:])
+    columns['tokens'] = np.array([t for tokens in token_lists for t in tokens], dtype='<i4')
+
+    has_words = any('words' in seg for seg in segments)
+    if has_words:
+        word_lists = [seg.get('words', []) for seg in segments]
+        words = [word for word_list in word_lists for word in word_list]
+        columns['word_offsets'] = np.zeros(len(segments) + 1, dtype='<i4')
+        np.cumsum([len(word_list) for word_list in word_lists], out=columns['word_offsets'][1:])
+        columns['word_start'] = np.array([w['start'] for w in words], dtype='<f4')
+        columns['word_end'] = np.array([w['end'] for w in words], dtype='<f4')
+        columns['word_probability'] = np.array([w['probability'] for w in words], dtype='<f4')
+        columns['word_text_blob'], columns['word_text_offsets'] = _text_column([w['word'] for w in words])
+        columns['words_present'] = np.array(['words' in seg for seg in segments], dtype=np.uint8)
+
+    segment_extra = [{k: v for k, v in seg.items() if k not in SEGMENT_COLUMN_FIELDS} for seg in segments]
+    header = {
+        "version": FORMAT_VERSION,
+        "n_segments": len(result["segments"]),
+        "has_words": has_words,
+        "top_level": {k: v for k, v in result.items() if k != "segments"},
+        "segment_extra": segment_extra if any(segment_extra) else None,  # Per columnar segment
+        "raw_segments": raw_segments or None,  # Segment index -> segment kept as JSON
+        "columns": [[name, array.dtype.str, int(array.size)] for name, array in columns.items()],
+    }
+    header_bytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    body = b''.join(array.tobytes() for array in columns.values())
+    codec, compressed = _compress(FORMAT_MAGIC + struct.pack('<I', len(header_bytes)) + header_bytes + body)
+    return {COMPACT_MARKER: FORMAT_VERSION, "codec": codec, "data": base64.b64encode(compressed).decode('ascii')}
+
+
+def is_compact_result(value):
+    return isinstance(value, dict) and COMPACT_MARKER in value
+
+
+def decode_result(compact):
+    """Rebuilds the Whisper result dict from its compact form."""
+    payload = _decompress(compact["codec"], base64.b64decode(compact["data"]))
+    if payload[:4] != FORMAT_MAGIC:
+        raise ValueError("Not a compact Whisper result")
+    (header_len,) = struct.unpack_from('<I', payload, 4)
+    header = json.loads(payload[8:8 + header_len])
+
+    columns = {}
+    position = 8 + header_len
+    for name, dtype, size in header["columns"]:
+        array = np.frombuffer(payload, dtype=np.dtype(dtype), count=size, offset=position)
+        columns[name] = array
+        position += array.nbytes
+
+    n_segments = header["n_segments"]
+    raw_segments = header.get("raw_segments") or {}
+    ints = {field: columns[field].tolist() for field in SEGMENT_INT_FIELDS}
+    floats = {field: np.round(columns[field].astype(np.float64),
+                              TIME_DECIMALS if field in ('start', 'end') else VALUE_DECIMALS).tolist()
+              for field in SEGMENT_FLOAT_FIELDS}
+    texts = _read_text_column(columns['text_blob'], columns['text_offsets'])
+    tokens = columns['tokens'].tolist()
+    token_offsets = columns['token_offsets'].tolist()
+
+    if header["has_words"]:
+        word_offsets = columns['word_offsets'].tolist()
+        word_texts = _read_text_column(columns['word_text_blob'], columns['word_text_offsets'])
+        word_start = np.round(columns['word_start'].astype(np.float64), TIME_DECIMALS).tolist()
+        word_end = np.round(columns['word_end'].astype(np.float64), TIME_DECIMALS).tolist()
+        word_probability = np.round(columns['word_probability'].astype(np.float64), VALUE_DECIMALS).tolist()
+        words_present = columns['words_present'].tolist() if 'words_present' in columns else None
+
+    segment_extra = header.get("segment_extra")
+    segments = []
+    i = 0  # Index into the columns, which skip the segments kept as JSON
+    for index in range(n_segments):
+        if str(index) in raw_segments:
+            segments.append(raw_segments[str(index)])
+            continue
+        segment = {"id": ints["id"][i], "seek": ints["seek"][i], "start": floats["start"][i], "end": floats["end"][i],
+                   "text": texts[i], "tokens": tokens[token_offsets[i]:token_offsets[i + 1]]}
+        for field in ('temperature', 'avg_logprob', 'compression_ratio', 'no_speech_prob'):
+            segment[field] = floats[field][i]
+        if header["has_words"] and (words_present is None or words_present[i]):
+            segment["words"] = [
+                {"word": word_texts[j], "start": word_start[j], "end": word_end[j], "probability": word_probability[j]}
+                for j in range(word_offsets[i], word_offsets[i + 1])
+            ]
+        if segment_extra:
+            segment.update(segment_extra[i])
+        segments.append(segment)
+        i += 1
+
+    result = dict(header["top_level"])
+    result["segments"] = segments
+    return result
+
+
+def pack_result(result):
+    """Result as it should be stored by a task: compact when WHISPER_COMPACT_RESULTS is on."""
+    return encode_result(result) if COMPACT_RESULTS_ENABLED else result
+
+
+def unpack_result(value):
+    """Inverse of pack_result; plain results pass through unchanged."""
+    return decode_result(value) if is_compact_result(value) else value
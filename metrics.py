@@ -0,0 +1,138 @@
+# metrics.py
+# Prometheus instrumentation shared by the Flask app and the Celery workers.
+#
+# The metrics are exported by the app at /metrics and by each worker on WHISPER_METRICS_PORT.
+# With several processes per service (Gunicorn workers, prefork children), set
+# PROMETHEUS_MULTIPROC_DIR to an empty directory. The processes then write their samples there
+# and every export aggregates them. If `prometheus_client` is not installed, all metrics are no-ops.
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:  # Optional dependency
+    prometheus_client = None
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = (os.environ.get('WHISPER_METRICS_ENABLED', 'true').lower() in ['true', 'on', '1']
+                   and prometheus_client is not None)
+WORKER_METRICS_PORT = int(os.environ.get('WHISPER_METRICS_PORT', '9808'))  # 0 disables the worker exporter
+MULTIPROCESS_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+RTF_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 4)
+
+
+class _NoopMetric:
+    """Stand-in when prometheus_client is missing or metrics are disabled."""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def observe(self, amount):
+        pass
+
+    def set(self, value):
+        pass
+
+
+def _metric(metric_class, name, documentation, labelnames=(), **kwargs):
+    if not METRICS_ENABLED:
+        return _NoopMetric()
+    return metric_class(name, documentation, labelnames, **kwargs)
+
+
+_Histogram = prometheus_client.Histogram if prometheus_client else None
+_Counter = prometheus_client.Counter if prometheus_client else None
+_Gauge = prometheus_client.Gauge if prometheus_client else None
+
+STAGE_SECONDS = _metric(_Histogram, 'whisper_stage_seconds',
+                        'Duration of a stage (ingest, queue_wait, model_load, audio_decode, vad, inference, total).',
+                        ('stage', 'model', 'device'), buckets=STAGE_BUCKETS)
+REALTIME_FACTOR = _metric(_Histogram, 'whisper_realtime_factor',
+                          'Inference time divided by audio duration.', ('model', 'device'), buckets=RTF_BUCKETS)
+AUDIO_SECONDS = _metric(_Counter, 'whisper_audio_seconds', 'Seconds of audio transcribed.', ('model', 'device'))
+MODEL_CACHE_REQUESTS = _metric(_Counter, 'whisper_model_cache_requests', 'Model cache lookups.', ('result',))
+MODEL_CACHE_EVICTIONS = _metric(_Counter, 'whisper_model_cache_evictions', 'Models evicted from the model cache.')
+# Per process: with PROMETHEUS_MULTIPROC_DIR every live prefork child is exported with its pid
+MODEL_CACHE_BYTES = _metric(_Gauge, 'whisper_model_cache_bytes', 'RAM held by the models cached in this process.',
+                            multiprocess_mode='liveall')
+MODEL_CACHE_MODELS = _metric(_Gauge, 'whisper_model_cache_models', 'Models cached in this process.',
+                             multiprocess_mode='liveall')
+TASK_OUTCOMES = _metric(_Counter, 'whisper_tasks', 'Finished tasks by outcome (success, error, exception).',
+                        ('task', 'outcome'))
+UPLOAD_BYTES = _metric(_Counter, 'whisper_upload_bytes', 'Bytes of audio received by /transcribe.', ('ingest',))
+UPLOADS = _metric(_Counter, 'whisper_uploads', 'Uploads received by /transcribe.', ('ingest',))
+SUBMISSIONS = _metric(_Counter, 'whisper_submissions',
+                      'Transcription requests by how they were answered (dispatched, cache_hit, inflight, sync).',
+                      ('result',))
+SYNC_FALLBACKS = _metric(_Counter, 'whisper_sync_fallbacks',
+                         'Requests for the synchronous path that were dispatched to Celery, by reason.', ('reason',))
+FAIR_SHARE_DECISIONS = _metric(_Counter, 'whisper_fair_share_decisions',
+                               'Fair-share admission decisions (ok, demoted, rejected).', ('decision',))
+LANE_DISPATCHES = _metric(_Counter, 'whisper_lane_dispatches', 'Tasks dispatched to Celery by priority lane.', ('lane',))
+SPECULATIVE_DRAFT_TOKENS = _metric(_Counter, 'whisper_speculative_draft_tokens',
+                                   'Draft-model tokens checked by speculative decoding, by outcome (accepted, rejected).',
+                                   ('model', 'outcome'))
+
+
+@contextmanager
+def stage_timer(stage, model='', device=''):
+    """Observes the duration of the enclosed block under whisper_stage_seconds{stage=...}."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.labels(stage, model, device).observe(elapsed)
+        logger.debug("Stage %s (%s/%s) took %.3fs", stage, model, device, elapsed)
+
+
+def observe_stage(stage, seconds, model='', device=''):
+    STAGE_SECONDS.labels(stage, model, device).observe(seconds)
+
+
+def observe_inference(model, device, inference_seconds, audio_seconds):
+    AUDIO_SECONDS.labels(model, device).inc(audio_seconds)
+    if audio_seconds > 0:
+        REALTIME_FACTOR.labels(model, device).observe(inference_seconds / audio_seconds)
+
+
+def _registry():
+    if MULTIPROCESS_DIR:
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return prometheus_client.REGISTRY
+
+
+def metrics_payload():
+    """(body, content_type) of the Prometheus text exposition for /metrics."""
+    if not METRICS_ENABLED:
+        return b'', 'text/plain; version=0.0.4; charset=utf-8'
+    return prometheus_client.generate_latest(_registry()), prometheus_client.CONTENT_TYPE_LATEST
+
+
+def mark_process_exited(pid=None):
+    """Drops the per-process gauges of an exited process (a prefork child) from PROMETHEUS_MULTIPROC_DIR."""
+    if METRICS_ENABLED and MULTIPROCESS_DIR:
+        multiprocess.mark_process_dead(pid or os.getpid())
+
+
+def start_worker_exporter(port=WORKER_METRICS_PORT):
+    """Serves the worker's metrics over HTTP (aggregating prefork children when PROMETHEUS_MULTIPROC_DIR is set)."""
+    if not METRICS_ENABLED or not port:
+        return
+    try:
+        prometheus_client.start_http_server(port, registry=_registry())
+        logger.info("Worker metrics exporter listening on port %d", port)
+    except OSError as e:
+        logger.warning("Worker metrics exporter could not listen on port %d: %s", port, e)
+
@@ -0,0 +1,109 @@
+# render_cache.py
+# Format-once storage of finished /status responses.
+#
+# A finished task's result never changes, so the complete /status body for a given
+# (task_id, output_format, simplified_output) is rendered once, gzip-compressed and cached
+# together with its ETag. Later requests are answered from the cache without reading the
+# Celery result backend or re-running the SRT/VTT/TSV formatters; clients that send
+# If-None-Match get a 304.
+import gzip
+import hashlib
+import json
+import os
+
+from result_cache import LocalLRUStore, RedisStore, RESULT_CACHE_REDIS_URL
+from whisper_wrapper import format_transcription_result
+
+RENDER_CACHE_ENABLED = os.environ.get('RENDER_CACHE_ENABLED', 'true').lower() in ['true', 'on', '1']
+RENDER_CACHE_MAX_BYTES = int(os.environ.get('RENDER_CACHE_MAX_BYTES', str(128 * 1024 * 1024)))  # Compressed bytes
+RENDER_CACHE_REDIS_URL = os.environ.get('RENDER_CACHE_REDIS_URL', RESULT_CACHE_REDIS_URL)
+RENDER_CACHE_TTL = int(os.environ.get('RENDER_CACHE_TTL', str(24 * 3600)))  # Match Celery's default result_expires
+# Formats the worker renders right after a task succeeds (needs the Redis tier), e.g. "srt,vtt,tsv"
+RENDER_EAGER_FORMATS = [f.strip() for f in os.environ.get('RENDER_EAGER_FORMATS', '').split(',') if f.strip()]
+GZIP_LEVEL = 6
+
+
+def render_status_body(task_id, raw_result, output_format, simplified):
+    """JSON body of a /status response for a successful task."""
+    response_data = {
+        "task_id": task_id,
+        "status": "SUCCESS",
+        "result": format_transcription_result(raw_result, output_format, simplified),
+        "error_info": None,
+    }
+    return json.dumps(response_data, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+class RenderedResponse:
+    def __init__(self, etag, compressed_body):
+        self.etag = etag
+        self.compressed_body = compressed_body
+
+    @classmethod
+    def from_body(cls, body):
+        return cls(hashlib.sha1(body).hexdigest(), gzip.compress(body, compresslevel=GZIP_LEVEL))
+
+    def body(self):
+        return gzip.decompress(self.compressed_body)
+
+    def to_bytes(self):
+        return self.etag.encode('ascii') + b'\n' + self.compressed_body
+
+    @classmethod
+    def from_bytes(cls, payload):
+        etag, _, compressed_body = payload.partition(b'\n')
+        return cls(etag.decode('ascii'), compressed_body)
+
+
+class RenderCache:
+    def __init__(self, max_bytes=RENDER_CACHE_MAX_BYTES, redis_url=RENDER_CACHE_REDIS_URL, ttl=RENDER_CACHE_TTL):
+        self.local = LocalLRUStore(max_bytes)
+        self.redis = RedisStore(redis_url, 'whisper:render:', ttl) if redis_url else None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(task_id, output_format, simplified):
+        return f"{task_id}:{output_format}:{int(bool(simplified))}"
+
+    def get(self, task_id, output_format, simplified):
+        key = self.make_key(task_id, output_format, simplified)
+        payload = self.local.get(key)
+        if payload is None and self.redis is not None:
+            payload = self.redis.get(key)
+            if payload is not None:
+                self.local.set(key, payload)
+        if payload is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return RenderedResponse.from_bytes(payload)
+
+    def render(self, task_id, raw_result, output_format, simplified):
+        """Renders, caches (both tiers) and returns the response for a successful task."""
+        rendered = RenderedResponse.from_body(render_status_body(task_id, raw_result, output_format, simplified))
+        key = self.make_key(task_id, output_format, simplified)
+        payload = rendered.to_bytes()
+        self.local.set(key, payload)
+        if self.redis is not None:
+            self.redis.set(key, payload)
+        return rendered
+
+    def render_shared(self, task_id, raw_result, formats):
+        """Worker-side eager rendering into the Redis tier (the local tier would be invisible to the API)."""
+        if self.redis is None:
+            return
+        for output_format in formats:
+            for simplified in (False, True):
+                body = render_status_body(task_id, raw_result, output_format, simplified)
+                self.redis.set(self.make_key(task_id, output_format, simplified),
+                               RenderedResponse.from_body(body).to_bytes())
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "local": self.local.stats(), "redis_enabled": self.redis is not None}
+
+
+render_cache = RenderCache()
@@ -0,0 +1,250 @@
+# result_cache.py
+# Content-addressed cache for finished transcriptions.
+#
+# A cache key is the SHA-256 of the uploaded audio bytes combined with every
+# option that changes the decode (model, task, language, prompt, temperature,
+# best_of, word timestamps). The API consults it before dispatching a Celery
+# task so that re-uploads of the same recording are answered without a worker.
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Options that influence the Whisper output. 'verbose' only affects console logging.
+# 'chunked' is included because stitched results can differ slightly at chunk boundaries.
+# 'speculative' is not: draft-model decoding yields the same transcript.
+CACHE_KEY_OPTIONS = ('model_name', 'task_type', 'language', 'initial_prompt',
+                     'temperature', 'best_of', 'word_timestamps', 'chunked', 'vad')
+
+RESULT_CACHE_ENABLED = os.environ.get('RESULT_CACHE_ENABLED', 'true').lower() in ['true', 'on', '1']
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))  # 256 MB
+RESULT_CACHE_REDIS_URL = os.environ.get('RESULT_CACHE_REDIS_URL')  # Unset = local store only
+RESULT_CACHE_TTL = int(os.environ.get('RESULT_CACHE_TTL', str(7 * 24 * 3600)))  # Seconds, Redis only
+INFLIGHT_TTL = int(os.environ.get('RESULT_CACHE_INFLIGHT_TTL', str(6 * 3600)))
+MAX_LOCAL_INFLIGHT = 10000  # Tasks that are never polled would otherwise accumulate in the local maps
+
+
+def new_audio_hasher():
+    """Hasher fed with the upload bytes as they are streamed to disk."""
+    return hashlib.sha256()
+
+
+def make_cache_key(audio_digest, options):
+    """Combine the audio digest with the decode options into a single key."""
+    relevant = {name: options.get(name) for name in CACHE_KEY_OPTIONS}
+    options_blob = json.dumps(relevant, sort_keys=True, separators=(',', ':'))
+    options_digest = hashlib.sha256(options_blob.encode('utf-8')).hexdigest()[:16]
+    return f"{audio_digest}:{options_digest}"
+
+
+class LocalLRUStore:
+    """Thread-safe in-process LRU store bounded by the total size of its values (bytes)."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return False  # Would evict everything and still not fit
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._data[key] = value
+            self._size += len(value)
+            while self._size > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self._size -= len(evicted)
+                self.evictions += 1
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._data), "bytes": self._size,
+                    "max_bytes": self.max_bytes, "evictions": self.evictions}
+
+
+class RedisStore:
+    """Shared store in Redis; errors are logged and treated as misses so Redis never breaks a request."""
+
+    def __init__(self, url, prefix, ttl):
+        import redis  # Only required when a Redis URL is configured
+        self._client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def get(self, key):
+        try:
+            return self._client.get(self.prefix + key)
+        except Exception as e:
+            logger.warning(f"Result cache: Redis get failed for {key}: {e}")
+            return None
+
+    def set(self, key, value, ttl=None):
+        try:
+            self._client.set(self.prefix + key, value, ex=ttl or self.ttl)
+            return True
+        except Exception as e:
+            logger.warning(f"Result cache: Redis set failed for {key}: {e}")
+            return False
+
+    def delete(self, key):
+        try:
+            self._client.delete(self.prefix + key)
+        except Exception as e:
+            logger.warning(f"Result cache: Redis delete failed for {key}: {e}")
+
+    def pop(self, key):
+        """Reads and deletes `key` atomically; only one of several concurrent callers gets the value."""
+        try:
+            pipe = self._client.pipeline(transaction=True)
+            pipe.get(self.prefix + key)
+            pipe.delete(self.prefix + key)
+            value, deleted = pipe.execute()
+            return value if deleted else None
+        except Exception as e:
+            logger.warning(f"Result cache: Redis pop failed for {key}: {e}")
+            return None
+
+
+class ResultCache:
+    """
+    Two-tier (local LRU + optional Redis) cache of transcription results.
+
+    Besides finished results it remembers which task is currently producing the
+    result for a key, so that concurrent duplicate uploads attach to that task
+    instead of queueing a second decode.
+    """
+
+    def __init__(self, max_bytes=RESULT_CACHE_MAX_BYTES, redis_url=RESULT_CACHE_REDIS_URL, ttl=RESULT_CACHE_TTL):
+        self.local = LocalLRUStore(max_bytes)
+        self.redis = RedisStore(redis_url, 'whisper:result:', ttl) if redis_url else None
+        self._inflight = OrderedDict()   # cache_key -> task_id (local mirror of the Redis entries)
+        self._task_keys = OrderedDict()  # task_id -> cache_key, to store the result once the task finishes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.inflight_hits = 0
+
+    # --- Finished results ---
+    def get(self, key, count=True):
+        """count: False for a repeated lookup of the same submission, so it is counted once in the hit ratio."""
+        payload = self.local.get(key)
+        if payload is None and self.redis is not None:
+            payload = self.redis.get(key)
+            if payload is not None:
+                self.local.set(key, payload)  # Promote to the local tier
+        if count:
+            with self._lock:
+                if payload is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+        return json.loads(payload) if payload is not None else None
+
+    def put(self, key, result):
+        if not result or "error" in result:
+            return  # Never cache failures
+        payload = json.dumps(result, separators=(',', ':')).encode('utf-8')
+        self.local.set(key, payload)
+        if self.redis is not None:
+            self.redis.set(key, payload)
+
+    def put_shared(self, key, result):
+        """Worker-side store: writes only the Redis tier, which is the one the API process can see."""
+        if self.redis is None or not result or "error" in result:
+            return
+        self.redis.set(key, json.dumps(result, separators=(',', ':')).encode('utf-8'))
+        self.redis.delete('inflight:' + key)
+
+    # --- In-flight tasks ---
+    def get_inflight(self, key):
+        with self._lock:
+            task_id = self._inflight.get(key)
+        if task_id is None and self.redis is not None:
+            raw = self.redis.get('inflight:' + key)
+            task_id = raw.decode('utf-8') if raw is not None else None
+        if task_id is not None:
+            with self._lock:
+                self.inflight_hits += 1
+        return task_id
+
+    def set_inflight(self, key, task_id):
+        with self._lock:
+            self._inflight[key] = task_id
+            self._task_keys[task_id] = key
+            while len(self._task_keys) > MAX_LOCAL_INFLIGHT:
+                _, stale_key = self._task_keys.popitem(last=False)
+                self._inflight.pop(stale_key, None)
+        if self.redis is not None:
+            self.redis.set('inflight:' + key, task_id, ttl=INFLIGHT_TTL)
+            self.redis.set('task:' + task_id, key, ttl=INFLIGHT_TTL)
+
+    def clear_inflight(self, key):
+        with self._lock:
+            task_id = self._inflight.pop(key, None)
+            if task_id is not None:
+                self._task_keys.pop(task_id, None)
+        if self.redis is not None:
+            self.redis.delete('inflight:' + key)
+
+    def claim_task_key(self, task_id):
+        """
+        Removes and returns the cache key of a finished task. Only the first caller gets it, so a
+        task's outcome is recorded once however often (and from however many processes) it is polled.
+        """
+        with self._lock:
+            key = self._task_keys.pop(task_id, None)
+        if self.redis is not None:
+            raw = self.redis.pop('task:' + task_id)
+            if key is None and raw is not None:
+                key = raw.decode('utf-8')
+        return key
+
+    def remember_task_result(self, task_id, result):
+        """Called when a task is seen to finish: caches its result and drops the in-flight marker (once)."""
+        key = self.claim_task_key(task_id)
+        if key is None:
+            return
+        self.put(key, result)
+        self.clear_inflight(key)
+
+    def forget_failed_task(self, task_id):
+        """Called when a task is seen to fail: drops the in-flight marker so the next upload decodes again."""
+        key = self.claim_task_key(task_id)
+        if key is not None:
+            self.clear_inflight(key)
+
+    def stats(self):
+        with self._lock:
+            counters = {"hits": self.hits, "misses": self.misses, "inflight_hits": self.inflight_hits}
+        lookups = counters["hits"] + counters["misses"]
+        counters["hit_ratio"] = round(counters["hits"] / lookups, 4) if lookups else 0.0
+        counters["local"] = self.local.stats()
+        counters["redis_enabled"] = self.redis is not None
+        return counters
+
+
+# Module-level cache shared by the request handlers of this process
+result_cache = ResultCache()
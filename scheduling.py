@@ -0,0 +1,242 @@
+# scheduling.py
+# Priority lanes and per-client fair share for transcription tasks.
+#
+# Lanes: every task is published with the priority of one of three lanes: interactive, default
+# and bulk. The Redis transport keeps one list per priority step and queue, and workers always
+# pop the interactive list first. With worker_prefetch_multiplier=1, a short clip therefore waits
+# at most for the tasks already running, never for a backlog of long files. A request may ask for
+# a lane (`priority`), but the audio duration caps it: clips up to WHISPER_LANE_INTERACTIVE_SECONDS
+# can be interactive, and files of WHISPER_LANE_BULK_SECONDS or more always go to bulk. With both
+# set to 0, requests keep the lane they ask for and the API doesn't probe uploads to pick one.
+#
+# Fair share: each client (WHISPER_CLIENT_ID_HEADER, else the remote address) has a token bucket
+# measured in seconds of audio. It refills at WHISPER_FAIR_SHARE_RATE audio seconds per second,
+# up to WHISPER_FAIR_SHARE_BURST. A submission within the budget keeps its lane. A client over
+# budget may go up to one burst into debt, and those submissions are demoted to bulk. Beyond
+# that, requests are rejected with 429 and Retry-After. With several API processes, the buckets
+# live in Redis and are updated atomically by a Lua script.
+#
+# Visibility: workers count finished tasks per queue and minute in Redis. The API combines these
+# counts with the depth of each lane's broker list into an estimated wait per lane (/queues).
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+LANES = ('interactive', 'default', 'bulk')  # Served in this order
+# Redis transport priorities (lower is served first); each must be one of the broker's priority_steps
+LANE_PRIORITIES = {'interactive': 0, 'default': 3, 'bulk': 6}
+LANE_INTERACTIVE_SECONDS = float(os.environ.get('WHISPER_LANE_INTERACTIVE_SECONDS', '60'))
+LANE_BULK_SECONDS = float(os.environ.get('WHISPER_LANE_BULK_SECONDS', '1800'))
+DURATION_LANES = LANE_INTERACTIVE_SECONDS > 0 or LANE_BULK_SECONDS > 0  # Both 0: the duration never picks the lane
+
+FAIR_SHARE_RATE = float(os.environ.get('WHISPER_FAIR_SHARE_RATE', '0'))  # Audio seconds per second, 0 disables
+FAIR_SHARE_BURST = float(os.environ.get('WHISPER_FAIR_SHARE_BURST', '3600'))  # Bucket size in audio seconds
+FAIR_SHARE_UNKNOWN_SECONDS = float(os.environ.get('WHISPER_FAIR_SHARE_UNKNOWN_SECONDS', '60'))  # Charge if unprobed
+CLIENT_ID_HEADER = os.environ.get('WHISPER_CLIENT_ID_HEADER', 'X-Client-ID')
+# Redis for the buckets, queue depths and drain rates (defaults to the broker); empty keeps buckets per process
+SCHEDULER_REDIS_URL = os.environ.get('WHISPER_SCHEDULER_REDIS_URL',
+                                     os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0'))
+DRAIN_WINDOW_MINUTES = int(os.environ.get('WHISPER_DRAIN_WINDOW_MINUTES', '10'))
+
+BUCKET_PREFIX = 'whisper:fairshare:'
+DONE_PREFIX = 'whisper:sched:done:'  # + <queue>:<minute>, finished tasks per queue and minute
+PRIORITY_SEP = '\x06\x16'  # kombu's Redis transport: list of priority p > 0 is '<queue><sep><p>'
+MAX_LOCAL_CLIENTS = 10000
+
+# Refill, then charge `cost` audio seconds if the client may still submit. Returns {decision, tokens left}.
+# A negative cost refunds (cache hits); tokens never exceed the burst.
+ADMIT_SCRIPT = """
+local rate, burst, cost, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local decision = 'rejected'
+if tokens >= cost then decision = 'ok' elseif tokens - cost >= -burst then decision = 'demoted' end
+if decision ~= 'rejected' then tokens = math.min(burst, tokens - cost) end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(2 * burst / rate) + 60)
+return {decision, tostring(tokens)}
+"""
+
+_redis_client = None
+
+
+def get_redis():
+    """Process-wide Redis client (created lazily so forked workers get their own connection pool)."""
+    global _redis_client
+    if _redis_client is None:
+        import redis
+        _redis_client = redis.Redis.from_url(SCHEDULER_REDIS_URL)
+    return _redis_client
+
+
+def redis_configured():
+    return SCHEDULER_REDIS_URL.startswith(('redis://', 'rediss://', 'unix://'))
+
+
+def duration_lane(duration):
+    """Highest lane a file of this duration may use (None: unknown duration, no cap)."""
+    if duration is None:
+        return 'interactive'
+    if LANE_BULK_SECONDS and duration >= LANE_BULK_SECONDS:
+        return 'bulk'
+    if duration <= LANE_INTERACTIVE_SECONDS:
+        return 'interactive'
+    return 'default'
+
+
+def choose_lane(requested=None, duration=None, demoted=False):
+    """
+    Lane of a submission: the requested lane (the duration's lane if none), never higher than the
+    duration allows; over-budget clients go to bulk.
+    """
+    if demoted:
+        return 'bulk'
+    if not DURATION_LANES:
+        return requested or 'default'
+    cap = duration_lane(duration)
+    if requested is None:
+        return cap if duration is not None else 'default'
+    return max(requested, cap, key=LANES.index)
+
+
+def lane_needs_duration(requested=None):
+    """Whether choose_lane's answer for this requested lane depends on the audio duration."""
+    return DURATION_LANES and requested != 'bulk'
+
+
+class Admission:
+    def __init__(self, decision, cost=0.0, tokens=None, retry_after=None):
+        self.decision = decision  # 'ok', 'demoted' or 'rejected'
+        self.cost = cost  # Audio seconds charged (refunded by FairShare.refund)
+        self.tokens = tokens
+        self.retry_after = retry_after  # Seconds until a rejected request would be admitted
+
+    @property
+    def rejected(self):
+        return self.decision == 'rejected'
+
+    @property
+    def demoted(self):
+        return self.decision == 'demoted'
+
+
+class FairShare:
+    """Token buckets of audio seconds per client, in Redis or (without a Redis URL) in this process."""
+
+    def __init__(self, rate=FAIR_SHARE_RATE, burst=FAIR_SHARE_BURST, redis_url=SCHEDULER_REDIS_URL):
+        self.rate = rate
+        self.burst = burst
+        self.use_redis = bool(redis_url) and redis_configured()
+        self._buckets = OrderedDict()  # client -> (tokens, timestamp); local mode only
+        self._lock = threading.Lock()
+        self._script = None
+
+    @property
+    def enabled(self):
+        return self.rate > 0
+
+    def _admit_local(self, client, cost, now):
+        with self._lock:
+            tokens, ts = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + max(0.0, now - ts) * self.rate)
+            decision = 'rejected'
+            if tokens >= cost:
+                decision = 'ok'
+            elif tokens - cost >= -self.burst:
+                decision = 'demoted'
+            if decision != 'rejected':
+                tokens = min(self.burst, tokens - cost)
+            self._buckets[client] = (tokens, now)
+            if len(self._buckets) > MAX_LOCAL_CLIENTS:
+                self._buckets.popitem(last=False)
+            return decision, tokens
+
+    def _admit_redis(self, client, cost, now):
+        if self._script is None:
+            self._script = get_redis().register_script(ADMIT_SCRIPT)
+        decision, tokens = self._script(keys=[BUCKET_PREFIX + client], args=[self.rate, self.burst, cost, now])
+        return decision.decode() if isinstance(decision, bytes) else decision, float(tokens)
+
+    def _apply(self, client, cost):
+        now = time.time()
+        if self.use_redis:
+            try:
+                return self._admit_redis(client, cost, now)
+            except Exception as e:
+                # Fail open: a Redis outage must not stop transcriptions
+                logger.warning(f"Fair share: Redis bucket update failed for {client}: {e}")
+                return 'ok', None
+        return self._admit_local(client, cost, now)
+
+    def admit(self, client, duration):
+        """Charges `duration` seconds of audio to the client (at most one burst per file)."""
+        if not self.enabled:
+            return Admission('ok')
+        cost = min(duration if duration is not None else FAIR_SHARE_UNKNOWN_SECONDS, self.burst)
+        decision, tokens = self._apply(client, cost)
+        if decision == 'rejected':
+            return Admission(decision, tokens=tokens, retry_after=math.ceil((cost - self.burst - tokens) / self.rate))
+        return Admission(decision, cost, tokens)
+
+    def refund(self, admission, client):
+        """Returns the charge of a submission that needed no decoding (result cache hit, in-flight duplicate)."""
+        if self.enabled and admission.cost:
+            self._apply(client, -admission.cost)
+
+fair_share = FairShare()
+
+
+def record_task_done(queue):
+    """Counts a finished task for the drain rate of its queue (called by the workers)."""
+    if not queue or not redis_configured():
+        return
+    key = f"{DONE_PREFIX}{queue}:{int(time.time() // 60)}"
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.incr(key)
+        pipe.expire(key, (DRAIN_WINDOW_MINUTES + 1) * 60)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Scheduling: failed to record a finished task for {queue}: {e}")
+
+
+def lane_stats(queues):
+    """
+    Depth per queue and lane, the queue's drain rate over the last DRAIN_WINDOW_MINUTES and the
+    estimated wait of a new task in each lane (depth of that lane and the ones above / drain rate).
+    """
+    if not redis_configured():
+        return {"queues": [], "error": "Queue depths need a Redis broker"}
+    now = time.time()
+    minute = int(now // 60)
+    window_seconds = (DRAIN_WINDOW_MINUTES - 1) * 60 + (now % 60)  # Full past minutes plus the current one
+    pipe = get_redis().pipeline(transaction=False)
+    for queue in queues:
+        for lane in LANES:
+            priority = LANE_PRIORITIES[lane]
+            pipe.llen(f"{queue}{PRIORITY_SEP}{priority}" if priority else queue)
+        pipe.mget([f"{DONE_PREFIX}{queue}:{m}" for m in range(minute - DRAIN_WINDOW_MINUTES + 1, minute + 1)])
+    replies = pipe.execute()
+
+    stats = []
+    for index, queue in enumerate(queues):
+        depths = replies[index * (len(LANES) + 1):(index + 1) * (len(LANES) + 1) - 1]
+        finished = sum(int(count) for count in replies[(index + 1) * (len(LANES) + 1) - 1] if count)
+        drain_rate = finished / window_seconds  # Tasks per second
+        lanes, ahead = {}, 0
+        for lane, depth in zip(LANES, depths):
+            ahead += depth
+            if ahead == 0:
+                wait = 0.0
+            else:
+                wait = round(ahead / drain_rate, 1) if drain_rate > 0 else None  # None: nothing finished lately
+            lanes[lane] = {"depth": depth, "estimated_wait_seconds": wait}
+        stats.append({"queue": queue, "tasks_per_minute": round(drain_rate * 60, 2), "lanes": lanes})
+    return {"queues": stats}
@@ -0,0 +1,119 @@
+# shared_weights.py
+# Memory-mapped model weights shared by all worker processes of a host.
+#
+# Without it every prefork child loads its own fp32 copy of each model (8 children with 'medium'
+# hold 8 copies). With WHISPER_SHARED_WEIGHTS enabled, each model is converted once into an
+# fp32 weight file under WHISPER_SHARED_WEIGHTS_DIR (tmpfs /dev/shm by default). Processes then
+# build the model on the meta device and assign the tensors straight from a read-only mmap of
+# that file, so all children share the same physical pages and a child's cold start only maps
+# the file. The worker's parent process exports the files of its preloaded models before the
+# pool starts; models requested later are exported by the first child that needs them.
+#
+# Sharing only applies to fp32 weights on the CPU. GPU loads copy the tensors to the device and
+# INT8 quantization (WHISPER_CPU_QUANTIZE) packs private copies; both still get the fast load.
+import fcntl
+import hashlib
+import logging
+import os
+import tempfile
+from contextlib import contextmanager
+
+import torch
+import whisper
+from whisper.model import ModelDimensions, Whisper
+
+logger = logging.getLogger(__name__)
+
+SHARED_WEIGHTS_ENABLED = os.environ.get('WHISPER_SHARED_WEIGHTS', 'false').lower() in ['true', 'on', '1']
+SHARED_WEIGHTS_DIR = os.environ.get('WHISPER_SHARED_WEIGHTS_DIR') or os.path.join(
+    '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'whisper-weights')
+
+WEIGHT_FILE_SUFFIX = '.fp32.pt'
+
+
+def weight_file_path(model_name):
+    """Weight file of a model; the checkpoint's SHA-256 is part of the name so updated checkpoints get a new file."""
+    url = whisper._MODELS.get(model_name)
+    if url:
+        version = url.split('/')[-2][:12]
+    else:  # A checkpoint path passed as model name
+        version = hashlib.sha256(os.path.abspath(model_name).encode()).hexdigest()[:12]
+    safe_name = os.path.basename(model_name).replace(os.sep, '_')
+    return os.path.join(SHARED_WEIGHTS_DIR, f"{safe_name}-{version}{WEIGHT_FILE_SUFFIX}")
+
+
+def _non_persistent_buffers(model):
+    """Buffers missing from state_dict() (decoder mask, alignment heads), which a meta-device model lacks."""
+    persistent = set(model.state_dict().keys())
+    return {name: (buffer.to_dense() if buffer.is_sparse else buffer)
+            for name, buffer in model.named_buffers() if name not in persistent}
+
+
+def export_weights(model_name):
+    """
+    Writes the fp32 weight file of a model unless it exists, and returns its path.
+    An exclusive lock makes concurrent exporters (sibling processes) wait for a single conversion.
+    """
+    path = weight_file_path(model_name)
+    if os.path.exists(path):
+        return path
+    os.makedirs(SHARED_WEIGHTS_DIR, exist_ok=True)
+    with open(path + '.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            if os.path.exists(path):  # Exported by another process while we waited
+                return path
+            logger.info("Exporting shared fp32 weights of '%s' to %s...", model_name, path)
+            model = whisper.load_model(model_name, device="cpu")
+            temporary_path = f"{path}.{os.getpid()}.tmp"
+            torch.save({
+                "dims": vars(model.dims),
+                "state_dict": model.state_dict(),
+                "buffers": _non_persistent_buffers(model),
+            }, temporary_path)
+            os.replace(temporary_path, path)  # Readers never see a partial file
+            return path
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+@contextmanager
+def _meta_device():
+    """Builds modules without allocating or initialising weights (they are assigned from the file afterwards)."""
+    # Whisper.__init__ sparsifies its default alignment heads, an op meta tensors don't implement
+    to_sparse = torch.Tensor.to_sparse
+    torch.Tensor.to_sparse = lambda self, *args, **kwargs: self if self.is_meta else to_sparse(self, *args, **kwargs)
+    try:
+        with torch.device("meta"):
+            yield
+    finally:
+        torch.Tensor.to_sparse = to_sparse
+
+
+def load_shared_model(model_name, device="cpu"):
+    """Whisper model whose tensors are mapped read-only from the shared weight file (exported on first use)."""
+    checkpoint = torch.load(export_weights(model_name), map_location="cpu", mmap=True, weights_only=True)
+    with _meta_device():
+        model = Whisper(ModelDimensions(**checkpoint["dims"]))
+    model.load_state_dict(checkpoint["state_dict"], assign=True)
+    for name, buffer in checkpoint["buffers"].items():
+        module_name, _, buffer_name = name.rpartition('.')
+        module = model.get_submodule(module_name) if module_name else model
+        module.register_buffer(buffer_name, buffer.to_sparse() if buffer_name == "alignment_heads" else buffer,
+                               persistent=False)
+    model.eval()
+    return model if device == "cpu" else model.to(device)
+
+
+def export_models(model_names):
+    """
+    Exports the weight files of the given models (called by the worker parent before the pool forks).
+    Each file is test-loaded once: that validates it and imports torch's meta-tensor kernels in the
+    parent, so forked children don't each pay (and privately hold) that import.
+    """
+    for model_name in model_names:
+        try:
+            load_shared_model(model_name)
+        except Exception as e:
+            # Children fall back to exporting (or loading privately) themselves
+            logger.error("Could not export shared weights of '%s': %s", model_name, e)
@@ -0,0 +1,236 @@
+# speculative.py
+# Speculative greedy decoding with a small draft model proposing tokens that the large model checks.
+#
+# On the CPU, a large model spends most of its decode time in one decoder pass per token, each of
+# which reads all decoder weights. Here the draft model (WHISPER_SPECULATIVE_DRAFT, tiny by
+# default) greedily proposes up to WHISPER_SPECULATIVE_DRAFT_TOKENS tokens and the large model
+# scores all of them in a single pass. Proposals are accepted up to the first position where the
+# large model's own greedy choice differs, after the same logit filters (timestamp rules,
+# suppressed tokens). That choice is appended instead, so every pass yields at least one token.
+# The rejected positions are cut from both kv-caches.
+#
+# The tokens are those of plain greedy decoding up to floating-point ties: the verification pass
+# scores several positions at once with its own attention over the cache (DecoderState), which
+# rounds differently from whisper's one-token passes, so where the two best logits are within
+# rounding of each other the choice can differ. tests/test_speculative.py checks the tokens on a
+# fixed model and input; benchmarks/speculative.py compares transcripts on real audio.
+#
+# Only greedy windows are speculated (temperature 0, no beam search); the temperature fallback
+# decodes as usual. whisper_wrapper calls speculative_decode per window from transcribe_windows'
+# decode_window hook, only for requests that ask for speculative decoding. Draft and target must
+# share the text vocabulary (both multilingual or both English-only). Special tokens are mapped by
+# name, so a 99-language draft can serve large-v3 and turbo; when the mel bin counts differ, the
+# draft reads its own spectrogram of the same audio.
+import functools
+import logging
+import os
+
+import torch
+import torch.nn.functional as F
+from whisper.decoding import DecodingResult, DecodingTask
+from whisper.tokenizer import get_tokenizer
+from whisper.utils import compression_ratio
+
+logger = logging.getLogger(__name__)
+
+SPECULATIVE_DEFAULT = os.environ.get('WHISPER_SPECULATIVE', 'false').lower() in ['true', 'on', '1']
+SPECULATIVE_DRAFT_MODEL = os.environ.get('WHISPER_SPECULATIVE_DRAFT', 'tiny')
+SPECULATIVE_DRAFT_TOKENS = int(os.environ.get('WHISPER_SPECULATIVE_DRAFT_TOKENS', '6'))  # Proposals per pass
+
+
+def draft_model_name(model_name):
+    """Draft for `model_name`, switched to the English-only variant (or back) to match its vocabulary."""
+    draft = SPECULATIVE_DRAFT_MODEL
+    if model_name.endswith('.en') and not draft.endswith('.en'):
+        return draft + '.en'
+    if not model_name.endswith('.en') and draft.endswith('.en'):
+        return draft[:-len('.en')]
+    return draft
+
+
+def draft_compatible(model, draft):
+    return model.is_multilingual == draft.is_multilingual and model.dims.n_text_ctx == draft.dims.n_text_ctx
+
+
+def is_speculable(options):
+    """Greedy decodes can be speculated; sampling and beam search can't."""
+    return options.temperature == 0 and options.beam_size is None and options.task != 'lang_id'
+
+
+@functools.lru_cache(maxsize=None)
+def _token_maps(multilingual, target_languages, draft_languages, target_vocab, draft_vocab):
+    """
+    (target -> draft ids, draft ids present in the target, their target ids). Text tokens share
+    their ids; special tokens (languages, tasks, timestamps) are matched by name. -1: no counterpart.
+    """
+    target = get_tokenizer(multilingual, num_languages=target_languages)
+    draft = get_tokenizer(multilingual, num_languages=draft_languages)
+    to_draft = torch.full((target_vocab,), -1, dtype=torch.long)
+    to_draft[:target.eot] = torch.arange(target.eot)
+    for name, target_id in target.special_tokens.items():
+        draft_id = draft.special_tokens.get(name)
+        if draft_id is not None and target_id < target_vocab and draft_id < draft_vocab:
+            to_draft[target_id] = draft_id
+    mapped = (to_draft >= 0).nonzero().squeeze(1)
+    return to_draft, to_draft[mapped], mapped
+
+
+def _attention(q, k, v, n_head, mask=None):
+    q, k, v = (t.view(*t.shape[:2], n_head, -1).transpose(1, 2) for t in (q, k, v))
+    return F.scaled_dot_product_attention(q, k, v, attn_mask=mask).transpose(1, 2).flatten(start_dim=2)
+
+
+class DecoderState:
+    """
+    kv-cache of one token sequence through a Whisper TextDecoder that can be rolled back.
+
+    Whisper's own cache can't score several new tokens after cached ones (its causal mask assumes
+    an empty cache) and can't drop rejected tokens. The key/value projections are called through
+    .forward, so the kv-cache hooks whisper.decode installs on a shared model never see these passes.
+    """
+
+    def __init__(self, decoder, audio_features):
+        self.decoder = decoder
+        self.dtype = audio_features.dtype
+        self.cross = [(block.cross_attn.key.forward(audio_features), block.cross_attn.value.forward(audio_features))
+                      for block in decoder.blocks]
+        self.keys = [None] * len(self.cross)
+        self.values = [None] * len(self.cross)
+        self.length = 0  # Positions held in the cache
+
+    def truncate(self, length):
+        self.length = min(self.length, length)
+
+    def forward(self, tokens):
+        """Logits (1, len(tokens), n_vocab) of new tokens following the cached ones."""
+        decoder = self.decoder
+        offset, count = self.length, tokens.shape[-1]
+        x = (decoder.token_embedding(tokens) + decoder.positional_embedding[offset:offset + count]).to(self.dtype)
+        # Row i attends to the cache and to new tokens up to itself
+        mask = torch.ones(count, offset + count, dtype=torch.bool, device=x.device).tril(offset) if count > 1 else None
+        for index, block in enumerate(decoder.blocks):
+            attn = block.attn
+            h = block.attn_ln(x)
+            k, v = attn.key.forward(h), attn.value.forward(h)
+            if offset:
+                k = torch.cat([self.keys[index][:, :offset], k], dim=1)
+                v = torch.cat([self.values[index][:, :offset], v], dim=1)
+            self.keys[index], self.values[index] = k, v
+            x = x + attn.out(_attention(attn.query(h), k, v, attn.n_head, mask))
+            cross = block.cross_attn
+            x = x + cross.out(_attention(cross.query(block.cross_attn_ln(x)), *self.cross[index], cross.n_head))
+            x = x + block.mlp(block.mlp_ln(x))
+        x = decoder.ln(x)
+        self.length = offset + count
+        return (x @ decoder.token_embedding.weight.to(x.dtype).T).float()
+
+
+def _propose(proposer, sequence, count, logit_filters, eot, maps):
+    """Up to `count` greedy tokens of the draft model (as target ids), ending early at end of text."""
+    proposals = []
+    pending = sequence[proposer.length:]
+    device = proposer.cross[0][0].device
+    while len(proposals) < count:
+        ids = torch.tensor([pending], device=device)
+        if maps is not None:
+            ids = maps[0].to(device)[ids]
+            if (ids < 0).any():
+                break  # A token the draft doesn't know (e.g. a language it lacks)
+        logits = proposer.forward(ids)[:, -1]
+        if maps is not None:
+            target_logits = logits.new_full((1, maps[0].shape[0]), float('-inf'))
+            target_logits[:, maps[2].to(device)] = logits[:, maps[1].to(device)]
+            logits = target_logits
+        for logit_filter in logit_filters:
+            logit_filter.apply(logits, torch.tensor([sequence + proposals], device=device))
+        token = int(logits.argmax(dim=-1))
+        proposals.append(token)
+        if token == eot:
+            break
+        pending = [token]
+    return proposals
+
+
+@torch.no_grad()
+def speculative_decode(model, draft, mel, draft_mel, options, stats=None):
+    """
+    Same as whisper.decode(model, mel, options) for one greedy window, with the tokens proposed by
+    `draft` from `draft_mel`. stats (a dict) accumulates drafted/accepted tokens and target passes.
+    """
+    single = mel.ndim == 2
+    if single:
+        mel, draft_mel = mel.unsqueeze(0), draft_mel.unsqueeze(0)
+    task = DecodingTask(model, options)
+    tokenizer = task.tokenizer
+    eot = tokenizer.eot
+    audio_features = task._get_audio_features(mel)
+    device = audio_features.device  # The target's device (load_draft_model puts the draft on the same one)
+    tokens = torch.tensor([task.initial_tokens], device=device)
+    languages, _ = task._detect_language(audio_features, tokens)
+    sequence = tokens[0].tolist()
+
+    maps = None
+    if draft.num_languages != model.num_languages or draft.dims.n_vocab != model.dims.n_vocab:
+        maps = _token_maps(model.is_multilingual, model.num_languages, draft.num_languages,
+                           model.dims.n_vocab, draft.dims.n_vocab)
+    target = DecoderState(model.decoder, audio_features)
+    proposer = DecoderState(draft.decoder, draft.encoder(draft_mel.to(device=draft.device, dtype=audio_features.dtype)))
+
+    sum_logprob = torch.zeros(1, device=device)
+    no_speech_prob = float('nan')
+    generated = drafted = accepted_total = passes = 0
+    while generated < task.sample_len and len(sequence) <= task.n_ctx:
+        # Never past sample_len, nor past the last position whisper's own loop would feed (n_ctx - 1)
+        budget = min(SPECULATIVE_DRAFT_TOKENS, task.sample_len - generated - 1, task.n_ctx - len(sequence))
+        proposals = _propose(proposer, sequence, budget, task.logit_filters, eot, maps) if budget > 0 else []
+        start = target.length
+        logits = target.forward(torch.tensor([sequence[start:] + proposals], device=device))
+        passes += 1
+        if start == 0 and tokenizer.no_speech is not None:
+            no_speech_prob = logits[0, task.sot_index].softmax(dim=-1)[tokenizer.no_speech].item()
+
+        # The large model's greedy choice after each accepted prefix, exactly as whisper's main loop makes it
+        candidates = torch.tensor([sequence + proposals], device=device)
+        base = len(sequence)
+        emitted = []
+        for i in range(len(proposals) + 1):
+            row = logits[:, base - 1 - start + i].clone()
+            for logit_filter in task.logit_filters:
+                logit_filter.apply(row, candidates[:, :base + i])
+            choice = int(row.argmax(dim=-1))
+            sum_logprob += F.log_softmax(row, dim=-1)[0, choice]
+            emitted.append(choice)
+            if choice == eot or i == len(proposals) or choice != proposals[i]:
+                break
+        accepted = len(emitted) if emitted == proposals[:len(emitted)] else len(emitted) - 1
+
+        target.truncate(base + accepted)
+        proposer.truncate(base + accepted)
+        sequence.extend(emitted)
+        generated += len(emitted)
+        drafted += len(proposals)
+        accepted_total += accepted
+        if emitted[-1] == eot:
+            break
+
+    if stats is not None:
+        stats["drafted"] = stats.get("drafted", 0) + drafted
+        stats["accepted"] = stats.get("accepted", 0) + accepted_total
+        stats["passes"] = stats.get("passes", 0) + passes
+        stats["tokens"] = stats.get("tokens", 0) + generated
+
+    output = sequence[task.sample_begin:]
+    if eot in output:
+        output = output[:output.index(eot)]
+    text = tokenizer.decode(output).strip()
+    result = DecodingResult(
+        audio_features=audio_features[0],
+        language=languages[0],
+        tokens=output,
+        text=text,
+        avg_logprob=sum_logprob.item() / (len(output) + 1),
+        no_speech_prob=no_speech_prob,
+        temperature=options.temperature,
+        compression_ratio=compression_ratio(text),
+    )
+    return result if single else [result]
@@ -0,0 +1,91 @@
+# sync_path.py
+# Synchronous fast path: short clips are transcribed inside the API process and the result is
+# returned in the /transcribe response, skipping the broker round trip, the result backend and
+# client polling.
+#
+# Requests opt in with mode=sync (query string or form field), or every short clip does when
+# WHISPER_SYNC_MODE=auto. A clip is served synchronously only if it is at most WHISPER_SYNC_MAX_SECONDS
+# long, its model is one of WHISPER_SYNC_MODELS and already loaded in this process, and one of the
+# WHISPER_SYNC_WORKERS slots frees up within WHISPER_SYNC_QUEUE_TIMEOUT_MS. Otherwise the request
+# falls back to the regular Celery path, so a burst of short clips never queues up inside the API.
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from whisper_wrapper import transcribe_audio, load_whisper_model, is_model_loaded
+
+logger = logging.getLogger(__name__)
+
+SYNC_WORKERS = int(os.environ.get('WHISPER_SYNC_WORKERS', '0'))  # Concurrent in-process decodes, 0 disables
+SYNC_MODE_DEFAULT = os.environ.get('WHISPER_SYNC_MODE', 'async').strip().lower()  # 'auto': short clips go sync
+SYNC_MAX_SECONDS = float(os.environ.get('WHISPER_SYNC_MAX_SECONDS', '30'))
+SYNC_MODELS = [m.strip() for m in os.environ.get('WHISPER_SYNC_MODELS', 'base').split(',') if m.strip()]
+SYNC_QUEUE_TIMEOUT = int(os.environ.get('WHISPER_SYNC_QUEUE_TIMEOUT_MS', '0')) / 1000.0
+
+SYNC_MODES = ('sync', 'auto', 'async')
+
+
+class SyncTranscriber:
+    """
+    Bounded in-process pool for synchronous transcriptions.
+    A slot is taken before anything is queued; when none frees up within the timeout the caller
+    gets None and hands the clip to Celery instead (backpressure instead of an unbounded queue).
+    """
+
+    def __init__(self, workers=SYNC_WORKERS, queue_timeout=SYNC_QUEUE_TIMEOUT, max_seconds=SYNC_MAX_SECONDS,
+                 models=SYNC_MODELS):
+        self.workers = workers
+        self.queue_timeout = queue_timeout
+        self.max_seconds = max_seconds
+        self.models = models
+        self._slots = threading.BoundedSemaphore(workers) if workers > 0 else None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self._slots is not None
+
+    def fallback_reason(self, model_name, duration, chunked=False):
+        """Why a clip can't be served synchronously (None if it can); checked before waiting for a slot."""
+        if not self.enabled:
+            return 'disabled'
+        if chunked:
+            return 'chunked'
+        if '*' not in self.models and model_name not in self.models:
+            return 'model'
+        if duration is None:
+            return 'unknown_duration'
+        if duration > self.max_seconds:
+            return 'too_long'
+        if not is_model_loaded(model_name):
+            return 'cold_model'  # Loading would stall the request; a worker has it warm
+        return None
+
+    def run(self, **transcribe_options):
+        """transcribe_audio(**transcribe_options) on a pool thread, or None when the pool is saturated."""
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            return None
+        try:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='sync-transcribe')
+            return self._executor.submit(transcribe_audio, **transcribe_options).result()
+        finally:
+            self._slots.release()
+
+    def warm_up(self):
+        """Loads the sync models in the background so the first short clips don't fall back as 'cold_model'."""
+        if not self.enabled or '*' in self.models:
+            return
+
+        def load():
+            for model_name in self.models:
+                logger.info("Loading '%s' for synchronous transcriptions...", model_name)
+                if load_whisper_model(model_name=model_name, pin=True) is None:
+                    logger.error("Could not load '%s' for synchronous transcriptions.", model_name)
+
+        threading.Thread(target=load, name='sync-warm-up', daemon=True).start()
+
+sync_transcriber = SyncTranscriber()
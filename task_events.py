@@ -0,0 +1,141 @@
+# task_events.py
+# Push channel for task state: workers publish state changes and progress to Redis pub/sub,
+# the API relays them to browsers as Server-Sent Events (/events/<task_id>).
+#
+# The most recent event of every task is also kept under a key with a TTL, so a client that
+# subscribes after an event was published still starts from the current state.
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+TASK_EVENTS_ENABLED = os.environ.get('TASK_EVENTS_ENABLED', 'true').lower() in ['true', 'on', '1']
+TASK_EVENTS_REDIS_URL = os.environ.get('TASK_EVENTS_REDIS_URL',
+                                       os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0'))
+LAST_EVENT_TTL = int(os.environ.get('TASK_EVENTS_LAST_EVENT_TTL', str(24 * 3600)))
+CHANNEL_PREFIX = 'whisper:events:'
+LAST_EVENT_PREFIX = 'whisper:events:last:'
+PARTIAL_SEGMENTS_PREFIX = 'whisper:partial:'  # Redis list of JSON segments decoded so far
+CHUNK_PROGRESS_PREFIX = 'whisper:chunk-progress:'  # Redis hash: chunk index -> fraction done (chunked jobs)
+TERMINAL_STATES = {'SUCCESS', 'FAILURE', 'REVOKED'}
+
+_redis_client = None
+
+
+def get_redis():
+    """Process-wide Redis client (created lazily so forked workers get their own connection pool)."""
+    global _redis_client
+    if _redis_client is None:
+        import redis
+        _redis_client = redis.Redis.from_url(TASK_EVENTS_REDIS_URL)
+    return _redis_client
+
+
+def publish_task_event(task_id, state, **fields):
+    """Publishes {"task_id", "state", **fields}. Failures are logged, never raised into the task."""
+    if not TASK_EVENTS_ENABLED or not task_id:
+        return
+    event = {"task_id": task_id, "state": state, "timestamp": time.time(), **fields}
+    payload = json.dumps(event, separators=(',', ':'))
+    try:
+        client = get_redis()
+        pipe = client.pipeline(transaction=False)
+        pipe.set(LAST_EVENT_PREFIX + task_id, payload, ex=LAST_EVENT_TTL)
+        pipe.publish(CHANNEL_PREFIX + task_id, payload)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Task events: failed to publish {state} for {task_id}: {e}")
+
+
+def append_partial_segments(task_id, segments):
+    """
+    Appends newly decoded segments to the task's partial transcript.
+    Returns the length of the partial transcript (None if it could not be stored or nothing was added).
+    """
+    if not TASK_EVENTS_ENABLED or not task_id or not segments:
+        return None
+    key = PARTIAL_SEGMENTS_PREFIX + task_id
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.rpush(key, *[json.dumps(segment, separators=(',', ':')) for segment in segments])
+        pipe.expire(key, LAST_EVENT_TTL)
+        length, _ = pipe.execute()
+        return length
+    except Exception as e:
+        logger.warning(f"Task events: failed to store partial segments for {task_id}: {e}")
+        return None
+
+
+def record_chunk_progress(task_id, chunk_index, fraction_done):
+    """
+    Stores the progress of one chunk of a chunked job (chunks run on different workers) and
+    returns the progress of all its chunks as {chunk index: fraction done}, or None on failure.
+    """
+    if not TASK_EVENTS_ENABLED or not task_id:
+        return None
+    key = CHUNK_PROGRESS_PREFIX + task_id
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.hset(key, str(chunk_index), fraction_done)
+        pipe.expire(key, LAST_EVENT_TTL)
+        pipe.hgetall(key)
+        _, _, fractions = pipe.execute()
+        return {int(index): float(fraction) for index, fraction in fractions.items()}
+    except Exception as e:
+        logger.warning(f"Task events: failed to store chunk progress for {task_id}: {e}")
+        return None
+
+
+def get_partial_segments(task_id, start=0):
+    if not TASK_EVENTS_ENABLED:
+        return []
+    try:
+        raw_segments = get_redis().lrange(PARTIAL_SEGMENTS_PREFIX + task_id, start, -1)
+    except Exception as e:
+        logger.warning(f"Task events: failed to read partial segments for {task_id}: {e}")
+        return []
+    return [json.loads(raw) for raw in raw_segments]
+
+
+def clear_partial_segments(task_id):
+    """Called once the full result is stored; the partial transcript is then redundant."""
+    if not TASK_EVENTS_ENABLED:
+        return
+    try:
+        get_redis().delete(PARTIAL_SEGMENTS_PREFIX + task_id, CHUNK_PROGRESS_PREFIX + task_id)
+    except Exception as e:
+        logger.warning(f"Task events: failed to clear partial segments for {task_id}: {e}")
+
+
+def get_last_task_event(task_id):
+    raw = get_redis().get(LAST_EVENT_PREFIX + task_id)
+    return json.loads(raw) if raw is not None else None
+
+
+def subscribe_task_events(task_id, max_seconds=3600, keepalive_seconds=15):
+    """
+    Yields the task's events as dicts until a terminal state is seen or `max_seconds` pass.
+    Yields None every `keepalive_seconds` without events so the caller can keep the connection alive.
+    """
+    pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(CHANNEL_PREFIX + task_id)  # Subscribe before reading the last event so nothing is missed
+    try:
+        last_event = get_last_task_event(task_id)
+        if last_event is not None:
+            yield last_event
+            if last_event["state"] in TERMINAL_STATES:
+                return
+        deadline = time.monotonic() + max_seconds
+        while time.monotonic() < deadline:
+            message = pubsub.get_message(timeout=keepalive_seconds)
+            if message is None:
+                yield None
+                continue
+            event = json.loads(message["data"])
+            yield event
+            if event["state"] in TERMINAL_STATES:
+                return
+    finally:
+        pubsub.close()
@@ -0,0 +1,50 @@
+import io
+import os
+import shutil
+import subprocess
+
+import numpy as np
+import pytest
+
+from audio_ingest import ingest_multipart_audio
+
+pytestmark = pytest.mark.skipif(shutil.which('ffmpeg') is None, reason="ffmpeg is not installed")
+
+BOUNDARY = 'test-boundary'
+
+
+def multipart_body(filename, data, **fields):
+    parts = [f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+             for name, value in fields.items()]
+    parts.append(f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="audio_file"; filename="{filename}"\r\n'
+                 f'Content-Type: application/octet-stream\r\n\r\n'.encode() + data + b'\r\n')
+    return b''.join(parts) + f'--{BOUNDARY}--\r\n'.encode()
+
+
+def encode(tmp_path, name, seconds, *codec):
+    path = tmp_path / name
+    subprocess.run(['ffmpeg', '-nostdin', '-loglevel', 'error', '-f', 'lavfi', '-i',
+                    f'sine=frequency=440:duration={seconds}', *codec, str(path)], check=True)
+    return path.read_bytes()
+
+
+@pytest.mark.parametrize("name, codec", [
+    ("tone.wav", ()),
+    # The mp4 muxer writes the moov atom after the audio unless asked for +faststart
+    ("tone.m4a", ('-c:a', 'aac')),
+])
+def test_streamed_ingestion_decodes_to_pcm(tmp_path, name, codec):
+    seconds = 120
+    data = encode(tmp_path, name, seconds, *codec)
+    if name.endswith('.m4a'):
+        assert data.index(b'moov') > data.index(b'mdat')
+    pcm_path = str(tmp_path / 'upload.f32')
+
+    upload = ingest_multipart_audio(io.BytesIO(multipart_body(name, data, model_name='tiny')),
+                                    f'multipart/form-data; boundary={BOUNDARY}', pcm_path)
+
+    assert upload.form == {"model_name": "tiny"}
+    assert upload.bytes_received == len(data)
+    assert abs(upload.duration - seconds) < 0.1
+    assert len(np.fromfile(pcm_path, dtype=np.float32)) == upload.samples
+    assert sorted(os.listdir(tmp_path)) == sorted([name, 'upload.f32'])  # No spool file left behind
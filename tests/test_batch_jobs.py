@@ -0,0 +1,59 @@
+import hashlib
+import os
+
+import pytest
+
+import batch_jobs
+from batch_jobs import BatchError, resolve_manifest_path, stage_server_file
+
+
+@pytest.fixture
+def batch_root(tmp_path, monkeypatch):
+    root = tmp_path / 'media'
+    (root / 'calls').mkdir(parents=True)
+    (root / 'calls' / 'a.wav').write_bytes(b'RIFF a')
+    (tmp_path / 'media2').mkdir()  # Shares the root's name as a prefix
+    (tmp_path / 'media2' / 'b.wav').write_bytes(b'RIFF b')
+    (tmp_path / 'secret.wav').write_bytes(b'RIFF secret')
+    monkeypatch.setattr(batch_jobs, 'BATCH_ROOT', str(root))
+    return root
+
+
+def test_paths_below_the_root_resolve(batch_root):
+    expected = os.path.realpath(batch_root / 'calls' / 'a.wav')
+    assert resolve_manifest_path('calls/a.wav') == expected
+    assert resolve_manifest_path('calls/../calls/./a.wav') == expected
+    assert resolve_manifest_path(str(batch_root / 'calls' / 'a.wav')) == expected  # Absolute, but inside
+    os.symlink(batch_root / 'calls' / 'a.wav', batch_root / 'link.wav')
+    assert resolve_manifest_path('link.wav') == expected
+
+
+@pytest.mark.parametrize('path', ['../secret.wav', 'calls/../../secret.wav', '../media2/b.wav', '/etc/passwd',
+                                  'escape.wav'])
+def test_paths_outside_the_root_are_rejected(batch_root, path):
+    os.symlink(batch_root.parent / 'secret.wav', batch_root / 'escape.wav')  # A link out of the root
+    with pytest.raises(BatchError, match='outside of the batch root'):
+        resolve_manifest_path(path)
+
+
+def test_missing_files_and_directories_are_rejected(batch_root):
+    for path in ('calls/missing.wav', 'calls', ''):
+        with pytest.raises(BatchError, match='does not exist'):
+            resolve_manifest_path(path)
+
+
+def test_manifests_are_disabled_without_a_root(monkeypatch):
+    monkeypatch.setattr(batch_jobs, 'BATCH_ROOT', None)
+    with pytest.raises(BatchError, match='disabled'):
+        resolve_manifest_path('a.wav')
+
+
+def test_staged_files_keep_the_source_and_hash_its_bytes(batch_root, tmp_path):
+    uploads = tmp_path / 'uploads'
+    uploads.mkdir()
+    source = resolve_manifest_path('calls/a.wav')
+    staged_path, digest = stage_server_file(source, str(uploads))
+    assert os.path.dirname(staged_path) == str(uploads) and staged_path.endswith('.wav')
+    assert digest == hashlib.sha256(b'RIFF a').hexdigest()
+    os.remove(staged_path)  # As the task does
+    assert open(source, 'rb').read() == b'RIFF a'
@@ -0,0 +1,78 @@
+import numpy as np
+
+from chunking import chunk_progress, core_segments, merge_chunk_results, plan_chunks
+
+# Two chunks of a 20 s recording cut at 10 s with 2 s of overlap
+CHUNKS = [
+    {"start": 0.0, "end": 12.0, "core_start": 0.0, "core_end": 10.0},
+    {"start": 8.0, "end": 20.0, "core_start": 10.0, "core_end": 20.0},
+]
+
+
+def segment(start, end, text, **extra):
+    return {"id": 0, "seek": 0, "start": start, "end": end, "text": text, "tokens": [1], **extra}
+
+
+def test_merge_shifts_onto_the_original_timeline_and_keeps_overlaps_once():
+    first = {"language": "en", "segments": [segment(0.0, 4.0, " a"), segment(8.5, 9.5, " b"),
+                                             segment(10.2, 11.8, " c")]}
+    # 0.5-1.5 in the second chunk is 8.5-9.5 on the timeline (the first chunk's core), 2.2-3.8 is " c" again
+    second = {"language": "en", "segments": [segment(0.5, 1.5, " b"), segment(2.2, 3.8, " c"),
+                                              segment(6.0, 11.0, " d")]}
+
+    merged = merge_chunk_results([first, second], CHUNKS)
+
+    assert [s["text"] for s in merged["segments"]] == [" a", " b", " c", " d"]
+    assert [(s["start"], s["end"]) for s in merged["segments"]] == [(0.0, 4.0), (8.5, 9.5), (10.2, 11.8), (14.0, 19.0)]
+    assert [s["id"] for s in merged["segments"]] == [0, 1, 2, 3]
+    assert merged["segments"][3]["seek"] == 800  # Shifted by 8 s of 10 ms mel frames
+    assert merged["text"] == " a b c d"
+    assert merged["language"] == "en"
+    assert merged["chunks"] == 2
+
+
+def test_merge_shifts_words_and_keeps_segments_past_the_last_core():
+    words = [{"word": " e", "start": 11.5, "end": 12.4, "probability": 0.9}]
+    second = {"language": "de", "segments": [segment(11.5, 12.4, " e", words=words)]}
+    merged = merge_chunk_results([{"language": None, "segments": []}, second],
+                                 [CHUNKS[0], dict(CHUNKS[1], end=20.1, core_end=20.0)])
+
+    assert merged["segments"][0]["words"] == [{"word": " e", "start": 19.5, "end": 20.4, "probability": 0.9}]
+    assert merged["language"] == "de"
+
+
+def test_merge_reports_failed_chunks():
+    merged = merge_chunk_results([{"segments": []}, {"error": "out of memory"}], CHUNKS)
+    assert merged == {"error": "1 of 2 chunks failed: out of memory"}
+
+
+def test_merge_sums_vad_skipped_seconds():
+    merged = merge_chunk_results([{"segments": [], "vad_skipped_seconds": 1.25},
+                                  {"segments": [], "vad_skipped_seconds": 2.5}], CHUNKS)
+    assert merged["vad_skipped_seconds"] == 3.75
+
+
+def test_core_segments_filters_by_midpoint():
+    kept = core_segments([segment(0.5, 1.5, " b"), segment(2.2, 3.8, " c")], CHUNKS, 1)
+    assert [(s["start"], s["text"]) for s in kept] == [(10.2, " c")]
+
+
+def test_chunk_progress_is_weighted_by_chunk_length():
+    chunks = [{"start": 0.0, "end": 30.0}, {"start": 30.0, "end": 40.0}]
+    assert chunk_progress({}, chunks) == 0.0
+    assert chunk_progress({1: 1.0}, chunks) == 0.25
+    assert chunk_progress({0: 0.5, 1: 1.0}, chunks) == 0.625
+    assert chunk_progress({0: 1.0, 1: 1.0}, chunks) == 1.0
+
+
+def test_plan_chunks_covers_the_recording_with_overlap():
+    sample_rate = 100
+    audio = np.random.default_rng(0).standard_normal(sample_rate * 95).astype(np.float32)
+    chunks = plan_chunks(audio, sample_rate, chunk_seconds=30, overlap_seconds=2, search_seconds=5)
+
+    assert chunks[0]["core_start"] == 0.0 and chunks[-1]["core_end"] == 95.0
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert previous["core_end"] == chunk["core_start"]
+        assert 25.0 <= previous["core_end"] - previous["core_start"] <= 30.0
+        assert chunk["start"] == chunk["core_start"] - 2
+    assert all(chunk["end"] <= 95.0 for chunk in chunks)
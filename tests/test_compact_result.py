@@ -0,0 +1,79 @@
+import json
+import math
+
+import numpy as np
+import pytest
+
+from benchmarks.run import build_model
+from chunking import merge_chunk_results
+from compact_result import decode_result, encode_result, is_compact_result
+from transcribe_loop import transcribe_windows
+
+
+def assert_round_trip(value, decoded):
+    """Equal up to the documented float rounding (milliseconds for times, 6 decimals otherwise)."""
+    if isinstance(value, float):
+        assert isinstance(decoded, (int, float)) and math.isclose(decoded, value, rel_tol=1e-6, abs_tol=1e-3), \
+            (value, decoded)
+    elif isinstance(value, dict):
+        assert isinstance(decoded, dict) and decoded.keys() == value.keys(), (value, decoded)
+        for key in value:
+            assert_round_trip(value[key], decoded[key])
+    elif isinstance(value, list):
+        assert isinstance(decoded, list) and len(decoded) == len(value), (value, decoded)
+        for item, decoded_item in zip(value, decoded):
+            assert_round_trip(item, decoded_item)
+    else:
+        assert decoded == value and type(decoded) is type(value), (value, decoded)
+
+
+def round_trip(result):
+    # Through JSON, as in the Celery result backend
+    compact = json.loads(json.dumps(encode_result(result)))
+    assert is_compact_result(compact)
+    return decode_result(compact)
+
+
+@pytest.fixture(scope='module')
+def whisper_result():
+    model = build_model('tiny', random_weights=True)
+    audio = (np.random.default_rng(0).standard_normal(16000 * 45) * 0.05).astype(np.float32)
+    return transcribe_windows(model, audio, fp16=False, sample_len=24, language='en', temperature=0.0,
+                              word_timestamps=True)
+
+
+def test_whisper_output_with_word_timestamps_round_trips(whisper_result):
+    assert any(segment["words"] for segment in whisper_result["segments"])
+    decoded = round_trip(whisper_result)
+    assert_round_trip(whisper_result, decoded)
+    assert [s["tokens"] for s in decoded["segments"]] == [s["tokens"] for s in whisper_result["segments"]]
+
+
+def test_merged_chunk_output_round_trips(whisper_result):
+    chunks = [{"start": 0.0, "end": 30.0, "core_start": 0.0, "core_end": 25.0},
+              {"start": 20.0, "end": 65.0, "core_start": 25.0, "core_end": 65.0}]
+    merged = merge_chunk_results([whisper_result, dict(whisper_result, vad_skipped_seconds=1.5)], chunks)
+    assert_round_trip(merged, round_trip(merged))
+
+
+def test_irregular_segments_are_kept_verbatim():
+    regular = {"id": 0, "seek": 0, "start": 0.0, "end": 1.5, "text": " a", "tokens": [50364, 257],
+               "temperature": 0.0, "avg_logprob": -0.25, "compression_ratio": 0.9, "no_speech_prob": 0.01,
+               "words": [{"word": " a", "start": 0.0, "end": 1.5, "probability": 0.5}]}
+    result = {"text": " a b c d", "language": "en", "segments": [
+        regular,
+        dict(regular, id=1, words=[{"word": " b", "start": 1.5, "end": 2.0, "probability": 0.5, "speaker": "S1"}]),
+        {k: v for k, v in regular.items() if k not in ('temperature', 'words')} | {"id": 2},  # Missing fields
+        dict(regular, id=3, avg_logprob=None),
+        {k: v for k, v in regular.items() if k != 'words'} | {"id": 4, "speaker": "S2"},  # No words key
+        dict(regular, id=5, words=[{"word": " d", "start": 3.0, "end": 3.5}]),  # No probability
+    ]}
+    decoded = round_trip(result)
+    assert decoded == result
+    assert "words" not in decoded["segments"][4] and "temperature" not in decoded["segments"][2]
+
+
+def test_results_without_segments_and_errors_are_not_encoded():
+    assert encode_result({"error": "boom"}) == {"error": "boom"}
+    assert encode_result({"text": ""}) == {"text": ""}
+    assert round_trip({"text": "", "segments": [], "language": None}) == {"text": "", "segments": [], "language": None}
@@ -0,0 +1,73 @@
+import fakeredis
+import pytest
+import redis
+
+from result_cache import ResultCache, make_cache_key
+
+RESULT = {"text": " hello", "segments": [], "language": "en"}
+
+
+@pytest.fixture
+def server(monkeypatch):
+    fake_server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis.Redis, 'from_url', classmethod(lambda cls, url, **kw: fakeredis.FakeRedis(server=fake_server)))
+    return fake_server
+
+
+def test_cache_key_depends_on_decode_options_only():
+    options = {"model_name": "tiny", "task_type": "transcribe", "verbose": False}
+    assert make_cache_key("abc", options) == make_cache_key("abc", dict(options, verbose=True, speculative=True))
+    assert make_cache_key("abc", options) != make_cache_key("abc", dict(options, model_name="base"))
+    assert make_cache_key("abc", options) != make_cache_key("abd", options)
+
+
+def test_finished_task_is_remembered_once(server):
+    cache = ResultCache(redis_url='redis://fake')
+    cache.set_inflight('k', 'task-1')
+    assert cache.get_inflight('k') == 'task-1'
+
+    writes = []
+    put = cache.put
+    cache.put = lambda key, result: writes.append(key) or put(key, result)
+    for _ in range(3):  # Every /status poll of the finished task
+        cache.remember_task_result('task-1', RESULT)
+
+    assert writes == ['k']
+    assert cache.get('k') == RESULT
+    assert cache.get_inflight('k') is None
+    assert not fakeredis.FakeRedis(server=server).exists('whisper:result:task:task-1')
+
+
+def test_a_task_is_claimed_by_one_process_only(server):
+    submitting, polling = ResultCache(redis_url='redis://fake'), ResultCache(redis_url='redis://fake')
+    submitting.set_inflight('k', 'task-1')
+
+    polling.remember_task_result('task-1', RESULT)  # Another API process sees the task finish first
+    assert polling.get('k') == RESULT
+    assert submitting.claim_task_key('task-1') == 'k'  # Its local mapping is still dropped once
+    assert submitting.claim_task_key('task-1') is None
+
+
+def test_failed_task_releases_the_inflight_key(server):
+    cache = ResultCache(redis_url='redis://fake')
+    cache.set_inflight('k', 'task-1')
+    cache.forget_failed_task('task-1')
+    assert cache.get_inflight('k') is None
+    assert cache.get('k') is None
+
+
+def test_uncounted_lookups_leave_the_hit_ratio_alone():
+    cache = ResultCache(redis_url=None)
+    assert cache.get('k') is None
+    assert cache.get('k', count=False) is None
+    cache.put('k', RESULT)
+    assert cache.get('k') == RESULT
+    assert cache.get('k', count=False) == RESULT
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["hit_ratio"]) == (1, 1, 0.5)
+
+
+def test_errors_are_never_cached():
+    cache = ResultCache(redis_url=None)
+    cache.put('k', {"error": "boom"})
+    assert cache.get('k') is None
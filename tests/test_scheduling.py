@@ -0,0 +1,82 @@
+from types import SimpleNamespace
+
+import pytest
+
+import scheduling
+from scheduling import FairShare, choose_lane, lane_needs_duration
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(scheduling, 'time', SimpleNamespace(time=lambda: now[0]))  # Only scheduling's clock
+    return now
+
+
+def local_bucket(rate=1.0, burst=100.0):
+    return FairShare(rate=rate, burst=burst, redis_url='')
+
+
+def test_disabled_fair_share_admits_everything(clock):
+    fair_share = local_bucket(rate=0)
+    assert not fair_share.enabled
+    admission = fair_share.admit('a', 10 ** 6)
+    assert admission.decision == 'ok' and admission.cost == 0.0
+
+
+def test_local_bucket_admits_demotes_then_rejects(clock):
+    fair_share = local_bucket()
+    assert not fair_share.use_redis
+
+    first = fair_share.admit('a', 60)
+    assert (first.decision, first.cost, first.tokens) == ('ok', 60, 40)
+    second = fair_share.admit('a', 60)  # 20 s into debt: demoted to bulk
+    assert second.demoted and second.tokens == -20
+    assert fair_share.admit('a', 60).tokens == -80
+    third = fair_share.admit('a', 60)  # Would be 140 s into debt, more than one burst
+    assert third.rejected and third.retry_after == 40 and third.cost == 0.0
+    assert fair_share.admit('b', 60).decision == 'ok'  # Buckets are per client
+
+
+def test_local_bucket_refills_at_rate_up_to_the_burst(clock):
+    fair_share = local_bucket(rate=2.0)
+    fair_share.admit('a', 100)
+    clock[0] += 10
+    assert fair_share.admit('a', 10).tokens == 10  # 20 s earned, 10 s charged
+    clock[0] += 3600
+    assert fair_share.admit('a', 0).tokens == 100
+
+
+def test_refund_and_caps(clock):
+    fair_share = local_bucket()
+    admission = fair_share.admit('a', 10 ** 6)  # One file is charged at most one burst
+    assert admission.cost == 100 and admission.tokens == 0
+    fair_share.refund(admission, 'a')
+    assert fair_share.admit('a', 0).tokens == 100
+    unknown = fair_share.admit('a', None)
+    assert unknown.cost == scheduling.FAIR_SHARE_UNKNOWN_SECONDS
+
+
+def test_local_buckets_are_bounded(clock, monkeypatch):
+    monkeypatch.setattr(scheduling, 'MAX_LOCAL_CLIENTS', 3)
+    fair_share = local_bucket()
+    for client in 'abcd':
+        fair_share.admit(client, 50)
+    assert list(fair_share._buckets) == ['b', 'c', 'd']
+    assert fair_share.admit('a', 50).tokens == 50  # Forgotten clients start from a full bucket
+
+
+def test_lane_choice_is_capped_by_duration():
+    assert choose_lane(None, 30) == 'interactive'
+    assert choose_lane(None, None) == 'default'
+    assert choose_lane('interactive', 120) == 'default'
+    assert choose_lane('default', scheduling.LANE_BULK_SECONDS) == 'bulk'
+    assert choose_lane('interactive', 30, demoted=True) == 'bulk'
+    assert lane_needs_duration('default') and not lane_needs_duration('bulk')
+
+
+def test_lanes_without_duration_caps(monkeypatch):
+    monkeypatch.setattr(scheduling, 'DURATION_LANES', False)
+    assert choose_lane('interactive', 3600) == 'interactive'
+    assert choose_lane(None, 30) == 'default'
+    assert not lane_needs_duration(None)
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+import torch
+import whisper
+from whisper.model import ModelDimensions
+
+from benchmarks.run import build_model, random_model
+from transcribe_loop import transcribe_windows
+from speculative import speculative_decode
+from whisper_wrapper import speculative_window_decoder, transcription_mel
+
+OPTIONS = dict(language='en', temperature=0.0, fp16=False, sample_len=64)
+
+
+@pytest.fixture(scope='module')
+def draft():
+    return build_model('tiny', random_weights=True)
+
+
+@pytest.fixture(scope='module')
+def target():
+    return build_model('base', random_weights=True)
+
+
+@pytest.fixture(scope='module')
+def large_v3_like():
+    """Tiny-sized model with large-v3's 128 mel bins and 100-language vocabulary."""
+    torch.manual_seed(1)
+    return random_model(ModelDimensions(n_mels=128, n_audio_ctx=1500, n_audio_state=384, n_audio_head=6, n_audio_layer=4,
+                                        n_vocab=51866, n_text_ctx=448, n_text_state=384, n_text_head=6,
+                                        n_text_layer=4))
+
+
+@pytest.fixture(scope='module')
+def audio():
+    rng = np.random.default_rng(0)
+    return (rng.standard_normal(16000 * 45) * 0.05).astype(np.float32)
+
+
+def test_window_tokens_match_greedy(target, draft, audio):
+    mel = whisper.pad_or_trim(transcription_mel(audio, target.dims.n_mels), whisper.audio.N_FRAMES)
+    options = whisper.DecodingOptions(language='en', temperature=0.0, fp16=False)
+    stats = {}
+    expected = target.decode(mel, options)
+    drafted = speculative_decode(target, draft, mel, mel, options, stats)
+    assert drafted.tokens == expected.tokens
+    assert drafted.text == expected.text
+    assert stats["passes"] < stats["tokens"]  # Several tokens per target pass
+
+
+@pytest.mark.parametrize('model_fixture', ['target', 'large_v3_like'])
+def test_transcript_tokens_match_greedy(request, model_fixture, draft, audio):
+    model = request.getfixturevalue(model_fixture)
+    expected = transcribe_windows(model, audio, **OPTIONS)
+    decode_window, stats = speculative_window_decoder(model, draft, audio)
+    result = transcribe_windows(model, audio, decode_window=decode_window, **OPTIONS)
+    assert [s["tokens"] for s in result["segments"]] == [s["tokens"] for s in expected["segments"]]
+    assert result["text"] == expected["text"]
+    assert stats["tokens"] > 0
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+import torch
+import whisper
+
+from benchmarks.run import build_model
+from transcribe_loop import transcribe_windows
+
+
+@pytest.fixture(scope='module')
+def model():
+    return build_model('tiny', random_weights=True)  # Random weights: the text is noise, but deterministic
+
+
+@pytest.fixture(scope='module')
+def audio():
+    rng = np.random.default_rng(0)
+    return (rng.standard_normal(16000 * 45) * 0.05).astype(np.float32)  # Two windows
+
+
+@pytest.mark.parametrize('options', [
+    dict(language='en', temperature=0.0),
+    dict(language='en', temperature=0.0, word_timestamps=True, initial_prompt="Meeting notes"),
+    dict(temperature=(0.0, 0.4), best_of=2, task='translate'),
+])
+def test_matches_whisper_transcribe(model, audio, options):
+    torch.manual_seed(0)
+    expected = whisper.transcribe(model, audio, fp16=False, sample_len=24, verbose=None, **options)
+    torch.manual_seed(0)
+    assert transcribe_windows(model, audio, fp16=False, sample_len=24, verbose=None, **options) == expected
+
+
+def test_reports_progress_per_window(model, audio):
+    reports = []
+    result = transcribe_windows(model, audio, fp16=False, sample_len=24, language='en', temperature=0.0,
+                                progress_callback=lambda fraction, segments: reports.append((fraction, segments)))
+    fractions = [fraction for fraction, _ in reports]
+    assert fractions == sorted(fractions) and fractions[-1] == 1.0
+    assert reports[-1][1] == result["segments"]
+
+
+def test_decode_window_sees_every_window(model, audio):
+    seeks = []
+
+    def decode_window(segment, options, seek):
+        seeks.append(seek)
+        return model.decode(segment, options)
+
+    expected = transcribe_windows(model, audio, fp16=False, sample_len=24, language='en', temperature=0.0)
+    assert transcribe_windows(model, audio, fp16=False, sample_len=24, language='en', temperature=0.0,
+                              decode_window=decode_window) == expected
+    assert seeks[0] == 0 and seeks == sorted(seeks)
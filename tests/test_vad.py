@@ -0,0 +1,54 @@
+import numpy as np
+
+from vad import EnergyVAD, extract_regions, map_segments_to_original, to_original_time
+
+SAMPLE_RATE = 16000
+# Speech at 2-5 s and 10-12 s of the original: 0-3 s and 3-5 s of the concatenated speech audio
+REGIONS = [(2.0, 5.0), (10.0, 12.0)]
+
+
+def timeline():
+    _, regions_timeline = extract_regions(np.zeros(15 * SAMPLE_RATE, dtype=np.float32), REGIONS, SAMPLE_RATE)
+    return regions_timeline
+
+
+def test_extract_regions_concatenates_the_speech():
+    audio = np.arange(15 * SAMPLE_RATE, dtype=np.float32)
+    speech, regions_timeline = extract_regions(audio, REGIONS, SAMPLE_RATE)
+    assert len(speech) == 5 * SAMPLE_RATE
+    assert speech[3 * SAMPLE_RATE] == audio[10 * SAMPLE_RATE]
+    assert regions_timeline == [(0.0, 2.0, 3.0), (3.0, 10.0, 2.0)]
+
+
+def test_times_inside_regions_are_shifted():
+    assert to_original_time(0.0, timeline()) == 2.0
+    assert to_original_time(1.5, timeline()) == 3.5
+    assert to_original_time(4.0, timeline()) == 11.0
+    assert to_original_time(9.0, timeline()) == 12.0  # Past the speech audio: clamped to the last region
+
+
+def test_boundary_is_a_start_of_the_later_region_and_an_end_of_the_earlier_one():
+    assert to_original_time(3.0, timeline()) == 10.0
+    assert to_original_time(3.0, timeline(), is_end=True) == 5.0
+    assert to_original_time(0.0, timeline(), is_end=True) == 2.0
+
+
+def test_boundary_aligned_segments_keep_their_region():
+    segments = [
+        {"start": 1.0, "end": 3.0, "text": " first", "words": [{"word": " first", "start": 2.5, "end": 3.0}]},
+        {"start": 3.0, "end": 5.0, "text": " second", "words": [{"word": " second", "start": 3.0, "end": 3.4}]},
+    ]
+    mapped = map_segments_to_original(segments, timeline())
+    assert [(s["start"], s["end"]) for s in mapped] == [(3.0, 5.0), (10.0, 12.0)]
+    assert [(w["start"], w["end"]) for s in mapped for w in s["words"]] == [(4.5, 5.0), (10.0, 10.4)]
+    assert segments[0]["end"] == 3.0  # The input is not modified
+
+
+def test_energy_vad_finds_a_tone_between_silence():
+    t = np.arange(6 * SAMPLE_RATE) / SAMPLE_RATE
+    audio = np.where((t >= 2.0) & (t < 4.0), 0.5 * np.sin(2 * np.pi * 1000 * t), 0.0).astype(np.float32)
+    audio += np.random.default_rng(0).normal(0, 1e-4, len(audio)).astype(np.float32)
+    regions = EnergyVAD().detect(audio, SAMPLE_RATE)
+    assert len(regions) == 1
+    start, end = regions[0]
+    assert 1.7 <= start <= 2.0 and 4.0 <= end <= 4.3
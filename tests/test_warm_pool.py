@@ -0,0 +1,185 @@
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+from billiard.pool import Pool
+from celery import Celery
+
+import celery_worker_app
+from warm_pool import WarmPoolController
+
+NOW = 10000.0
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def process(pid, models=(), running=0, idle_for=None):
+    return {"pid": pid, "models": list(models), "running": running,
+            "idle_since": NOW - idle_for if idle_for is not None else None}
+
+
+def worker(node, processes, max_processes=4, queues=('whisper.base',), warmed=(), pool='prefork', **extra):
+    return {"node": node, "pool": pool, "processes": len(processes), "max_processes": max_processes,
+            "queues": list(queues), "preload": [], "warmed": list(warmed), "process_list": processes, **extra}
+
+
+def model(warm, target, queue):
+    return {"warm_processes": warm, "target_processes": target, "queue": queue}
+
+
+def plan(snapshot, controller=None):
+    return (controller or WarmPoolController(app=None, idle_seconds=600, min_processes=1)).plan(snapshot, now=NOW)
+
+
+def test_grows_on_workers_serving_the_model_first_and_reports_the_rest_as_scale_out():
+    snapshot = {
+        "models": {"large": model(warm=1, target=6, queue='whisper.large')},
+        "workers": [worker('a', [process(1, ['base'], running=1)], max_processes=8),
+                    worker('b', [process(2, ['large'], running=1)], queues=('whisper.large',), max_processes=3)],
+    }
+    actions = plan(snapshot)
+    assert [(a["action"], a["node"], a["processes"]) for a in actions] == [
+        ("grow", 'b', 2), ("grow", 'a', 3)]
+
+    snapshot["workers"][0]["max_processes"] = 2
+    assert [(a["action"], a["node"], a["processes"]) for a in plan(snapshot)] == [
+        ("grow", 'b', 2), ("grow", 'a', 1), ("scale_out", None, 2)]
+
+
+def test_requested_processes_count_as_warm_during_the_grace_period():
+    snapshot = {"models": {"large": model(warm=0, target=2, queue='whisper.large')},
+                "workers": [worker('a', [process(1)], max_processes=8)]}
+    controller = WarmPoolController(app=None, grace_seconds=180)
+    controller._pending.append((NOW + 60, 'large', 2, 0))
+    assert plan(snapshot, controller) == []
+    snapshot["models"]["large"]["warm_processes"] = 1  # One arrived, one is still loading
+    assert plan(snapshot, controller) == []
+    controller._pending[0] = (NOW - 1, 'large', 2, 0)  # Expired: requested again
+    assert [(a["action"], a["processes"]) for a in plan(snapshot, controller)] == [("grow", 1)]
+
+
+def test_drains_idle_processes_but_keeps_needed_models_and_the_minimum():
+    snapshot = {
+        "models": {"base": model(warm=2, target=1, queue='whisper.base'),
+                   "large": model(warm=1, target=1, queue='whisper.large')},
+        "workers": [worker('a', [process(1, ['base'], idle_for=900), process(2, ['base'], idle_for=900),
+                                 process(3, ['large'], idle_for=900), process(4, [], idle_for=60),
+                                 process(5, [], running=1), process(6, [], idle_for=1200)])],
+    }
+    actions = plan(snapshot)
+    # 1: surplus base; 2: the last base process the target needs; 3: large is at its target; 4: idle too briefly
+    assert [(a["action"], a["pids"]) for a in actions] == [("drain", [1, 6])]
+
+    controller = WarmPoolController(app=None, idle_seconds=600, min_processes=5)
+    assert [a["pids"] for a in plan(snapshot, controller)] == [[1]]
+
+
+def test_releases_warmed_models_without_demand_and_leaves_other_pools_alone():
+    snapshot = {
+        "models": {"large": model(warm=1, target=0, queue='whisper.large')},
+        "workers": [worker('a', [process(1, ['large'], running=1)], warmed=['large']),
+                    worker('t', [process(2, [], idle_for=9999)], pool='threads')],
+    }
+    assert [(a["action"], a["node"], a["model"]) for a in plan(snapshot)] == [("release", 'a', 'large')]
+
+
+def test_workers_that_cannot_resize_are_neither_grown_nor_drained():
+    snapshot = {
+        "models": {"large": model(warm=0, target=1, queue='whisper.large')},
+        "workers": [worker('a', [process(1, [], idle_for=900), process(2, [], idle_for=900)], resizable=False)],
+    }
+    assert [(a["action"], a["processes"]) for a in plan(snapshot)] == [("scale_out", 1)]
+
+
+class PreforkStub:
+    __module__ = 'celery.concurrency.prefork'  # What _is_prefork looks at
+
+    def __init__(self, pool):
+        self._pool = pool
+        self.grow = lambda n: None
+
+
+def test_missing_pool_internals_disable_grow_and_drain(monkeypatch):
+    class BilliardPoolStub:  # Methods of billiard's Pool, but none of the attributes its __init__ sets
+        _worker_active = Pool._worker_active
+        on_shrink = Pool.on_shrink
+
+    consumer = type('Consumer', (), {'_update_prefetch_count': lambda self, n: None})()
+    consumer.pool = PreforkStub(BilliardPoolStub())
+    consumer.controller = type('Controller', (), {'autoscaler': None})()
+    assert celery_worker_app.missing_pool_internals(consumer) == [
+        'BilliardPoolStub._pool', 'BilliardPoolStub._processes', 'BilliardPoolStub._putlock']
+
+    monkeypatch.setattr(celery_worker_app, 'pool_resize_unsupported', None)
+    celery_worker_app.check_pool_internals(sender=consumer)
+    assert 'BilliardPoolStub._putlock' in celery_worker_app.pool_resize_unsupported
+    state = type('State', (), {'consumer': consumer})()
+    assert 'disabled' in celery_worker_app.warm_pool_drain(state, '1')['error']
+    assert 'disabled' in celery_worker_app.warm_pool_grow(state, 'tiny')['error']
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def redis_url():
+    fakeredis = pytest.importorskip('fakeredis')
+    port = free_port()
+    server = fakeredis.TcpFakeServer(('127.0.0.1', port), server_type='redis')
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'redis://127.0.0.1:{port}'
+    server.shutdown()
+    server.server_close()
+
+
+def pool_pids(app, node):
+    stats = app.control.inspect(destination=[node], timeout=5).stats() or {}
+    return stats.get(node, {}).get('pool', {}).get('processes')
+
+
+def test_warm_pool_drain_stops_idle_processes_of_a_real_prefork_pool(redis_url, tmp_path):
+    node = 'drain@test'
+    env = dict(os.environ, CELERY_BROKER_URL=f'{redis_url}/0', CELERY_RESULT_BACKEND=f'{redis_url}/1',
+               TASK_EVENTS_REDIS_URL=f'{redis_url}/2', WHISPER_AUTOSCALE_INTERVAL='0', WHISPER_METRICS_PORT='0',
+               WHISPER_WORKER_MODELS='', RESULT_CACHE_ENABLED='false')
+    env.pop('PROMETHEUS_MULTIPROC_DIR', None)
+    log = open(tmp_path / 'worker.log', 'wb')
+    worker_process = subprocess.Popen(
+        [sys.executable, '-m', 'celery', '-A', 'celery_worker_app.celery', 'worker', '-P', 'prefork', '-c', '3',
+         '-Q', 'celery', '-n', node, '--without-mingle', '--without-gossip', '-l', 'info'],
+        cwd=REPO_ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    app = Celery(broker=f'{redis_url}/0', backend=f'{redis_url}/1')
+    try:
+        deadline = time.time() + 120
+        pids = None
+        while time.time() < deadline and not pids:
+            assert worker_process.poll() is None, (tmp_path / 'worker.log').read_text()
+            pids = pool_pids(app, node)
+        assert pids and len(pids) == 3, (tmp_path / 'worker.log').read_text()
+
+        reply = app.control.broadcast('warm_pool_drain', destination=[node], reply=True, timeout=10,
+                                      arguments={'pids': f'{pids[0]},999999'})
+        assert reply == [{node: {'ok': {'drained': [pids[0]], 'skipped': [999999]}}}]
+
+        # The pool reaps the stopped process on its next maintenance pass, and must not replace it
+        remaining = pids
+        deadline = time.time() + 30
+        while time.time() < deadline and pids[0] in remaining:
+            time.sleep(1)
+            remaining = pool_pids(app, node)
+        time.sleep(3)
+        assert sorted(pool_pids(app, node)) == sorted(pids[1:])
+        with pytest.raises(ProcessLookupError):
+            os.kill(pids[0], 0)
+        # The remaining processes still take tasks
+        assert app.send_task('celery.accumulate', args=(1, 2)).get(timeout=30) == [1, 2]
+    finally:
+        worker_process.terminate()
+        worker_process.wait(timeout=60)
+        log.close()
@@ -0,0 +1,211 @@
+# transcribe_loop.py
+# The service's own copy of whisper.transcribe's window loop.
+#
+# whisper.transcribe decodes a recording in 30 s windows but exposes nothing per window: no
+# callback with the segments decoded so far, and no way to decode a window with anything other
+# than model.decode. transcribe_windows runs the same loop (seek over the padded spectrogram,
+# temperature fallback, timestamp-token segmentation, prompt conditioning, word timestamps) with
+# two explicit hooks:
+#
+#   progress_callback(fraction_done, segments_so_far)   after every decoded window
+#   decode_window(mel_segment, options, seek)            decodes one window (default: model.decode)
+#
+# It only uses whisper's public building blocks (model.decode, DecodingOptions, log_mel_spectrogram,
+# pad_or_trim, get_tokenizer, timing.add_word_timestamps) and returns the same result as
+# whisper.transcribe for the options the service passes; tests/test_transcribe_loop.py checks that.
+# clip_timestamps and hallucination_silence_threshold are not supported.
+import warnings
+
+import torch
+import tqdm
+from whisper.audio import FRAMES_PER_SECOND, HOP_LENGTH, N_FRAMES, N_SAMPLES, SAMPLE_RATE, log_mel_spectrogram, pad_or_trim
+from whisper.decoding import DecodingOptions
+from whisper.timing import add_word_timestamps
+from whisper.tokenizer import LANGUAGES, get_tokenizer
+from whisper.utils import exact_div, format_timestamp, get_end, make_safe
+
+
+def transcribe_windows(model, audio, *, mel=None, verbose=None, temperature=(0.0, 0.2, 0.4, 0.6, 0.8, 1.0),
+                       compression_ratio_threshold=2.4, logprob_threshold=-1.0, no_speech_threshold=0.6,
+                       condition_on_previous_text=True, initial_prompt=None, word_timestamps=False,
+                       prepend_punctuations="\"'“¿([{-", append_punctuations="\"'.。,，!！?？:：”)]}、",
+                       progress_callback=None, decode_window=None, **decode_options):
+    """
+    Same arguments and result as whisper.transcribe(model, audio, ...), plus:
+    mel: log-mel spectrogram of `audio` padded with 30 s of silence (computed if None).
+    progress_callback(fraction_done, segments_so_far): called after every decoded window.
+    decode_window(mel_segment, options, seek): decodes one window; seek is its first mel frame.
+    """
+    dtype = torch.float16 if decode_options.get("fp16", True) else torch.float32
+    if model.device == torch.device("cpu"):
+        if torch.cuda.is_available():
+            warnings.warn("Performing inference on CPU when CUDA is available")
+        if dtype == torch.float16:
+            warnings.warn("FP16 is not supported on CPU; using FP32 instead")
+            dtype = torch.float32
+    if dtype == torch.float32:
+        decode_options["fp16"] = False
+
+    if mel is None:
+        mel = log_mel_spectrogram(audio, model.dims.n_mels, padding=N_SAMPLES)
+    content_frames = mel.shape[-1] - N_FRAMES
+
+    if decode_options.get("language") is None:
+        if not model.is_multilingual:
+            decode_options["language"] = "en"
+        else:
+            if verbose:
+                print("Detecting language using up to the first 30 seconds. Use `--language` to specify the language")
+            _, probs = model.detect_language(pad_or_trim(mel, N_FRAMES).to(model.device).to(dtype))
+            decode_options["language"] = max(probs, key=probs.get)
+            if verbose is not None:
+                print(f"Detected language: {LANGUAGES[decode_options['language']].title()}")
+
+    language = decode_options["language"]
+    task = decode_options.get("task", "transcribe")
+    tokenizer = get_tokenizer(model.is_multilingual, num_languages=model.num_languages, language=language, task=task)
+    if word_timestamps and task == "translate":
+        warnings.warn("Word-level timestamps on translations may not be reliable.")
+    if decode_window is None:
+        decode_window = lambda segment, options, seek: model.decode(segment, options)
+
+    def decode_with_fallback(segment, seek):
+        temperatures = [temperature] if isinstance(temperature, (int, float)) else temperature
+        decode_result = None
+        for t in temperatures:
+            kwargs = {**decode_options}
+            if t > 0:  # Sampling: no beam search
+                kwargs.pop("beam_size", None)
+                kwargs.pop("patience", None)
+            else:  # Greedy or beam search: best_of doesn't apply
+                kwargs.pop("best_of", None)
+            decode_result = decode_window(segment, DecodingOptions(**kwargs, temperature=t), seek)
+
+            needs_fallback = False
+            if compression_ratio_threshold is not None and decode_result.compression_ratio > compression_ratio_threshold:
+                needs_fallback = True  # Too repetitive
+            if logprob_threshold is not None and decode_result.avg_logprob < logprob_threshold:
+                needs_fallback = True  # Average log probability too low
+            if no_speech_threshold is not None and decode_result.no_speech_prob > no_speech_threshold \
+                    and logprob_threshold is not None and decode_result.avg_logprob < logprob_threshold:
+                needs_fallback = False  # Silence
+            if not needs_fallback:
+                break
+        return decode_result
+
+    seek = 0
+    input_stride = exact_div(N_FRAMES, model.dims.n_audio_ctx)  # Mel frames per output token: 2
+    time_precision = input_stride * HOP_LENGTH / SAMPLE_RATE  # Seconds per output token: 0.02
+    all_tokens = []
+    all_segments = []
+    prompt_reset_since = 0
+    initial_prompt_tokens = tokenizer.encode(" " + initial_prompt.strip()) if initial_prompt is not None else []
+    all_tokens.extend(initial_prompt_tokens)
+
+    def new_segment(*, start, end, tokens, result):
+        tokens = tokens.tolist()
+        return {
+            "seek": seek,
+            "start": start,
+            "end": end,
+            "text": tokenizer.decode([token for token in tokens if token < tokenizer.eot]),
+            "tokens": tokens,
+            "temperature": result.temperature,
+            "avg_logprob": result.avg_logprob,
+            "compression_ratio": result.compression_ratio,
+            "no_speech_prob": result.no_speech_prob,
+        }
+
+    # The console bar for verbose=False, as in whisper.transcribe (verbose=True prints the segments)
+    with tqdm.tqdm(total=content_frames, unit="frames", disable=verbose is not False) as pbar:
+        last_speech_timestamp = 0.0
+        while seek < content_frames:
+            time_offset = float(seek * HOP_LENGTH / SAMPLE_RATE)
+            segment_size = min(N_FRAMES, content_frames - seek)
+            mel_segment = pad_or_trim(mel[:, seek:seek + segment_size], N_FRAMES).to(model.device).to(dtype)
+            decode_options["prompt"] = all_tokens[prompt_reset_since:]
+
+            result = decode_with_fallback(mel_segment, seek)
+            tokens = torch.tensor(result.tokens)
+
+            if no_speech_threshold is not None:
+                should_skip = result.no_speech_prob > no_speech_threshold
+                if logprob_threshold is not None and result.avg_logprob > logprob_threshold:
+                    should_skip = False  # Confident text despite the no-speech probability
+                if should_skip:
+                    seek += segment_size  # Fast-forward to the next window
+                    if progress_callback is not None:
+                        progress_callback(min(1.0, seek / content_frames), list(all_segments))
+                    continue
+
+            previous_seek = seek
+            current_segments = []
+            timestamp_tokens = tokens.ge(tokenizer.timestamp_begin)
+            single_timestamp_ending = timestamp_tokens[-2:].tolist() == [False, True]
+            consecutive = torch.where(timestamp_tokens[:-1] & timestamp_tokens[1:])[0]
+            consecutive.add_(1)
+            if len(consecutive) > 0:
+                # Segments end at pairs of consecutive timestamp tokens
+                slices = consecutive.tolist()
+                if single_timestamp_ending:
+                    slices.append(len(tokens))
+                last_slice = 0
+                for current_slice in slices:
+                    sliced_tokens = tokens[last_slice:current_slice]
+                    start_timestamp_pos = sliced_tokens[0].item() - tokenizer.timestamp_begin
+                    end_timestamp_pos = sliced_tokens[-1].item() - tokenizer.timestamp_begin
+                    current_segments.append(new_segment(start=time_offset + start_timestamp_pos * time_precision,
+                                                        end=time_offset + end_timestamp_pos * time_precision,
+                                                        tokens=sliced_tokens, result=result))
+                    last_slice = current_slice
+                if single_timestamp_ending:
+                    seek += segment_size  # No speech after the last timestamp
+                else:
+                    # Drop the unfinished segment and continue from the last timestamp
+                    seek += (tokens[last_slice - 1].item() - tokenizer.timestamp_begin) * input_stride
+            else:
+                duration = segment_size * HOP_LENGTH / SAMPLE_RATE
+                timestamps = tokens[timestamp_tokens.nonzero().flatten()]
+                if len(timestamps) > 0 and timestamps[-1].item() != tokenizer.timestamp_begin:
+                    # No consecutive timestamps, but a final one: use it as the end
+                    duration = (timestamps[-1].item() - tokenizer.timestamp_begin) * time_precision
+                current_segments.append(new_segment(start=time_offset, end=time_offset + duration,
+                                                    tokens=tokens, result=result))
+                seek += segment_size
+
+            if word_timestamps:
+                add_word_timestamps(segments=current_segments, model=model, tokenizer=tokenizer, mel=mel_segment,
+                                    num_frames=segment_size, prepend_punctuations=prepend_punctuations,
+                                    append_punctuations=append_punctuations,
+                                    last_speech_timestamp=last_speech_timestamp)
+                if not single_timestamp_ending:
+                    last_word_end = get_end(current_segments)
+                    if last_word_end is not None and last_word_end > time_offset:
+                        seek = round(last_word_end * FRAMES_PER_SECOND)
+                last_word_end = get_end(current_segments)
+                if last_word_end is not None:
+                    last_speech_timestamp = last_word_end
+
+            if verbose:
+                for segment in current_segments:
+                    line = f"[{format_timestamp(segment['start'])} --> {format_timestamp(segment['end'])}] {segment['text']}"
+                    print(make_safe(line))
+
+            # Instantaneous or empty segments keep their place but lose their content
+            for segment in current_segments:
+                if segment["start"] == segment["end"] or segment["text"].strip() == "":
+                    segment["text"] = ""
+                    segment["tokens"] = []
+                    segment["words"] = []
+
+            all_segments.extend({"id": i, **segment} for i, segment in enumerate(current_segments, start=len(all_segments)))
+            all_tokens.extend(token for segment in current_segments for token in segment["tokens"])
+            if not condition_on_previous_text or result.temperature > 0.5:
+                prompt_reset_since = len(all_tokens)  # Don't prompt with text sampled at a high temperature
+
+            pbar.update(min(content_frames, seek) - previous_seek)
+            if progress_callback is not None:
+                progress_callback(min(1.0, seek / content_frames), list(all_segments))
+
+    return dict(text=tokenizer.decode(all_tokens[len(initial_prompt_tokens):]), segments=all_segments,
+                language=language)
@@ -0,0 +1,150 @@
+# vad.py
+# Voice-activity pre-filter: finds the speech regions of a recording so only those are decoded.
+#
+# Long stretches of silence or hold music cost full 30 s decode windows and make Whisper
+# hallucinate text. The detected regions are cut out and concatenated, the concatenation is
+# transcribed, and segment timestamps are mapped back onto the original recording.
+#
+# Detectors are pluggable: subclass VoiceActivityDetector and register it under a name, which
+# can then be selected with the `vad` form option of /transcribe.
+import os
+
+import numpy as np
+
+VAD_DEFAULT_DETECTOR = os.environ.get('WHISPER_VAD_DETECTOR', 'energy')
+
+
+class VoiceActivityDetector:
+    """Interface of a detector: returns speech regions as [(start_seconds, end_seconds), ...]."""
+
+    def detect(self, audio, sample_rate):
+        raise NotImplementedError
+
+
+class EnergyVAD(VoiceActivityDetector):
+    """
+    Pure-NumPy detector. A frame counts as speech when its energy is `margin_db` above the
+    recording's noise floor (10th percentile of frame energies) and most of its spectral power
+    lies in the speech band. Short gaps are bridged, short blips dropped, and every region is
+    padded so word onsets and endings are not clipped.
+    """
+
+    def __init__(self, frame_seconds=0.03, margin_db=10.0, min_energy_db=-60.0,
+                 speech_band=(300.0, 3400.0), min_band_ratio=0.4,
+                 min_speech_seconds=0.25, min_silence_seconds=0.5, padding_seconds=0.2):
+        self.frame_seconds = frame_seconds
+        self.margin_db = margin_db
+        self.min_energy_db = min_energy_db
+        self.speech_band = speech_band
+        self.min_band_ratio = min_band_ratio
+        self.min_speech_seconds = min_speech_seconds
+        self.min_silence_seconds = min_silence_seconds
+        self.padding_seconds = padding_seconds
+
+    def frame_features(self, audio, sample_rate, block_frames=8192):
+        """Per-frame energy (dB) and fraction of spectral power inside the speech band."""
+        frame_len = max(1, int(sample_rate * self.frame_seconds))
+        n_frames = len(audio) // frame_len
+        frames = np.asarray(audio[:n_frames * frame_len], dtype=np.float32).reshape(n_frames, frame_len)
+        window = np.hanning(frame_len).astype(np.float32)
+        freqs = np.fft.rfftfreq(frame_len, 1.0 / sample_rate)
+        in_band = (freqs >= self.speech_band[0]) & (freqs <= self.speech_band[1])
+
+        energy_db = np.empty(n_frames, dtype=np.float32)
+        band_ratio = np.empty(n_frames, dtype=np.float32)
+        for lo in range(0, n_frames, block_frames):  # Blocks keep the FFT buffers small for long recordings
+            block = frames[lo:lo + block_frames]
+            energy_db[lo:lo + len(block)] = 10.0 * np.log10(np.mean(block * block, axis=1) + 1e-10)
+            power = np.abs(np.fft.rfft(block * window, axis=1)) ** 2
+            band_ratio[lo:lo + len(block)] = power[:, in_band].sum(axis=1) / (power.sum(axis=1) + 1e-10)
+        return energy_db, band_ratio
+
+    def detect(self, audio, sample_rate):
+        duration = len(audio) / sample_rate
+        energy_db, band_ratio = self.frame_features(audio, sample_rate)
+        if len(energy_db) == 0:
+            return []
+        threshold = max(float(np.percentile(energy_db, 10)) + self.margin_db, self.min_energy_db)
+        is_speech = (energy_db > threshold) & (band_ratio > self.min_band_ratio)
+
+        # Runs of speech frames as [start_frame, end_frame)
+        edges = np.diff(np.concatenate(([0], is_speech.astype(np.int8), [0])))
+        runs = zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1))
+        regions = []
+        for start_frame, end_frame in runs:
+            start, end = start_frame * self.frame_seconds, end_frame * self.frame_seconds
+            if regions and start - regions[-1][1] < self.min_silence_seconds:
+                regions[-1][1] = end
+            else:
+                regions.append([start, end])
+
+        padded = []
+        for start, end in regions:
+            if end - start < self.min_speech_seconds:
+                continue
+            start = max(0.0, start - self.padding_seconds)
+            end = min(duration, end + self.padding_seconds)
+            if padded and start <= padded[-1][1]:
+                padded[-1][1] = end
+            else:
+                padded.append([start, end])
+        return [(round(float(start), 3), round(float(end), 3)) for start, end in padded]
+
+
+VAD_DETECTORS = {
+    'energy': EnergyVAD,
+}
+
+
+def register_detector(name, detector_class):
+    VAD_DETECTORS[name] = detector_class
+
+
+def get_detector(name=None):
+    """Detector instance for a registered name (None = WHISPER_VAD_DETECTOR). Raises ValueError if unknown."""
+    name = name or VAD_DEFAULT_DETECTOR
+    if name not in VAD_DETECTORS:
+        raise ValueError(f"Unknown VAD detector '{name}' (available: {', '.join(sorted(VAD_DETECTORS))})")
+    return VAD_DETECTORS[name]()
+
+
+def extract_regions(audio, regions, sample_rate):
+    """
+    Concatenates the speech regions. Returns (speech_audio, timeline) where timeline holds
+    (offset_in_speech_audio, start_in_original, length) for each region, all in seconds.
+    """
+    pieces = []
+    timeline = []
+    offset = 0.0
+    for start, end in regions:
+        piece = audio[int(start * sample_rate):int(end * sample_rate)]
+        pieces.append(piece)
+        timeline.append((offset, start, len(piece) / sample_rate))
+        offset += len(piece) / sample_rate
+    speech_audio = np.concatenate(pieces).astype(np.float32) if pieces else np.zeros(0, dtype=np.float32)
+    return speech_audio, timeline
+
+
+def to_original_time(t, timeline, is_end=False):
+    """
+    Maps a time on the concatenated speech audio back onto the original recording.
+    A time exactly on the seam of two regions is the start of the later region, or with
+    is_end=True (segment and word ends) the end of the earlier one.
+    """
+    offsets = [entry[0] for entry in timeline]
+    index = max(0, int(np.searchsorted(offsets, t, side='left' if is_end else 'right')) - 1)
+    offset, original_start, length = timeline[index]
+    return round(float(original_start + min(max(t - offset, 0.0), length)), 3)
+
+
+def map_segments_to_original(segments, timeline):
+    mapped = []
+    for segment in segments:
+        segment = dict(segment, start=to_original_time(segment["start"], timeline),
+                       end=to_original_time(segment["end"], timeline, is_end=True))
+        if segment.get("words"):
+            segment["words"] = [dict(word, start=to_original_time(word["start"], timeline),
+                                     end=to_original_time(word["end"], timeline, is_end=True))
+                                for word in segment["words"]]
+        mapped.append(segment)
+    return mapped
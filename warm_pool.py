@@ -0,0 +1,182 @@
+# warm_pool.py
+# Warm-pool controller: grows and drains the worker pools from the autoscaling snapshot.
+#
+#   python -m warm_pool                     # one step every WHISPER_WARM_POOL_INTERVAL seconds
+#   python -m warm_pool --once --dry-run    # print the actions of one step without sending them
+#
+# Each step reads the demand/supply snapshot (autoscaling.py). For every model whose warm processes
+# fall short of its target, workers with room below their max_processes start processes that
+# preload it (warm_pool_grow), workers already consuming the model's queue first. The new processes
+# load the model before they take a task. Whatever no worker has room for is reported as scale_out,
+# i.e. more worker hosts are needed (the external scaler's part). Models the controller added that
+# have had no demand for the whole window are released (warm_pool_release).
+#
+# Processes idle for WHISPER_WARM_POOL_IDLE_SECONDS are drained by pid (warm_pool_drain), down to
+# WHISPER_WARM_POOL_MIN_PROCESSES per worker and never below a model's target: cold processes go,
+# the ones holding a model that is still needed stay. The worker only stops a process that runs no
+# task at that moment, and tasks it has prefetched stay unacknowledged (acks_late) until one of its
+# remaining processes has run them, so draining loses no work.
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+from autoscaling import forget_processes
+from celery_worker_app import celery, autoscale_snapshot
+
+logger = logging.getLogger(__name__)
+
+WARM_POOL_INTERVAL = float(os.environ.get('WHISPER_WARM_POOL_INTERVAL', '30'))
+WARM_POOL_IDLE_SECONDS = float(os.environ.get('WHISPER_WARM_POOL_IDLE_SECONDS', '600'))
+WARM_POOL_MIN_PROCESSES = int(os.environ.get('WHISPER_WARM_POOL_MIN_PROCESSES', '1'))
+# How long a requested process counts as warm before its heartbeat shows up (large models load slowly)
+WARM_POOL_GRACE_SECONDS = float(os.environ.get('WHISPER_WARM_POOL_GRACE_SECONDS', '180'))
+
+
+class WarmPoolController:
+    def __init__(self, app=celery, idle_seconds=WARM_POOL_IDLE_SECONDS, min_processes=WARM_POOL_MIN_PROCESSES,
+                 grace_seconds=WARM_POOL_GRACE_SECONDS):
+        self.app = app
+        self.idle_seconds = idle_seconds
+        self.min_processes = min_processes
+        self.grace_seconds = grace_seconds
+        self._pending = []  # (expiry, model, processes, warm processes when requested) of recent grows
+
+    def _pending_processes(self, models, now):
+        """Processes per model requested within the grace period that heartbeats don't show yet."""
+        self._pending = [entry for entry in self._pending if entry[0] > now]
+        pending = {}
+        for _, model_name, processes, warm_before in self._pending:
+            arrived = models.get(model_name, {}).get("warm_processes", 0) - warm_before
+            pending[model_name] = pending.get(model_name, 0) + max(0, processes - arrived)
+        return pending
+
+    def plan(self, snapshot, now=None):
+        """Actions ({"action", "node", "model", "processes", "reason"}) for one step."""
+        now = now or time.time()
+        models = snapshot["models"]
+        pending_models = self._pending_processes(models, now)
+        pending_nodes = {}  # Room taken by this step's grows
+        workers = snapshot["workers"]
+        actions = []
+
+        grown = set()
+        for model_name, stats in models.items():
+            missing = stats["target_processes"] - stats["warm_processes"] - pending_models.get(model_name, 0)
+            if missing <= 0:
+                continue
+            # Workers already consuming the model's queue first, then the ones with the most room
+            candidates = sorted(workers, key=lambda w: (stats["queue"] not in w["queues"],
+                                                        w["processes"] - w["max_processes"]))
+            for worker in candidates:
+                if worker["pool"] == 'prefork':
+                    room = worker["max_processes"] - worker["processes"] - pending_nodes.get(worker["node"], 0)
+                    if not worker.get("resizable", True):  # warm_pool_grow/drain are disabled on this worker
+                        room = 0
+                else:  # -P solo/threads load the model in place
+                    holds = any(model_name in p["models"] for p in worker["process_list"])
+                    room = 0 if holds or model_name in worker["preload"] else 1
+                processes = min(missing, room)
+                if processes <= 0:
+                    continue
+                actions.append({"action": "grow", "node": worker["node"], "model": model_name,
+                                "processes": processes, "warm": stats["warm_processes"], "reason": f"{stats['warm_processes']} warm, "
+                                                                  f"target {stats['target_processes']}"})
+                pending_nodes[worker["node"]] = pending_nodes.get(worker["node"], 0) + processes
+                grown.add(worker["node"])
+                missing -= processes
+                if missing <= 0:
+                    break
+            if missing > 0:
+                actions.append({"action": "scale_out", "node": None, "model": model_name, "processes": missing,
+                                "reason": "no worker has room for more processes"})
+
+        surplus = {m: s["warm_processes"] - s["target_processes"] for m, s in models.items()}
+        for worker in workers:
+            for model_name in worker["warmed"]:
+                if models.get(model_name, {}).get("target_processes", 0) == 0:
+                    actions.append({"action": "release", "node": worker["node"], "model": model_name,
+                                    "processes": 0, "reason": "no demand in the window"})
+            if worker["pool"] != 'prefork' or worker["node"] in grown or not worker.get("resizable", True):
+                continue
+            # The chosen processes themselves are stopped, so the warm ones a model still needs stay
+            drainable = []
+            for process in worker["process_list"]:
+                if process["running"] or process["idle_since"] is None or \
+                        now - process["idle_since"] < self.idle_seconds:
+                    continue
+                if all(surplus.get(m, 1) > 0 for m in process["models"]):
+                    drainable.append(process["pid"])
+                    for model_name in process["models"]:
+                        surplus[model_name] = surplus.get(model_name, 0) - 1
+            drainable = drainable[:max(0, worker["processes"] - self.min_processes)]
+            if drainable:
+                actions.append({"action": "drain", "node": worker["node"], "model": None,
+                                "processes": len(drainable), "pids": drainable,
+                                "reason": f"idle for {int(self.idle_seconds)}s or longer"})
+        return actions
+
+    def apply(self, actions, now=None):
+        """Sends the actions to the workers; returns their replies."""
+        now = now or time.time()
+        replies = []
+        for action in actions:
+            node = action["node"]
+            if action["action"] == 'grow':
+                reply = self.app.control.broadcast('warm_pool_grow', destination=[node], reply=True, timeout=10,
+                                                   arguments={'model_name': action["model"],
+                                                              'n': action["processes"]})
+                self._pending.append((now + self.grace_seconds, action["model"], action["processes"], action["warm"]))
+            elif action["action"] == 'release':
+                reply = self.app.control.broadcast('warm_pool_release', destination=[node], reply=True,
+                                                   arguments={'model_name': action["model"]})
+            elif action["action"] == 'drain':
+                reply = self.app.control.broadcast('warm_pool_drain', destination=[node], reply=True,
+                                                   arguments={'pids': ','.join(str(pid) for pid in action["pids"])})
+                for answer in reply or []:
+                    drained = (answer.get(node) or {}).get('ok')
+                    if isinstance(drained, dict):
+                        forget_processes(node, drained["drained"])
+            else:
+                logger.warning("Warm pool: %s more process(es) needed for '%s', %s.", action["processes"],
+                               action["model"], action["reason"])
+                continue
+            logger.info("Warm pool: %s %s on %s (%s): %s", action["action"], action["model"] or action["processes"],
+                        node, action["reason"], reply)
+            replies.append({"action": action, "reply": reply})
+        return replies
+
+    def step(self, dry_run=False):
+        actions = self.plan(autoscale_snapshot())
+        if not dry_run:
+            self.apply(actions)
+        return actions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Grow and drain worker pools from the autoscaling snapshot.")
+    parser.add_argument('--interval', type=float, default=WARM_POOL_INTERVAL, help="Seconds between steps")
+    parser.add_argument('--once', action='store_true', help="Run a single step and print its actions")
+    parser.add_argument('--dry-run', action='store_true', help="Plan actions without sending them")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    controller = WarmPoolController()
+    while True:
+        try:
+            actions = controller.step(dry_run=args.dry_run)
+            if args.once or args.dry_run:
+                print(json.dumps(actions, indent=2))
+        except Exception as e:
+            logger.error("Warm pool step failed: %s", e)
+            if args.once:
+                raise
+        if args.once:
+            return
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
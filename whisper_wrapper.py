@@ -1,60 +1,417 @@
 import whisper
+import numpy as np
 import os
 import torch
 import io  # For creating in-memory text streams
+import threading
+import time
+import logging
+from collections import OrderedDict
+
+from batching import batch_collector, inference_lock, is_batchable
+from transcribe_loop import transcribe_windows
+from vad import get_detector, extract_regions, map_segments_to_original
+from shared_weights import SHARED_WEIGHTS_ENABLED, load_shared_model
+from audio_store import audio_store
+from speculative import (SPECULATIVE_DEFAULT, draft_model_name, draft_compatible, is_speculable,
+                         speculative_decode)
+from metrics import (stage_timer, observe_stage, observe_inference, MODEL_CACHE_REQUESTS, MODEL_CACHE_EVICTIONS,
+                     MODEL_CACHE_BYTES, MODEL_CACHE_MODELS, SPECULATIVE_DRAFT_TOKENS)
+
+logger = logging.getLogger(__name__)
 
 # Determine default device at module level if not passed explicitly
 DEFAULT_DEVICE_WHISPER = "cuda" if torch.cuda.is_available() else "cpu"
-print(f"Whisper wrapper: Default device set to: {DEFAULT_DEVICE_WHISPER}")
+logger.info("Whisper wrapper: Default device set to: %s", DEFAULT_DEVICE_WHISPER)
 
-# Cache for different models
-model_cache = {}
+# Approximate parameter counts (millions) used to make room *before* a model is loaded,
+# so the cache never holds the old models and the new one at the same time.
+MODEL_PARAM_ESTIMATES_M = {
+    "tiny": 39, "base": 74, "small": 244, "medium": 769,
+    "large": 1550, "large-v1": 1550, "large-v2": 1550, "large-v3": 1550, "turbo": 809,
+}
+
+# RAM budget for cached models in this process, 0 means unbounded (previous behaviour)
+MODEL_CACHE_MAX_MB = int(os.environ.get('WHISPER_MODEL_CACHE_MAX_MB', '0'))
+
+# CPU performance mode
+# WHISPER_CPU_QUANTIZE: comma-separated models (or '*') whose Linear layers are dynamically quantized
+#   to INT8 when loaded on the CPU. Empty (default) keeps fp32 weights.
+# WHISPER_TORCH_THREADS: intra-op threads per worker process. 'auto' (default) divides the usable
+#   cores among the prefork children, a number pins it, '0' leaves torch's default.
+CPU_QUANTIZE_MODELS = [m.strip() for m in os.environ.get('WHISPER_CPU_QUANTIZE', '').split(',') if m.strip()]
+TORCH_THREADS = os.environ.get('WHISPER_TORCH_THREADS', 'auto').strip().lower()
+
+
+def model_footprint_bytes(model):
+    """Bytes held by the model's weights and buffers (quantized weights are packed outside parameters())."""
+    total = 0
+    for value in model.state_dict(keep_vars=True).values():
+        for tensor in (value if isinstance(value, (tuple, list)) else (value,)):
+            if isinstance(tensor, torch.Tensor):
+                total += tensor.numel() * tensor.element_size()
+    return total
+
+
+def quantization_enabled(model_name, device):
+    return device == "cpu" and ('*' in CPU_QUANTIZE_MODELS or model_name in CPU_QUANTIZE_MODELS)
+
+
+def quantize_model_int8(model):
+    """Dynamic INT8 quantization of all Linear layers (weights int8, activations quantized per batch), in place."""
+    for module in model.modules():
+        # whisper.model.Linear only adds dtype casting for fp16; quantize_dynamic matches exact types
+        if type(module) is whisper.model.Linear:
+            module.__class__ = torch.nn.Linear
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def model_cache_key(model_name, device, quantized=False):
+    return f"{model_name}_{device}_int8" if quantized else f"{model_name}_{device}"
+
+
+def configure_torch_threads(processes=1):
+    """Sets torch's intra-op thread count for this process so `processes` workers don't oversubscribe the CPU."""
+    if TORCH_THREADS == '0':
+        return torch.get_num_threads()
+    if TORCH_THREADS == 'auto':
+        cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+        threads = max(1, cores // max(1, processes))
+    else:
+        threads = max(1, int(TORCH_THREADS))
+    torch.set_num_threads(threads)
+    return threads
+
+
+def estimate_footprint_bytes(model_name):
+    base_name = model_name.split(".")[0]  # 'base.en' -> 'base'
+    params_m = MODEL_PARAM_ESTIMATES_M.get(base_name)
+    return params_m * 1_000_000 * 4 if params_m else 0  # fp32 weights
+
+
+class ModelCache:
+    """
+    LRU cache of loaded Whisper models bounded by a memory budget.
+
+    Pinned entries (the preloaded default) are never evicted. Loads are single-flight:
+    concurrent requests for the same uncached key wait for one load instead of each
+    loading their own copy.
+    """
+
+    def __init__(self, max_bytes=0):
+        self.max_bytes = max_bytes  # 0 = unbounded
+        self._models = OrderedDict()  # cache_key -> (model, footprint_bytes)
+        self._pinned = set()
+        self._lock = threading.RLock()
+        self._load_locks = {}  # cache_key -> [Lock held while that key is being loaded, callers using it]
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def __contains__(self, cache_key):
+        with self._lock:
+            return cache_key in self._models
+
+    def __len__(self):
+        with self._lock:
+            return len(self._models)
+
+    def keys(self):
+        with self._lock:
+            return list(self._models.keys())
+
+    def get(self, cache_key):
+        with self._lock:
+            entry = self._models.get(cache_key)
+            if entry is None:
+                return None
+            self._models.move_to_end(cache_key)
+            self.hits += 1
+        MODEL_CACHE_REQUESTS.labels('hit').inc()
+        return entry[0]
+
+    def occupied_bytes(self):
+        with self._lock:
+            return sum(footprint for _, footprint in self._models.values())
+
+    def pin(self, cache_key):
+        with self._lock:
+            self._pinned.add(cache_key)
+
+    def unpin(self, cache_key):
+        with self._lock:
+            self._pinned.discard(cache_key)
+
+    def get_or_load(self, cache_key, loader, estimated_bytes=0):
+        """Returns the cached model or calls loader() exactly once per key across threads."""
+        model = self.get(cache_key)
+        if model is not None:
+            return model
+
+        with self._lock:
+            entry = self._load_locks.setdefault(cache_key, [threading.Lock(), 0])
+            entry[1] += 1
+            key_lock = entry[0]
+        try:
+            with key_lock:
+                model = self.get(cache_key)  # Another thread may have finished loading meanwhile
+                if model is not None:
+                    return model
+                with self._lock:
+                    self.misses += 1
+                MODEL_CACHE_REQUESTS.labels('miss').inc()
+                self._make_room(estimated_bytes)
+                model = loader()
+                if model is not None:
+                    self.put(cache_key, model)
+                return model
+        finally:
+            # The last caller drops the lock; popping it earlier would let a newcomer start a second load
+            # while a waiter (after a failed load) is still loading under the old lock
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0 and self._load_locks.get(cache_key) is entry:
+                    del self._load_locks[cache_key]
+
+    def put(self, cache_key, model):
+        footprint = model_footprint_bytes(model)
+        with self._lock:
+            self._models.pop(cache_key, None)
+            self._make_room(footprint)
+            self._models[cache_key] = (model, footprint)
+            self.loads += 1
+        self._report_occupancy()
+
+    def evict(self, cache_key):
+        with self._lock:
+            entry = self._models.pop(cache_key, None)
+            self._pinned.discard(cache_key)
+        if entry is not None:
+            self._release(cache_key, entry[0])
+            self._report_occupancy()
+
+    def _make_room(self, needed_bytes):
+        if not self.max_bytes:
+            return
+        released = []
+        with self._lock:
+            occupied = sum(footprint for _, footprint in self._models.values())
+            for cache_key in list(self._models.keys()):  # Oldest first
+                if occupied + needed_bytes <= self.max_bytes:
+                    break
+                if cache_key in self._pinned:
+                    continue
+                model, footprint = self._models.pop(cache_key)
+                occupied -= footprint
+                self.evictions += 1
+                MODEL_CACHE_EVICTIONS.inc()
+                released.append((cache_key, model))
+        for cache_key, model in released:
+            self._release(cache_key, model)
+        if released:
+            self._report_occupancy()
 
+    def _report_occupancy(self):
+        with self._lock:
+            occupied, count = sum(footprint for _, footprint in self._models.values()), len(self._models)
+        MODEL_CACHE_BYTES.set(occupied)
+        MODEL_CACHE_MODELS.set(count)
 
-def load_whisper_model(model_name="base", device=None):
-    global model_cache
+    @staticmethod
+    def _release(cache_key, model):
+        logger.info("Evicting Whisper model '%s' from RAM cache.", cache_key)
+        device_type = model.device.type
+        del model
+        if device_type == "cuda":
+            torch.cuda.empty_cache()
 
+    def stats(self):
+        with self._lock:
+            return {
+                "models": {key: footprint for key, (_, footprint) in self._models.items()},
+                "pinned": sorted(self._pinned),
+                "occupied_bytes": sum(footprint for _, footprint in self._models.values()),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
+
+
+# Cache for different models
+model_cache = ModelCache(max_bytes=MODEL_CACHE_MAX_MB * 1024 * 1024)
+
+
+def load_whisper_model(model_name="base", device=None, pin=False, quantize=None):
+    """
+    Returns a cached Whisper model, loading it on first use.
+    pin=True keeps the model resident regardless of the cache budget (used for preloaded models).
+    quantize: INT8 CPU inference; None follows WHISPER_CPU_QUANTIZE. Quantized models have their own cache key.
+    """
     # Determine effective device for this load attempt
     # If a device is passed, use it; otherwise, use the module's default.
     effective_device = device if device is not None else DEFAULT_DEVICE_WHISPER
+    quantized = quantization_enabled(model_name, effective_device) if quantize is None else (
+        bool(quantize) and effective_device == "cpu")
 
-    cache_key = f"{model_name}_{effective_device}"  # Device-specific cache key
+    cache_key = model_cache_key(model_name, effective_device, quantized)  # Device-specific cache key
 
-    if cache_key in model_cache:
-        print(f"Using cached Whisper model: {model_name} on {effective_device} (from RAM cache).")
-        return model_cache[cache_key]
+    cached_model = model_cache.get(cache_key)
+    if cached_model is not None:
+        logger.debug("Using cached Whisper model: %s on %s (from RAM cache).", model_name, effective_device)
+        if pin:
+            model_cache.pin(cache_key)
+        return cached_model
+
+    def load_on_device(target_device, int8=False):
+        logger.info("Attempting to load Whisper model: %s for device: %s%s...", model_name, target_device,
+                    " (INT8)" if int8 else "")
+        model = None
+        if SHARED_WEIGHTS_ENABLED:
+            try:
+                model = load_shared_model(model_name, device=target_device)
+            except Exception as e:
+                logger.warning("Shared weights of '%s' unavailable (%s), loading a private copy.", model_name, e)
+        if model is None:
+            model = whisper.load_model(model_name, device=target_device)
+        return quantize_model_int8(model) if int8 else model
 
-    print(f"Attempting to load Whisper model: {model_name} for device: {effective_device}...")
     current_model = None
     try:
-        current_model = whisper.load_model(model_name, device=effective_device)
-        model_cache[cache_key] = current_model
-        print(f"Model '{model_name}' loaded successfully on {effective_device} and cached in RAM.")
+        current_model = model_cache.get_or_load(cache_key, lambda: load_on_device(effective_device, quantized),
+                                                estimated_bytes=estimate_footprint_bytes(model_name))
+        logger.info("Model '%s' loaded successfully on %s and cached in RAM.", model_name, effective_device)
+        if pin:
+            model_cache.pin(cache_key)
     except Exception as e:
-        print(f"Error loading model '{model_name}' on primary device '{effective_device}': {e}")
+        logger.error("Error loading model '%s' on primary device '%s': %s", model_name, effective_device, e)
         # Fallback logic if primary device fails (e.g., if CUDA was attempted and failed)
         if effective_device == "cuda":
-            print(f"Attempting to load model '{model_name}' on CPU as fallback...")
+            logger.warning("Attempting to load model '%s' on CPU as fallback...", model_name)
             try:
-                cpu_cache_key = f"{model_name}_cpu"
-                if cpu_cache_key in model_cache:  # Check if already CPU cached
-                    print(f"Using cached Whisper model: {model_name} on cpu (from RAM cache after CUDA fail).")
-                    return model_cache[cpu_cache_key]
-
-                current_model = whisper.load_model(model_name, device="cpu")
-                model_cache[cpu_cache_key] = current_model  # Cache it under CPU key
-                print(f"Model '{model_name}' loaded successfully on CPU (fallback) and cached in RAM.")
+                cpu_quantized = quantization_enabled(model_name, "cpu") if quantize is None else bool(quantize)
+                cpu_cache_key = model_cache_key(model_name, "cpu", cpu_quantized)  # Cache it under CPU key
+                current_model = model_cache.get_or_load(cpu_cache_key, lambda: load_on_device("cpu", cpu_quantized),
+                                                        estimated_bytes=estimate_footprint_bytes(model_name))
+                logger.info("Model '%s' loaded successfully on CPU (fallback) and cached in RAM.", model_name)
+                if pin:
+                    model_cache.pin(cpu_cache_key)
             except Exception as e_cpu:
-                print(f"Error loading model '{model_name}' on CPU (fallback): {e_cpu}")
+                logger.error("Error loading model '%s' on CPU (fallback): %s", model_name, e_cpu)
                 # If all attempts fail, current_model remains None
         # If initial attempt was CPU and failed, current_model is already None
 
     if current_model is None:
-        print(f"Failed to load model '{model_name}' on any attempted device.")
+        logger.error("Failed to load model '%s' on any attempted device.", model_name)
 
     return current_model
 
 
+def is_model_loaded(model_name, device=None):
+    """True if load_whisper_model would answer from the cache (with the same device/INT8 choice)."""
+    device = device if device is not None else DEFAULT_DEVICE_WHISPER
+    return model_cache_key(model_name, device, quantization_enabled(model_name, device)) in model_cache
+
+
+# Decoded audio handed between processes: raw little-endian float32 mono samples at Whisper's 16 kHz
+PCM_SUFFIX = '.f32'
+SAMPLE_RATE = whisper.audio.SAMPLE_RATE
+
+
+def save_pcm(path, audio):
+    np.asarray(audio, dtype='<f4').tofile(path)
+
+
+def load_pcm(path):
+    return np.fromfile(path, dtype='<f4')
+
+
+def load_audio_samples(audio_path, audio_id=None):
+    """
+    16 kHz mono float32 samples for an upload (decoded through ffmpeg) or an already decoded PCM file.
+    audio_id: the upload's id in the audio store; stored samples are reused, new ones are kept there.
+    """
+    if audio_path.endswith(PCM_SUFFIX):
+        return load_pcm(audio_path)
+    if audio_id:
+        samples = audio_store.load_pcm(audio_id)
+        if samples is not None:
+            return samples
+    samples = whisper.load_audio(audio_path, sr=SAMPLE_RATE)
+    if audio_id:
+        audio_store.save_pcm(audio_id, samples)
+    return samples
+
+
+# --- Progress reporting ---
+# transcribe_windows calls progress_callback(fraction_done, segments_so_far) after every decoded
+# 30 s window; a failing callback (e.g. Redis down) must not fail the transcription.
+def _guarded_progress(callback):
+    if callback is None:
+        return None
+
+    def report(fraction, segments):
+        try:
+            callback(fraction, segments)
+        except Exception as e:
+            logger.warning("Progress callback failed: %s", e)
+    return report
+
+
+# --- Stored log-mel spectrograms ---
+# The window loop (transcribe_loop.py) slices the spectrogram of the whole (padded) recording. With
+# an audio_id it is read from the audio store, or computed once and kept there, so a rerun with
+# another model or task skips the STFT.
+def transcription_mel(audio, n_mels, audio_id=None, device=None):
+    """Log-mel spectrogram of `audio` padded with 30 s of silence, as transcribe_windows slices it."""
+    if audio_id is None:
+        return whisper.log_mel_spectrogram(audio, n_mels, padding=whisper.audio.N_SAMPLES, device=device)
+    stored = audio_store.load_mel(audio_id, n_mels)
+    if stored is not None:
+        mel = torch.from_numpy(stored)
+        return mel.to(device) if device is not None else mel
+    mel = whisper.log_mel_spectrogram(audio, n_mels, padding=whisper.audio.N_SAMPLES, device=device)
+    audio_store.save_mel(audio_id, n_mels, mel.cpu().numpy())
+    return mel
+
+
+# --- Speculative decoding ---
+# Requests with a draft model hand transcribe_windows a decode_window that decodes greedy windows
+# through speculative.speculative_decode; nothing is patched for other requests. If the draft uses
+# another number of mel bins, it reads the same frames of its own spectrogram of the audio.
+def speculative_window_decoder(model, draft, audio, audio_id=None):
+    """(decode_window for transcribe_windows, acceptance stats it accumulates) for `model` drafted by `draft`."""
+    draft_mel = None
+    if draft.dims.n_mels != model.dims.n_mels:  # Same padding as the target's spectrogram (stored if possible)
+        draft_mel = transcription_mel(audio, draft.dims.n_mels, audio_id)
+    stats = {"drafted": 0, "accepted": 0, "passes": 0, "tokens": 0}
+
+    def decode_window(segment, options, seek):
+        if not is_speculable(options):  # Temperature fallback samples as usual
+            return model.decode(segment, options)
+        draft_segment = segment
+        if draft_mel is not None:
+            size = min(whisper.audio.N_FRAMES, draft_mel.shape[-1] - whisper.audio.N_FRAMES - seek)
+            draft_segment = whisper.pad_or_trim(draft_mel[:, seek:seek + size], whisper.audio.N_FRAMES)
+        return speculative_decode(model, draft, segment, draft_segment, options, stats)
+    return decode_window, stats
+
+
+def load_draft_model(model_name, model):
+    """The draft model for `model` from the model cache, or None if it can't speed it up."""
+    draft_name = draft_model_name(model_name)
+    if draft_name == model_name:
+        return None
+    with stage_timer('model_load', draft_name, model.device.type):
+        draft = load_whisper_model(model_name=draft_name, device=model.device.type)
+    if draft is None or not draft_compatible(model, draft):
+        logger.warning("Draft model '%s' is not usable for '%s', decoding without it.", draft_name, model_name)
+        return None
+    return draft
+
+
 def format_timestamp(seconds: float, always_include_hours: bool = False, decimal_marker: str = '.'):
     assert seconds >= 0, "non-negative timestamp expected"
     milliseconds = round(seconds * 1000.0)
@@ -70,10 +427,11 @@ def format_timestamp(seconds: float, always_include_hours: bool = False, decimal
         return f"{minutes:02d}:{seconds_val:02d}{decimal_marker}{milliseconds:03d}"
 
 
-def to_srt(result_segments, as_dict=False):
+def to_srt(result_segments, as_dict=False, start_index=0):
+    # start_index: number of segments already rendered, so a partial transcript can be continued
     if not as_dict:
         srt_io = io.StringIO()
-        for i, segment in enumerate(result_segments):
+        for i, segment in enumerate(result_segments, start=start_index):
             srt_io.write(f"{i + 1}\n")
             srt_io.write(f"{format_timestamp(segment['start'], always_include_hours=True, decimal_marker=',')} --> ")
             srt_io.write(f"{format_timestamp(segment['end'], always_include_hours=True, decimal_marker=',')}\n")
@@ -81,7 +439,7 @@ def to_srt(result_segments, as_dict=False):
         return srt_io.getvalue()
     else:
         srt_dict = {}
-        for i, segment in enumerate(result_segments):
+        for i, segment in enumerate(result_segments, start=start_index):
             timestamp_line = (
                 f"{format_timestamp(segment['start'], always_include_hours=True, decimal_marker=',')} --> "
                 f"{format_timestamp(segment['end'], always_include_hours=True, decimal_marker=',')}")
@@ -89,10 +447,11 @@ def to_srt(result_segments, as_dict=False):
         return srt_dict
 
 
-def to_vtt(result_segments, as_dict=False):
+def to_vtt(result_segments, as_dict=False, start_index=0):
     if not as_dict:
         vtt_io = io.StringIO()
-        vtt_io.write("WEBVTT\n\n")
+        if start_index == 0:  # Continuations of a partial transcript don't repeat the header
+            vtt_io.write("WEBVTT\n\n")
         for segment in result_segments:
             vtt_io.write(
                 f"{format_timestamp(segment['start'], decimal_marker='.')} --> {format_timestamp(segment['end'], decimal_marker='.')}\n")
@@ -103,15 +462,16 @@ def to_vtt(result_segments, as_dict=False):
         # VTT doesn't typically have sequence numbers in the content body like SRT dict keys,
         # but for consistency with the requested SRT dict structure, we'll use segment index as key.
         # The "WEBVTT" header is for the string format, not the dict.
-        for i, segment in enumerate(result_segments):
+        for i, segment in enumerate(result_segments, start=start_index):
             timestamp_line = f"{format_timestamp(segment['start'], decimal_marker='.')} --> {format_timestamp(segment['end'], decimal_marker='.')}"
             vtt_dict[str(i + 1)] = [timestamp_line, segment['text'].strip()]
         return vtt_dict
 
 
-def to_tsv(result_segments):  # TSV is always a string
+def to_tsv(result_segments, start_index=0):  # TSV is always a string
     tsv_content = io.StringIO()
-    tsv_content.write("start\tend\ttext\n")  # Header
+    if start_index == 0:
+        tsv_content.write("start\tend\ttext\n")  # Header
     for segment in result_segments:
         start_ms = int(segment['start'] * 1000)
         end_ms = int(segment['end'] * 1000)
@@ -119,21 +479,59 @@ def to_tsv(result_segments):  # TSV is always a string
     return tsv_content.getvalue()
 
 
+def format_transcription_result(raw_result, output_format='json', simplified=False, start_index=0):
+    """
+    Builds the `result` field of a /status response from a Whisper result.
+    start_index > 0 renders only the segments after that index (incremental partial transcripts).
+    """
+    formatted_output = None
+    if raw_result and ("text" in raw_result or "segments" in raw_result):
+        if output_format == 'txt':
+            formatted_output = raw_result.get("text", "")
+        elif output_format == 'srt' and "segments" in raw_result:
+            formatted_output = to_srt(raw_result["segments"], as_dict=simplified, start_index=start_index)
+        elif output_format == 'vtt' and "segments" in raw_result:
+            formatted_output = to_vtt(raw_result["segments"], as_dict=simplified, start_index=start_index)
+        elif output_format == 'tsv' and "segments" in raw_result:
+            formatted_output = to_tsv(raw_result["segments"], start_index=start_index)
+        elif output_format == 'json':
+            if simplified:
+                formatted_output = raw_result.get("text", "")
+            else: # Full JSON for non-simplified
+                return {"transcription_details": raw_result}
+        else:
+            formatted_output = raw_result # Fallback to raw result
+
+    if simplified and output_format != 'json': # JSON simplified is handled
+        return {"formatted_output": formatted_output}
+    elif not simplified and output_format != 'json': # Full output
+        return {"transcription_details": raw_result, "formatted_output": formatted_output}
+    elif simplified and output_format == 'json':
+        return {"formatted_output": formatted_output}
+    return None
+
+
 def transcribe_audio(audio_path, model_name="base", task="transcribe", language=None,
                      initial_prompt=None, temperature=0.0, best_of=5,
-                     word_timestamps=False, verbose=None):
+                     word_timestamps=False, verbose=None, progress_callback=None, vad=None, audio_id=None,
+                     speculative=None):
+    # progress_callback(fraction_done, segments_so_far) is called after every decoded 30 s window.
+    # vad: name of a VAD detector (see vad.py); only the detected speech regions are then decoded.
+    # audio_id: id of the audio in the audio store; its decoded PCM and log-mel spectrogram are reused.
+    # speculative: greedy windows are decoded with a draft model (see speculative.py); None follows WHISPER_SPECULATIVE.
     # Model will be loaded for CUDA if available, else CPU, by load_whisper_model's default behavior
-    loaded_model = load_whisper_model(model_name=model_name)
+    with stage_timer('model_load', model_name, DEFAULT_DEVICE_WHISPER):  # Cache hits take microseconds
+        loaded_model = load_whisper_model(model_name=model_name)
 
     if not loaded_model:
-        # load_whisper_model now prints detailed errors.
+        # load_whisper_model now logs detailed errors.
         return {"error": f"Whisper model '{model_name}' could not be loaded (check logs for details)."}
 
     # Determine the actual device the model was loaded on for fp16 setting
     # This requires the model object to store its device, or infer it.
     # Whisper model objects have a `device` attribute.
     actual_model_device_type = loaded_model.device.type
-    print(f"Model '{model_name}' will be used on device: {actual_model_device_type}")
+    logger.debug("Model '%s' will be used on device: %s", model_name, actual_model_device_type)
 
     if not os.path.exists(audio_path):
         return {"error": "Audio file not found."}
@@ -153,13 +551,69 @@ def transcribe_audio(audio_path, model_name="base", task="transcribe", language=
     # ... (type conversion for temp and best_of) ...
 
     try:
-        print(f"Transcribing {audio_path} with options: {transcribe_options} using model on {actual_model_device_type}")
-        result = loaded_model.transcribe(audio_path, **transcribe_options)
-        print("Transcription successful.")
+        logger.info("Transcribing %s with options: %s using model on %s",
+                    audio_path, transcribe_options, actual_model_device_type)
+        # Decoded here rather than inside Whisper so the decode is timed separately; PCM files skip ffmpeg
+        with stage_timer('audio_decode', model_name, actual_model_device_type):
+            audio_input = load_audio_samples(audio_path, audio_id)
+        timeline = None
+        if vad:
+            with stage_timer('vad', model_name, actual_model_device_type):
+                samples = audio_input
+                regions = get_detector(vad).detect(samples, SAMPLE_RATE)
+                audio_input, timeline = extract_regions(samples, regions, SAMPLE_RATE)
+            vad_skipped_seconds = round((len(samples) - len(audio_input)) / SAMPLE_RATE, 3)
+            logger.info("VAD '%s': %d speech regions, skipping %.1fs of %.1fs",
+                        vad, len(regions), vad_skipped_seconds, len(samples) / SAMPLE_RATE)
+            if len(audio_input) == 0:
+                return {"text": "", "segments": [], "language": language, "vad_skipped_seconds": vad_skipped_seconds}
+            if progress_callback is not None:  # Partial segments are reported on the original timeline too
+                report_progress = progress_callback
+                progress_callback = lambda fraction, segments: report_progress(
+                    fraction, map_segments_to_original(segments, timeline))
+
+        draft_model = None
+        if (SPECULATIVE_DEFAULT if speculative is None else speculative) and (
+                temperature is None or float(temperature) == 0.0):
+            draft_model = load_draft_model(model_name, loaded_model)
+
+        result = None
+        inference_started = time.perf_counter()
+        if (draft_model is None and batch_collector.window_seconds > 0
+                and is_batchable(audio_input, temperature, word_timestamps)):
+            batch_key = (id(loaded_model), task, language, initial_prompt)
+            result = batch_collector.submit(batch_key, loaded_model, audio_input, task=task,
+                                            language=language, initial_prompt=initial_prompt)
+            logger.info("Transcription successful (batched).")
+            if progress_callback is not None:
+                progress_callback(1.0, result["segments"])
+        if result is None:
+            transcribe_options["progress_callback"] = _guarded_progress(progress_callback)
+            mel_audio_id = audio_id if timeline is None else None  # VAD decodes a different signal
+            transcribe_options["mel"] = transcription_mel(audio_input, loaded_model.dims.n_mels, mel_audio_id)
+            with inference_lock(loaded_model):
+                if draft_model is None:
+                    result = transcribe_windows(loaded_model, audio_input, **transcribe_options)
+                else:
+                    decode_window, stats = speculative_window_decoder(loaded_model, draft_model, audio_input,
+                                                                      mel_audio_id)
+                    result = transcribe_windows(loaded_model, audio_input, decode_window=decode_window,
+                                                **transcribe_options)
+                    SPECULATIVE_DRAFT_TOKENS.labels(model_name, 'accepted').inc(stats["accepted"])
+                    SPECULATIVE_DRAFT_TOKENS.labels(model_name, 'rejected').inc(stats["drafted"] - stats["accepted"])
+                    logger.info("Speculative decoding: %d of %d draft tokens accepted, %d passes of '%s' for %d tokens",
+                                stats["accepted"], stats["drafted"], stats["passes"], model_name, stats["tokens"])
+            logger.info("Transcription successful.")
+        inference_seconds = time.perf_counter() - inference_started
+        observe_stage('inference', inference_seconds, model_name, actual_model_device_type)
+        observe_inference(model_name, actual_model_device_type, inference_seconds, len(audio_input) / SAMPLE_RATE)
+
+        if timeline is not None:
+            result["segments"] = map_segments_to_original(result["segments"], timeline)
+            result["vad_skipped_seconds"] = vad_skipped_seconds
         return result
     except Exception as e:
-        import traceback
-        print(f"Error during transcription: {e}\n{traceback.format_exc()}")
+        logger.exception("Error during transcription: %s", e)
         return {"error": str(e)}
 
 # (Keep the if __name__ == '__main__': block for direct testing if desired)
\ No newline at end of file